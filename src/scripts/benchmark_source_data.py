@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""benchmark the generate_source_data_* scripts on synthetic results trees, at increasing scale.
+
+For each scale, written as '{n_nets}x{n_replicates}', e.g. '10x32' for 10 architectures with 32 replicates each,
+makes a results tree for each experiment with make_synthetic_results.py,
+then runs the ``main`` function of each script on it, in the order that runall.sh runs them,
+so that scripts that use the output of other scripts find it.
+Each script runs in its own process, so peak memory (maximum resident set size) isn't inflated
+by earlier scripts, and measures:
+- import_sec: importing the script, including e.g. searchnets, which some scripts import
+- wall_sec and cpu_sec: running ``main``
+- peak_rss_mb: maximum resident set size of the process, and peak_main_mb, the increase while running ``main``
+- tracemalloc_peak_mb: peak memory allocated by Python while running ``main``, only with --tracemalloc,
+  since tracing slows scripts down
+along with the size of the results tree the script reads.
+
+Results are appended to a .csv with the host, versions, and git commit.
+With more than one scale, prints how each script scales: the exponent k in wall_sec ~ (n_nets * n_replicates) ** k,
+fit to the runs of this invocation.
+
+Run from the root of the repository, since the scripts find it with pyprojroot.
+"""
+from argparse import ArgumentParser
+import contextlib
+import importlib.util
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import queue
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyprojroot
+
+import make_synthetic_results
+
+HERE = Path(__file__).parent
+ROOT = pyprojroot.here()
+RESULTS_CSV = ROOT.joinpath('results', 'benchmarks', 'source_data_scripts.csv')
+
+EXPERIMENTS = make_synthetic_results.EXPERIMENTS
+SCALES = ['4x4', '4x8', '10x32']
+METHODS = make_synthetic_results.METHODS
+MODES = ['classify']
+LOSS_FUNCS = make_synthetic_results.LOSS_FUNCS
+POLL_SEC = 1.
+
+# in the order runall.sh runs them
+SCRIPTS = {
+    'searchstims': [
+        'experiment-1-searchstims/generate_source_data_csv.py',
+        'experiment-1-searchstims/generate_source_data_test_results.py',
+        'experiment-1-searchstims/generate_source_data_training_histories_csv.py',
+    ],
+    'VSD': [
+        'experiment-2-VSD/generate_source_data_test_results.py',
+        'experiment-2-VSD/generate_source_data_acc_vsd_corr.py',
+        'experiment-2-VSD/generate_source_data_test_acc_v_r_coeff.py',
+        'experiment-2-VSD/generate_source_data_training_histories_csv.py',
+    ],
+}
+
+
+def get_main_kwargs(script, tree_root, net_names):
+    """keyword arguments for ``main`` of script, to run it on the synthetic results tree in tree_root"""
+    source_data_root = tree_root.joinpath('source_data')
+    if script == 'experiment-1-searchstims/generate_source_data_csv.py':
+        return dict(results_gz_root=tree_root.joinpath('results_gz'),
+                    source_data_root=source_data_root,
+                    all_csv_filename='all.csv',
+                    acc_diff_csv_filename='acc_diff.csv',
+                    stim_acc_diff_csv_filename='stim_acc_diff.csv',
+                    net_acc_diff_csv_filename='net_acc_diff.csv',
+                    acc_diff_by_stim_csv_filename='acc_diff_by_stim.csv',
+                    net_names=net_names,
+                    methods=METHODS,
+                    modes=MODES,
+                    alexnet_split_csv_path=tree_root.joinpath('split.csv'),
+                    VGG16_split_csv_path=tree_root.joinpath('split.csv'))
+    elif script == 'experiment-1-searchstims/generate_source_data_test_results.py':
+        return dict(test_results_root=tree_root.joinpath('results_gz'),
+                    source_data_root=source_data_root,
+                    all_test_results_csv_filename='all_test_results.csv')
+    elif script == 'experiment-1-searchstims/generate_source_data_training_histories_csv.py':
+        return dict(ckpt_root=tree_root.joinpath('checkpoints'),
+                    source_data_root=source_data_root,
+                    csv_filename='training_history.csv',
+                    net_names=net_names,
+                    methods=METHODS,
+                    modes=MODES)
+    elif script == 'experiment-2-VSD/generate_source_data_test_results.py':
+        return dict(test_results_root=tree_root.joinpath('test_results'),
+                    source_data_root=source_data_root,
+                    all_test_results_csv_filename='all_test_results.csv',
+                    long_test_results_csv_filename='all_test_results_long_form.csv')
+    elif script == 'experiment-2-VSD/generate_source_data_acc_vsd_corr.py':
+        return dict(test_results_root=tree_root.joinpath('test_results'),
+                    source_data_root=source_data_root,
+                    accuracy_csv_filename='acc.csv',
+                    rm_corr_csv_filename='rm_corr.csv')
+    elif script == 'experiment-2-VSD/generate_source_data_test_acc_v_r_coeff.py':
+        return dict(source_data_root=source_data_root,
+                    rm_corr_csv_path='8-bins-quantile-strategy/rm_corr.csv',
+                    test_results_csv_path='test_results_table_transfer.csv',
+                    test_acc_v_r_coeff_csv_filename='acc_v_r_coeff.csv')
+    elif script == 'experiment-2-VSD/generate_source_data_training_histories_csv.py':
+        return dict(ckpt_root=tree_root.joinpath('checkpoints'),
+                    source_data_root=source_data_root,
+                    csv_filename='training_history.csv',
+                    net_names=net_names,
+                    methods=METHODS,
+                    modes=MODES,
+                    # as in the names of the checkpoint directories
+                    loss_funcs=[loss_func.replace('-', '_') for loss_func in LOSS_FUNCS])
+    else:
+        raise ValueError(
+            f'no arguments defined for script: {script}'
+        )
+
+
+def parse_scale(scale):
+    """parse scale written as '{n_nets}x{n_replicates}'"""
+    try:
+        n_nets, n_replicates = (int(n) for n in scale.split('x'))
+    except ValueError:
+        raise ValueError(
+            f"invalid scale: {scale}, should be written as '{{n_nets}}x{{n_replicates}}', e.g. '10x32'"
+        )
+    return n_nets, n_replicates
+
+
+def max_rss_mb():
+    """maximum resident set size of this process so far, in megabytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+def cpu_sec():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def tree_mb(root):
+    return sum(path.stat().st_size for path in Path(root).rglob('*') if path.is_file()) / 2 ** 20
+
+
+def measure(script, kwargs, trace, results):
+    """target of measurement process: import script, run its main, and put result in results queue"""
+    try:
+        path = HERE.joinpath(script)
+        sys.path.insert(0, str(path.parent))
+        tic = time.perf_counter()
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        import_sec = time.perf_counter() - tic
+
+        max_rss_before = max_rss_mb()
+        if trace:
+            tracemalloc.start()
+        cpu_before = cpu_sec()
+        tic = time.perf_counter()
+        # scripts print progress, e.g. once per replicate
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            module.main(**kwargs)
+        result = dict(import_sec=import_sec,
+                      wall_sec=time.perf_counter() - tic,
+                      cpu_sec=cpu_sec() - cpu_before,
+                      peak_rss_mb=max_rss_mb(),
+                      peak_main_mb=max_rss_mb() - max_rss_before)
+        if trace:
+            result['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        results.put(result)
+    except Exception as e:
+        results.put(dict(error=repr(e)))
+
+
+def get_result(process, results):
+    """get the result that process puts in results queue, or an error if process exits without putting one,
+    e.g. when it is killed for using too much memory"""
+    while True:
+        try:
+            return results.get(timeout=POLL_SEC)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    # result may have been put just before process exited
+    try:
+        return results.get(timeout=POLL_SEC)
+    except queue.Empty:
+        return dict(error=f'script process exited with code {process.exitcode} without a result')
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(host=socket.gethostname(),
+                python=platform.python_version(),
+                pandas=pd.__version__,
+                commit=commit,
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def scaling(df):
+    """exponent k in wall_sec ~ (n_nets * n_replicates) ** k for each script, fit by least squares on log-log"""
+    df = df[df['wall_sec'].notna()]
+    rows = []
+    for (experiment, script), df_script in df.groupby(['experiment', 'script']):
+        n_models = df_script['n_nets'] * df_script['n_replicates']
+        if n_models.nunique() < 2:
+            continue
+        k = np.polyfit(np.log(n_models), np.log(df_script['wall_sec']), 1)[0]
+        largest = df_script.loc[n_models.idxmax()]
+        rows.append(dict(experiment=experiment, script=script, exponent=k,
+                         largest_scale=largest['scale'], wall_sec=largest['wall_sec'],
+                         peak_rss_mb=largest['peak_rss_mb']))
+    return pd.DataFrame.from_records(rows)
+
+
+def main(scales=SCALES,
+         experiments=EXPERIMENTS,
+         scripts=None,
+         history_format='tfevents',
+         n_steps=make_synthetic_results.N_STEPS,
+         trees_root=None,
+         trace=False,
+         results_csv=RESULTS_CSV):
+    """benchmark generate_source_data_* scripts on synthetic results trees, and append results to a .csv
+
+    Parameters
+    ----------
+    scales : list
+        of str, '{n_nets}x{n_replicates}'. Default is ['4x4', '4x8', '10x32'].
+    experiments : list
+        of str, any of {'searchstims', 'VSD'}. Default is both.
+    scripts : list
+        of str, names of scripts to run, e.g. 'generate_source_data_csv.py'.
+        Default is None, in which case all scripts for each experiment are run.
+        Scripts that use the output of another script fail if that script isn't run.
+    history_format : str
+        format of training histories, one of {'tfevents', 'metrics'}. Default is 'tfevents'.
+    n_steps : int
+        number of training steps in each training history. Default is 2000.
+    trees_root : str, Path
+        directory where results trees are made and kept, in sub-directories named {experiment}-{scale}.
+        Default is None, in which case trees are made in a temporary directory that is removed afterwards.
+    trace : bool
+        if True, measure peak memory allocated by Python with tracemalloc. Default is False.
+    results_csv : str, Path
+        .csv that results are appended to. Default is results/benchmarks/source_data_scripts.csv.
+    """
+    results_csv = Path(results_csv)
+    metadata = get_metadata()
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    with contextlib.ExitStack() as stack:
+        if trees_root is None:
+            trees_root = stack.enter_context(tempfile.TemporaryDirectory())
+        trees_root = Path(trees_root)
+
+        for scale in scales:
+            n_nets, n_replicates = parse_scale(scale)
+            for experiment in experiments:
+                tree_root = trees_root.joinpath(f'{experiment}-{scale}')
+                tic = time.perf_counter()
+                net_names = make_synthetic_results.main(tree_root, experiment, n_nets=n_nets,
+                                                        n_replicates=n_replicates, n_steps=n_steps,
+                                                        history_format=history_format)
+                input_mb = tree_mb(tree_root)
+                print(f'made {experiment} results tree with {n_nets} nets x {n_replicates} replicates '
+                      f'({input_mb:.0f} MB) in {time.perf_counter() - tic:.1f} s')
+
+                for script in SCRIPTS[experiment]:
+                    if scripts is not None and Path(script).name not in scripts:
+                        continue
+                    results = context.Queue()
+                    process = context.Process(target=measure,
+                                              args=(script, get_main_kwargs(script, tree_root, net_names),
+                                                    trace, results))
+                    process.start()
+                    result = get_result(process, results)
+                    process.join()
+                    if 'error' in result:
+                        print(f'\t{script}: failed with {result["error"]}')
+                    else:
+                        print(f'\t{script}: {result["wall_sec"]:.2f} s, peak {result["peak_rss_mb"]:.0f} MB')
+                    rows.append(dict(experiment=experiment, script=script, scale=scale, n_nets=n_nets,
+                                     n_replicates=n_replicates, history_format=history_format, n_steps=n_steps,
+                                     input_mb=input_mb, **result))
+
+    current = pd.DataFrame.from_records(rows).assign(**metadata)
+    if results_csv.exists():
+        history = pd.concat([pd.read_csv(results_csv), current], ignore_index=True)
+    else:
+        results_csv.parent.mkdir(parents=True, exist_ok=True)
+        history = current
+    history.to_csv(results_csv, index=False)
+    print(f'appended results to {results_csv}')
+
+    if 'wall_sec' in current:
+        df_scaling = scaling(current)
+        if len(df_scaling) > 0:
+            print('scaling of wall time with number of nets x replicates, wall_sec ~ (n_nets * n_replicates) ** exponent:')
+            print(df_scaling.to_string(index=False, float_format='%.2f'))
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--scales', nargs='+', default=SCALES,
+                        help="scales to benchmark, written as '{n_nets}x{n_replicates}', e.g. '10x32'")
+    parser.add_argument('--experiments', nargs='+', default=EXPERIMENTS, choices=EXPERIMENTS)
+    parser.add_argument('--scripts', nargs='+', default=None,
+                        help='names of scripts to run, e.g. generate_source_data_csv.py. Default is all')
+    parser.add_argument('--history_format', choices=make_synthetic_results.HISTORY_FORMATS, default='tfevents',
+                        help='format of training histories')
+    parser.add_argument('--n_steps', type=int, default=make_synthetic_results.N_STEPS,
+                        help='number of training steps in each training history')
+    parser.add_argument('--trees_root', default=None,
+                        help='directory where results trees are made and kept. Default is a temporary directory')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='measure peak memory allocated by Python with tracemalloc')
+    parser.add_argument('--results_csv', default=RESULTS_CSV,
+                        help='.csv that results are appended to')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(scales=args.scales,
+         experiments=args.experiments,
+         scripts=args.scripts,
+         history_format=args.history_format,
+         n_steps=args.n_steps,
+         trees_root=args.trees_root,
+         trace=args.tracemalloc,
+         results_csv=args.results_csv,
+         )
@@ -0,0 +1,383 @@
+"""activation checkpointing at block boundaries of VGG16 and CORnet_S, to train within a peak memory budget.
+
+During training, the tensors that each layer saves for the backward pass ("activations")
+take up most of the memory used by VGG16 and CORnet_S.
+When a block is checkpointed, only its input is kept during the forward pass,
+and the block's forward pass is computed again during the backward pass to get its activations back.
+Blocks are the convolutional blocks of VGG16 (the layers up to and including each max pooling layer),
+and for CORnet_S, area V1 and each time step of areas V2, V4, and IT.
+
+``plan`` runs the forward pass on one batch and measures, for each block,
+how many bytes of activations it saves and how long it takes.
+With versions of torch that have ``torch.autograd.graph.saved_tensors_hooks``, the tensors saved
+for the backward pass are measured; with earlier versions, the outputs of each layer are measured instead,
+since they are most of what layers save.
+Blocks are then checkpointed in order of most memory saved per second of recomputation,
+until the estimated peak memory fits the budget.
+Checkpointing only changes which tensors are kept, not the modules' parameters or buffers,
+so checkpoints saved while training with it can be loaded into models built as usual.
+"""
+import contextlib
+import inspect
+import time
+
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from searchnets.nets.cornet_s import CORblock_S
+
+NETS = ['VGG16', 'CORnet_S']
+MB = 2 ** 20
+
+# added in later versions of torch than the one in environment.yml
+HAS_SAVED_TENSORS_HOOKS = hasattr(torch.autograd, 'graph') and hasattr(torch.autograd.graph, 'saved_tensors_hooks')
+CHECKPOINT_HAS_USE_REENTRANT = 'use_reentrant' in inspect.signature(checkpoint).parameters
+
+
+def storage_of(tensor):
+    """get (data pointer, number of bytes) of the storage of tensor, that may be shared with other tensors"""
+    if hasattr(tensor, 'untyped_storage'):
+        storage = tensor.untyped_storage()
+        return storage.data_ptr(), storage.nbytes()
+    storage = tensor.storage()
+    return storage.data_ptr(), storage.size() * storage.element_size()
+
+
+@contextlib.contextmanager
+def frozen_running_stats(module):
+    """don't update running statistics of batch norm layers in module,
+    e.g. when a forward pass is recomputed. Outputs in training mode are unchanged,
+    since they are computed with the statistics of the batch"""
+    norms = [(norm, norm.momentum, norm.num_batches_tracked.clone())
+             for norm in module.modules()
+             if isinstance(norm, nn.modules.batchnorm._BatchNorm) and norm.track_running_stats]
+    for norm, _, _ in norms:
+        norm.momentum = 0.
+    try:
+        yield
+    finally:
+        for norm, momentum, num_batches_tracked in norms:
+            norm.momentum = momentum
+            norm.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def checkpointed(fn, module, *args):
+    """call fn(*args) with activation checkpointing,
+    without updating running statistics of batch norm layers in module a second time when it is recomputed"""
+    ran = []
+
+    def run(*args):
+        if ran:  # recomputing during backward pass
+            with frozen_running_stats(module):
+                return fn(*args)
+        ran.append(True)
+        return fn(*args)
+
+    if CHECKPOINT_HAS_USE_REENTRANT:
+        return checkpoint(run, *args, use_reentrant=False)
+
+    # with earlier versions of torch, checkpoint only accepts tensor arguments,
+    # and only computes gradients for parameters of fn if one of its inputs requires grad,
+    # which the input of the first block, a batch of images, does not
+    tensor_inds = [ind for ind, arg in enumerate(args) if torch.is_tensor(arg)]
+
+    def run_tensors(_, *tensors):
+        all_args = list(args)
+        for ind, tensor in zip(tensor_inds, tensors):
+            all_args[ind] = tensor
+        return run(*all_args)
+
+    requires_grad = torch.ones(1, requires_grad=True)
+    return checkpoint(run_tensors, requires_grad, *[args[ind] for ind in tensor_inds])
+
+
+class BlockProfiler:
+    """measures bytes of activations saved by each block during a forward pass, and its duration"""
+    def __init__(self, model):
+        self.model = model
+        self.param_ptrs = {storage_of(param)[0] for param in model.parameters()}
+        self.rows = []
+        self.counts = []  # like saved_tensors_hooks, only the innermost output_hooks count
+
+    @staticmethod
+    def sync(tensor):
+        if tensor.is_cuda:
+            torch.cuda.synchronize(tensor.device)
+
+    def saved_bytes_hooks(self, counter):
+        """context manager that adds bytes saved for the backward pass to counter[0]"""
+        seen = set()
+
+        def count(tensor):
+            data_ptr, nbytes = storage_of(tensor)
+            if data_ptr not in seen and data_ptr not in self.param_ptrs:
+                seen.add(data_ptr)
+                counter[0] += nbytes
+
+        if HAS_SAVED_TENSORS_HOOKS:
+            def pack(tensor):
+                count(tensor)
+                return tensor
+
+            return torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor)
+        return self.output_hooks(count)
+
+    @contextlib.contextmanager
+    def output_hooks(self, count):
+        """call count on the output of each layer of the model with no children"""
+        def hook(module, inputs, output):
+            if self.counts[-1] is count and torch.is_tensor(output) and output.requires_grad:
+                count(output)
+
+        self.counts.append(count)
+        handles = [module.register_forward_hook(hook)
+                   for module in self.model.modules() if not list(module.children())]
+        try:
+            yield
+        finally:
+            for handle in handles:
+                handle.remove()
+            self.counts.pop()
+
+    def run(self, key, fn, *args):
+        inputs = [arg for arg in args if torch.is_tensor(arg)]
+        self.sync(inputs[0])
+        saved_bytes = [0]
+        with self.saved_bytes_hooks(saved_bytes):
+            tic = time.perf_counter()
+            out = fn(*args)
+            self.sync(out)
+        self.rows.append(dict(block=key,
+                              saved_mb=saved_bytes[0] / MB,
+                              input_mb=sum(storage_of(tensor)[1] for tensor in inputs) / MB,
+                              forward_sec=time.perf_counter() - tic))
+        return out
+
+
+def run_block(module, key, fn, *args):
+    if module.profiler is not None:
+        return module.profiler.run(key, fn, *args)
+    if key in module.checkpointed and module.training and torch.is_grad_enabled():
+        return checkpointed(fn, module, *args)
+    return fn(*args)
+
+
+class CheckpointedSequential(nn.Sequential):
+    """nn.Sequential split into blocks, any of which can be checkpointed.
+    Made by ``convert``, which sets ``blocks``, a list of (key, start, stop) tuples"""
+    def run_layers(self, x, start, stop):
+        for layer in list(self)[start:stop]:
+            x = layer(x)
+        return x
+
+    def forward(self, x):
+        for key, start, stop in self.blocks:
+            x = run_block(self, key, self.run_layers, x, start, stop)
+        return x
+
+
+class CheckpointedCORblock_S(CORblock_S):
+    """CORblock_S whose time steps can be checkpointed. Made by ``convert``, which sets ``keys``,
+    the key of each time step"""
+    def time_step(self, x, t):
+        if t == 0:
+            skip = self.norm_skip(self.skip(x))
+            self.conv2.stride = (2, 2)
+        else:
+            skip = x
+            self.conv2.stride = (1, 1)
+
+        x = self.conv1(x)
+        x = getattr(self, f'norm1_{t}')(x)
+        x = self.nonlin1(x)
+
+        x = self.conv2(x)
+        x = getattr(self, f'norm2_{t}')(x)
+        x = self.nonlin2(x)
+
+        x = self.conv3(x)
+        x = getattr(self, f'norm3_{t}')(x)
+
+        x += skip
+        x = self.nonlin3(x)
+        return self.output(x)
+
+    def forward(self, inp):
+        x = self.conv_input(inp)
+        for t in range(self.times):
+            x = run_block(self, self.keys[t], self.time_step, x, t)
+        return x
+
+
+def convert(model, net_name):
+    """convert the modules in model that contain blocks into classes that can checkpoint them, in place.
+    Parameters, buffers, and the keys in the state dict are unchanged.
+
+    Returns
+    -------
+    modules : dict
+        that maps the key of each block to the module that runs it, in the order blocks run
+    """
+    modules = {}
+    if net_name == 'VGG16':
+        features = model.features
+        features.__class__ = CheckpointedSequential
+        features.blocks = []
+        start = 0
+        for ind, layer in enumerate(features):
+            if isinstance(layer, nn.MaxPool2d):
+                features.blocks.append((f'features.{start}-{ind}', start, ind + 1))
+                start = ind + 1
+        if start < len(features):
+            features.blocks.append((f'features.{start}-{len(features) - 1}', start, len(features)))
+        to_init = [features]
+        modules.update({key: features for key, _, _ in features.blocks})
+    elif net_name == 'CORnet_S':
+        model.V1.__class__ = CheckpointedSequential
+        model.V1.blocks = [('V1', 0, len(model.V1))]
+        to_init = [model.V1]
+        modules['V1'] = model.V1
+        for area in ('V2', 'V4', 'IT'):
+            block = getattr(model, area)
+            block.__class__ = CheckpointedCORblock_S
+            block.keys = [f'{area}.t{t}' for t in range(block.times)]
+            to_init.append(block)
+            modules.update({key: block for key in block.keys})
+    else:
+        raise ValueError(
+            f'activation checkpointing is only implemented for {NETS}, not: {net_name}'
+        )
+    for module in to_init:
+        module.checkpointed = set()
+        module.profiler = None
+    return modules
+
+
+def n_optimizer_states(optimizer):
+    """number of tensors the size of each parameter that an optimizer keeps"""
+    if isinstance(optimizer, (torch.optim.Adam, torch.optim.AdamW)):
+        return 3 if optimizer.defaults.get('amsgrad') else 2
+    elif isinstance(optimizer, torch.optim.SGD):
+        return 1 if optimizer.defaults.get('momentum') else 0
+    return 2
+
+
+def static_mb(model, optimizers):
+    """memory used by parameters, their gradients, and optimizer state"""
+    mb = sum(storage_of(param)[1] for param in model.parameters()) / MB
+    for optimizer in optimizers:
+        for group in optimizer.param_groups:
+            group_mb = sum(storage_of(param)[1] for param in group['params']) / MB
+            mb += group_mb * (1 + n_optimizer_states(optimizer))
+    return mb
+
+
+def estimate_peak_mb(df_blocks, checkpointed_keys, other_mb, static):
+    """estimate peak memory during a training step, if blocks in checkpointed_keys are checkpointed:
+    activations of blocks that aren't checkpointed, inputs of blocks that are,
+    plus the activations of the largest checkpointed block, recomputed during the backward pass"""
+    is_checkpointed = df_blocks['block'].isin(checkpointed_keys)
+    activations = df_blocks.loc[~is_checkpointed, 'saved_mb'].sum()
+    if is_checkpointed.any():
+        activations += (df_blocks.loc[is_checkpointed, 'input_mb'].sum()
+                         + df_blocks.loc[is_checkpointed, 'saved_mb'].max())
+    return static + other_mb + activations
+
+
+def plan(model, net_name, batch, peak_memory_mb, optimizers=()):
+    """choose blocks of model to checkpoint, so the estimated peak memory of a training step
+    with batch is within peak_memory_mb, and checkpoint them
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        VGG16 or CORnet_S, not wrapped in nn.DataParallel
+    net_name : str
+        one of {'VGG16', 'CORnet_S'}
+    batch : torch.Tensor
+        batch of inputs, on the device used for training, with the batch size used for training
+    peak_memory_mb : float
+        peak memory budget, in megabytes
+    optimizers : list
+        of optimizers used to train model, to estimate memory used by their state
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per block, with activations saved, input size, forward pass duration,
+        and whether it is checkpointed
+    estimates : dict
+        estimates of peak memory and time, with and without checkpointing
+    """
+    modules = convert(model, net_name)
+    profiler = BlockProfiler(model)
+    for module in set(modules.values()):
+        module.profiler = profiler
+    outer_mb = [0]
+    was_training = model.training
+    model.train()
+    try:
+        with frozen_running_stats(model), profiler.saved_bytes_hooks(outer_mb):
+            BlockProfiler.sync(batch)
+            tic = time.perf_counter()
+            out = model(batch)
+            BlockProfiler.sync(out)
+            forward_sec = time.perf_counter() - tic
+        del out
+    finally:
+        for module in set(modules.values()):
+            module.profiler = None
+        model.train(was_training)
+
+    df = pd.DataFrame.from_records(profiler.rows)
+    other_mb = outer_mb[0] / MB  # activations saved outside of blocks, e.g. by the classifier
+    static = static_mb(model, optimizers)
+    # backward pass takes roughly twice as long as the forward pass
+    step_sec = 3 * forward_sec
+
+    # checkpoint blocks that free the most memory per second of recomputation first
+    df['freed_mb_per_sec'] = (df['saved_mb'] - df['input_mb']) / df['forward_sec']
+    order = df.sort_values('freed_mb_per_sec', ascending=False)['block'].tolist()
+    chosen = []
+    peak = estimate_peak_mb(df, chosen, other_mb, static)
+    for key in order:
+        if peak <= peak_memory_mb:
+            break
+        with_key = estimate_peak_mb(df, chosen + [key], other_mb, static)
+        if with_key < peak:
+            chosen.append(key)
+            peak = with_key
+
+    for key in chosen:
+        modules[key].checkpointed.add(key)
+    df['checkpointed'] = df['block'].isin(chosen)
+    estimates = dict(
+        peak_memory_mb=peak_memory_mb,
+        estimated_peak_mb=peak,
+        estimated_peak_mb_without=estimate_peak_mb(df, [], other_mb, static),
+        static_mb=static,
+        step_sec=step_sec,
+        extra_sec=df.loc[df['checkpointed'], 'forward_sec'].sum(),
+    )
+    return df, estimates
+
+
+def report(df, estimates):
+    """describe memory/time trade-off chosen by ``plan``, from the values it returns"""
+    lines = [
+        df[['block', 'saved_mb', 'input_mb', 'forward_sec', 'checkpointed']].to_string(index=False,
+                                                                                     float_format='%.3f'),
+        f'checkpointed {df["checkpointed"].sum()} of {len(df)} blocks: '
+        f'estimated peak memory {estimates["estimated_peak_mb"]:.0f} MB '
+        f'(without checkpointing: {estimates["estimated_peak_mb_without"]:.0f} MB, '
+        f'budget: {estimates["peak_memory_mb"]:.0f} MB, '
+        f'of which parameters, gradients, and optimizer state: {estimates["static_mb"]:.0f} MB), '
+        f'estimated extra time per step {estimates["extra_sec"]:.3f} s '
+        f'({100 * estimates["extra_sec"] / estimates["step_sec"]:.0f}% of {estimates["step_sec"]:.3f} s)'
+    ]
+    if estimates['estimated_peak_mb'] > estimates['peak_memory_mb']:
+        lines.append('warning: estimated peak memory is over budget even with checkpointing, '
+                     'try a smaller batch size')
+    return '\n'.join(lines)
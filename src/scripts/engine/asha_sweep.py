@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""sweep over a grid of configs, pruning those that aren't promising
+with asynchronous successive halving (ASHA, Li et al. 2018, https://arxiv.org/abs/1810.05934).
+
+Each config in the grid is a "trial".
+Training is divided into "rungs": a trial at rung k trains until step min_steps * eta ** k,
+then is scored by the best validation accuracy it has reached so far.
+A trial is promoted to the next rung only if it is in the top 1 / eta of all trials that reached its rung;
+the others are paused, and pruned when the sweep ends.
+Trials at the last rung train to completion, i.e. until EPOCHS or early stopping, as specified by their configs.
+
+Training is resumable (see train_replicates.py), so a promoted trial continues from where it was paused,
+and a sweep that is interrupted continues from where it stopped when run again with the same sweep_root.
+Every decision to promote or prune a trial is logged to decisions.csv in sweep_root,
+along with the scores used to make it.
+"""
+from argparse import ArgumentParser
+import csv
+import json
+from pathlib import Path
+import time
+
+from searchnets.config import parse_config
+
+from async_validation import VAL_METRIC
+import train_replicates
+from train_replicates import ResumableTrainer, ResumableTransferTrainer
+
+ETA = 3
+MIN_STEPS = 500
+N_RUNGS = 4
+
+DECISION_FIELDS = ['time', 'trial', 'rung', 'step', 'score', 'decision', 'rank', 'n_at_rung', 'n_promoted']
+
+
+class BudgetReached(Exception):
+    """raised to pause training when a trainer reaches its step budget"""
+
+
+class StopAtBudget:
+    """wraps a DataLoader, so that iterating over it raises BudgetReached
+    after the trainer has reached its step budget"""
+    def __init__(self, loader, trainer):
+        self.loader = loader
+        self.trainer = trainer
+
+    def __iter__(self):
+        for batch in self.loader:
+            if self.trainer.budget_reached:
+                raise BudgetReached
+            yield batch
+
+    def __len__(self):
+        return len(self.loader)
+
+
+class BudgetMixin:
+    """mixin that lets a resumable trainer pause after a given number of steps,
+    once it has computed validation metrics.
+    Must come before ResumableMixin in the list of base classes."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.step_budget = None
+        self.budget_reached = False
+        self.epoch = 1
+        self.val_scores = []
+
+    def validate(self):
+        val_metrics = super().validate()
+        self.val_scores.append(val_metrics[VAL_METRIC[self.loss_func]])
+        if self.step_budget is not None and self.step >= self.step_budget:
+            self.budget_reached = True
+        return val_metrics
+
+    def train_one_epoch(self, epoch):
+        self.epoch = epoch
+        train_loader = self.train_loader
+        self.train_loader = StopAtBudget(train_loader, self)
+        try:
+            super().train_one_epoch(epoch)
+        finally:
+            self.train_loader = train_loader
+
+    def train_to(self, step_budget=None):
+        """train until step_budget, or until finished if step_budget is None
+
+        Returns
+        -------
+        finished : bool
+            True if training finished, False if it was paused at step_budget
+        """
+        self.step_budget = step_budget
+        self.budget_reached = False
+        try:
+            self.train()
+            return True
+        except BudgetReached:
+            self.save_checkpoint(self.epoch)
+            return False
+
+
+class SweepTrainer(BudgetMixin, ResumableTrainer):
+    pass
+
+
+class SweepTransferTrainer(BudgetMixin, ResumableTransferTrainer):
+    pass
+
+
+def step_budget(rung, min_steps, eta, n_rungs):
+    """number of steps a trial trains at a rung. None for the last rung, which trains to completion"""
+    if rung == n_rungs - 1:
+        return None
+    return min_steps * eta ** rung
+
+
+def log_decision(sweep_root, trial, rung, score, decision, rank=None, n_at_rung=None, n_promoted=None):
+    """append a decision to decisions.csv"""
+    decisions_csv = Path(sweep_root).joinpath('decisions.csv')
+    write_header = not decisions_csv.exists()
+    with decisions_csv.open('a', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=DECISION_FIELDS)
+        if write_header:
+            writer.writeheader()
+        writer.writerow({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'trial': trial['name'], 'rung': rung,
+                         'step': trial['step'], 'score': score, 'decision': decision, 'rank': rank,
+                         'n_at_rung': n_at_rung, 'n_promoted': n_promoted})
+    print(f"{decision} {trial['name']} at rung {rung}, score: {score}, rank: {rank} of {n_at_rung}")
+
+
+def ranked_at_rung(trials, rung):
+    """trials that reached rung, sorted by their score at that rung, best first"""
+    at_rung = [trial for trial in trials if str(rung) in trial['scores']]
+    return sorted(at_rung, key=lambda trial: trial['scores'][str(rung)], reverse=True)
+
+
+def get_job(sweep_root, trials, eta, n_rungs):
+    """get next trial to train, and the rung to train it to, following ASHA:
+    promote a paused trial from the highest rung where it is in the top 1 / eta,
+    otherwise start a new trial at the bottom rung
+
+    Returns
+    -------
+    trial, rung : dict, int
+        or None, None if there are no trials to promote or start
+    """
+    for rung in reversed(range(n_rungs - 1)):
+        ranked = ranked_at_rung(trials, rung)
+        n_promoted = len(ranked) // eta
+        for rank, trial in enumerate(ranked[:n_promoted], start=1):
+            if trial['status'] == 'paused' and trial['rung'] == rung:
+                log_decision(sweep_root, trial, rung, trial['scores'][str(rung)], 'promote',
+                             rank, len(ranked), n_promoted)
+                return trial, rung + 1
+    for trial in trials:
+        if trial['status'] == 'new':
+            return trial, 0
+    return None, None
+
+
+def save_state(sweep_root, trials):
+    state_path = Path(sweep_root).joinpath('state.json')
+    tmp_path = state_path.parent.joinpath(state_path.name + '.tmp')
+    tmp_path.write_text(json.dumps(trials, indent=2))
+    tmp_path.replace(state_path)
+
+
+def main(config_files,
+         sweep_root,
+         eta=ETA,
+         min_steps=MIN_STEPS,
+         n_rungs=N_RUNGS,
+         replicate=1,
+         ):
+    """run a sweep over configs with asynchronous successive halving
+
+    Parameters
+    ----------
+    config_files : list
+        of paths to config.ini files, the grid of "trials".
+        Configs must have USE_VAL = True, and VAL_STEP should evenly divide min_steps.
+    sweep_root : str, Path
+        directory where state of sweep and log of decisions are saved
+    eta : int
+        reduction factor. Only the top 1 / eta of trials at each rung are promoted,
+        and each rung trains eta times as many steps as the one before. Default is 3.
+    min_steps : int
+        number of steps trials train at the first rung. Default is 500.
+    n_rungs : int
+        number of rungs. Trials at the last rung train to completion. Default is 4.
+    replicate : int
+        number of the replicate trained for each config. Default is 1.
+    """
+    sweep_root = Path(sweep_root)
+    sweep_root.mkdir(parents=True, exist_ok=True)
+    state_path = sweep_root.joinpath('state.json')
+    if state_path.exists():
+        trials = json.loads(state_path.read_text())
+        print(f'continuing sweep in {sweep_root}')
+    else:
+        trials = [{'name': Path(config_file).stem, 'config_file': str(Path(config_file).resolve()),
+                   'status': 'new', 'rung': None, 'step': 0, 'scores': {}}
+                  for config_file in config_files]
+        save_state(sweep_root, trials)
+
+    device = train_replicates.get_device()
+    while True:
+        trial, rung = get_job(sweep_root, trials, eta, n_rungs)
+        if trial is None:
+            break
+
+        config = parse_config(trial['config_file'])
+        if not config.train.use_val:
+            raise ValueError(
+                f"config for trial {trial['name']} does not have USE_VAL = True, can't score it"
+            )
+        epochs = config.train.epochs_list[0]
+        trainer_kwargs = train_replicates.get_trainer_kwargs(config, device)
+        trainer = train_replicates.make_trainer(config, replicate, epochs, trainer_kwargs,
+                                                trainer_class=SweepTrainer,
+                                                transfer_trainer_class=SweepTransferTrainer)
+        budget = step_budget(rung, min_steps, eta, n_rungs)
+        print(f"training {trial['name']} at rung {rung}, until step: {budget if budget else 'finished'}")
+        finished = trainer.train_to(budget)
+
+        # score is best validation accuracy so far, including before this rung
+        scores = trainer.val_scores + list(trial['scores'].values())
+        trial['scores'][str(rung)] = max(scores) if scores else float('nan')
+        trial['rung'] = rung
+        trial['step'] = trainer.step
+        trial['status'] = 'finished' if finished else 'paused'
+        save_state(sweep_root, trials)
+        if finished:
+            log_decision(sweep_root, trial, rung, trial['scores'][str(rung)], 'finished')
+
+    # trials still paused were never promoted, so they are pruned
+    for trial in trials:
+        if trial['status'] == 'paused':
+            ranked = ranked_at_rung(trials, trial['rung'])
+            trial['status'] = 'pruned'
+            log_decision(sweep_root, trial, trial['rung'], trial['scores'][str(trial['rung'])], 'prune',
+                         ranked.index(trial) + 1, len(ranked), len(ranked) // eta)
+    save_state(sweep_root, trials)
+
+    total_steps = sum(trial['step'] for trial in trials)
+    print(f'sweep finished. Total steps trained across {len(trials)} trials: {total_steps}')
+    for trial in sorted(trials, key=lambda trial: (trial['rung'], max(trial['scores'].values())), reverse=True):
+        print(f"{trial['name']}: {trial['status']} at rung {trial['rung']}, step {trial['step']}, "
+              f"best score {max(trial['scores'].values()):.3f}")
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('sweep_root',
+                        help='directory where state of sweep and log of decisions are saved')
+    parser.add_argument('config_files', nargs='+',
+                        help='paths to config.ini files in the grid')
+    parser.add_argument('--eta', type=int, default=ETA,
+                        help='reduction factor: the top 1 / eta of trials at each rung are promoted')
+    parser.add_argument('--min_steps', type=int, default=MIN_STEPS,
+                        help='number of steps trials train at the first rung')
+    parser.add_argument('--n_rungs', type=int, default=N_RUNGS,
+                        help='number of rungs; trials at the last rung train to completion')
+    parser.add_argument('--replicate', type=int, default=1,
+                        help='number of replicate trained for each config')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(config_files=args.config_files,
+         sweep_root=args.sweep_root,
+         eta=args.eta,
+         min_steps=args.min_steps,
+         n_rungs=args.n_rungs,
+         replicate=args.replicate,
+         )
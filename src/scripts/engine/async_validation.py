@@ -0,0 +1,328 @@
+"""validation in a separate process, so training doesn't stop every VAL_STEP steps to score the validation set.
+
+At each validation step, the trainer copies its weights into a "snapshot", a copy of the model in shared memory,
+and sends the snapshot to a worker process that computes validation metrics while training continues.
+Results are applied when they arrive, which may be a few steps later:
+metrics are written to TensorBoard with the step of the snapshot,
+and if a snapshot improves validation accuracy, the weights in that snapshot are saved as the best checkpoint,
+not the weights at the step when the result arrived.
+If the trainer needs a snapshot and none are free, it waits for a result.
+
+In "exact" mode the trainer waits for each result right after sending the snapshot,
+so early stopping decisions are made at the same steps as with searchnets' synchronous validation.
+"""
+from collections import defaultdict
+import copy
+import os
+import queue
+import traceback
+
+import numpy as np
+import sklearn.metrics
+import torch
+import torch.multiprocessing
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from searchnets import datasets
+
+from uint8_batches import Uint8Batches
+
+N_SNAPSHOTS = 2
+VAL_THREADS = 1
+SIGMOID_THRESHOLD = 0.5
+POLL_INTERVAL = 5  # seconds, to check worker is still alive while waiting for a result
+
+# key in batch for target, for each loss function
+TARGET_KEY = {
+    'CE': 'target',
+    'BCE': 'target',
+    'CE-largest': 'largest',
+    'CE-random': 'random',
+}
+
+# metric used by searchnets to decide whether to stop early, for each loss function
+VAL_METRIC = {
+    'CE': 'acc',
+    'BCE': 'f1',
+    'CE-largest': 'acc_largest',
+    'CE-random': 'acc_random',
+}
+
+
+def validate(model, val_loader, criterion, loss_func, device, sigmoid_threshold=SIGMOID_THRESHOLD):
+    """compute the same metrics as searchnets.engine.abstract_trainer.AbstractTrainer.validate,
+    for 'classify' mode: the mean over batches of each metric
+
+    Returns
+    -------
+    metrics : dict
+    y_pred : numpy.ndarray
+        predicted class for each sample, in the order of val_loader
+    """
+    model.eval()
+    is_vsd = isinstance(val_loader.dataset, datasets.VOCDetection)
+    batch_metrics = defaultdict(list)
+    y_pred = []
+    with torch.no_grad():
+        for batch in val_loader:
+            batch_x = batch['img'].to(device)
+            batch_y = batch[TARGET_KEY[loss_func]].to(device)
+            output = model(batch_x)
+            batch_metrics['loss'].append(criterion(output, batch_y).mean().item())
+
+            pred_max = output.argmax(dim=1).cpu()
+            y_pred.append(pred_max)
+            if is_vsd:
+                pred_sig = (torch.sigmoid(output) > sigmoid_threshold).float()
+                batch_metrics['f1'].append(
+                    sklearn.metrics.f1_score(batch['target'].numpy(), pred_sig.cpu().numpy(), average='macro')
+                )
+                batch_metrics['acc_largest'].append((pred_max == batch['largest']).float().mean().item())
+                batch_metrics['acc_random'].append((pred_max == batch['random']).float().mean().item())
+            else:
+                batch_metrics['acc'].append((pred_max == batch_y.cpu()).float().mean().item())
+    metrics = {metric: np.asarray(values).mean() for metric, values in batch_metrics.items()}
+    return metrics, torch.cat(y_pred).numpy()
+
+
+def validation_worker(snapshots, valset, batch_size, num_workers, criterion, loss_func, device, n_threads,
+                      tasks, results, uint8_dataset_type=None):
+    """worker process: validate snapshots as they are sent, until sent None"""
+    torch.set_num_threads(n_threads)
+    val_loader = DataLoader(valset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    device = torch.device(device)
+    if uint8_dataset_type is not None:
+        val_loader = Uint8Batches(val_loader, uint8_dataset_type, device)
+    criterion.to(device)
+    if device.type == 'cpu':
+        model = None  # validate snapshots in place
+    else:
+        model = copy.deepcopy(snapshots[0]).to(device)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        slot, step, epoch = task
+        try:
+            if model is None:
+                val_model = snapshots[slot]
+            else:
+                model.load_state_dict(snapshots[slot].state_dict())
+                val_model = model
+            metrics, y_pred = validate(val_model, val_loader, criterion, loss_func, device)
+            results.put((slot, step, epoch, metrics, y_pred, None))
+        except Exception:
+            results.put((slot, step, epoch, None, None, traceback.format_exc()))
+
+
+class AsyncValidationMixin:
+    """mixin that validates in a worker process, for trainers in 'classify' mode.
+    Must come before ResumableMixin in the list of base classes.
+
+    Set these attributes before calling ``train``:
+    exact_val : bool
+        if True, wait for each validation result before continuing, so early stopping is deterministic.
+        Default is False.
+    val_device : str, torch.device
+        device used by worker. Default is the same as the trainer.
+    val_threads : int
+        number of threads used by worker. Default is 1.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.mode != 'classify':
+            raise ValueError(
+                f"asynchronous validation only works with 'classify' mode, but mode was: {self.mode}"
+            )
+        self.exact_val = False
+        self.val_device = self.device
+        self.val_threads = VAL_THREADS
+        self.validator = None
+        self.n_pending = 0
+
+    @property
+    def unwrapped_model(self):
+        return self.model.module if isinstance(self.model, nn.DataParallel) else self.model
+
+    def start_validator(self):
+        context = torch.multiprocessing.get_context('spawn')
+        self.snapshots = []
+        for _ in range(N_SNAPSHOTS):
+            snapshot = copy.deepcopy(self.unwrapped_model).cpu().eval()
+            snapshot.share_memory()
+            self.snapshots.append(snapshot)
+        self.free_slots = list(range(N_SNAPSHOTS))
+        self.n_pending = 0
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.validator = context.Process(
+            target=validation_worker,
+            args=(self.snapshots, self.valset, self.batch_size, self.val_loader.num_workers, self.criterion,
+                  self.loss_func, str(self.val_device), self.val_threads, self.tasks, self.results,
+                  self.uint8_dataset_type)
+        )
+        self.validator.start()
+
+    def stop_validator(self):
+        if self.validator is None:
+            return
+        self.tasks.put(None)
+        self.validator.join(timeout=POLL_INTERVAL)
+        if self.validator.is_alive():
+            self.validator.terminate()
+        self.validator = None
+
+    def get_result(self, block):
+        """get result from worker, or None if block is False and there isn't one yet"""
+        while True:
+            try:
+                return self.results.get(timeout=POLL_INTERVAL) if block else self.results.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self.validator.is_alive():
+                    raise RuntimeError(
+                        f'validation worker exited with code {self.validator.exitcode}'
+                    )
+
+    def apply_result(self, result):
+        """apply validation result: log metrics, and update best validation accuracy and early stopping counter"""
+        slot, step, epoch, metrics, y_pred, error = result
+        self.n_pending -= 1
+        if error is not None:
+            raise RuntimeError(
+                f'validation failed in worker process:\n{error}'
+            )
+        try:
+            if self.patience is not None and self.steps_without_improvement > self.patience:
+                return  # training already stopped before this step, so ignore it like synchronous validation would
+
+            metrics_str = ', '.join([f'{metric}:{value:7.3f}' for metric, value in metrics.items()])
+            print(f' Validation, step {step} ({self.step - step} steps ago): {metrics_str}')
+            if self.summary_step:
+                for metric, value in metrics.items():
+                    self.train_writer.add_scalar(f'{metric}/val', value, step)
+            if self.val_codes is not None:
+                self.record_val_counts(y_pred, step)
+
+            if self.patience is not None:
+                val_acc = metrics[VAL_METRIC[self.loss_func]]
+                if val_acc > self.best_val_acc:
+                    self.best_val_acc = val_acc
+                    self.steps_without_improvement = 0
+                    print(f'Validation accuracy improved, saving model in {self.save_path}')
+                    self.save_snapshot(slot, epoch, step,
+                                       self.save_path.parent.joinpath(
+                                           self.save_path.name + self.BEST_VAL_ACC_CKPT_SUFFIX
+                                       ))
+                else:
+                    self.steps_without_improvement += 1
+                    if self.steps_without_improvement > self.patience:
+                        print(f'greater than {self.patience} steps without improvement '
+                              'in validation accuracy, stopping training')
+        finally:
+            self.free_slots.append(slot)
+
+    def poll(self):
+        """apply any results that have arrived, without waiting"""
+        while self.n_pending > 0:
+            result = self.get_result(block=False)
+            if result is None:
+                return
+            self.apply_result(result)
+
+    def drain(self):
+        """wait for and apply all pending results"""
+        while self.n_pending > 0:
+            self.apply_result(self.get_result(block=True))
+
+    def submit(self, epoch):
+        """copy current weights into a free snapshot and send it to the worker"""
+        while not self.free_slots:
+            self.apply_result(self.get_result(block=True))
+        slot = self.free_slots.pop()
+        with torch.no_grad():
+            for dst, src in zip(self.snapshots[slot].state_dict().values(),
+                                self.unwrapped_model.state_dict().values()):
+                dst.copy_(src)
+        self.tasks.put((slot, self.step, epoch))
+        self.n_pending += 1
+        if self.exact_val:
+            self.drain()
+
+    def save_snapshot(self, slot, epoch, step, ckpt_path):
+        """save weights in a snapshot as a checkpoint. Checkpoint has no optimizer state,
+        since the optimizers have moved on from the step when the snapshot was taken"""
+        ckpt = {
+            'epoch': epoch,
+            'step': step,
+            'model': dict(zip(self.model.state_dict().keys(), self.snapshots[slot].state_dict().values())),
+        }
+        tmp_path = str(ckpt_path) + '.tmp'
+        torch.save(ckpt, tmp_path)
+        os.replace(tmp_path, ckpt_path)
+
+    def save_checkpoint(self, epoch, ckpt_path=None):
+        """apply pending results before saving, so the state saved for resuming is complete"""
+        self.drain()
+        super().save_checkpoint(epoch, ckpt_path)
+
+    def train_acc_by_set_size(self, epoch):
+        """apply pending results first, so accuracy by set size is from the latest validation"""
+        self.drain()
+        super().train_acc_by_set_size(epoch)
+
+    def train(self):
+        if self.val_loader is not None:
+            self.start_validator()
+        try:
+            super().train()
+        finally:
+            self.stop_validator()
+
+    def train_one_epoch(self, epoch):
+        """same as AbstractTrainer.train_one_epoch in 'classify' mode, but validation runs in the worker"""
+        self.start_epoch(epoch)
+        self.model.train()
+
+        total_loss = 0.0
+        batch_total = int(np.ceil(len(self.trainset) / self.batch_size))
+        batch_pbar = tqdm(self.train_loader)
+        for i, batch in enumerate(batch_pbar):
+            self.step += 1
+
+            batch_x = batch['img'].to(self.device)
+            batch_y = batch[TARGET_KEY[self.loss_func]].to(self.device)
+            output = self.model(batch_x)
+            loss = self.criterion(output, batch_y)
+
+            for optimizer in self.optimizers:
+                optimizer.zero_grad()
+            loss.mean().backward()  # mean needed for multiple GPUs
+            for optimizer in self.optimizers:
+                optimizer.step()
+
+            batch_pbar.set_description(f'batch {i} of {batch_total}, loss: {loss: 7.3f}')
+            total_loss += loss.item()
+
+            if self.summary_step:
+                if self.step % self.summary_step == 0:
+                    self.train_writer.add_scalar('loss/train', loss.mean(), self.step)
+
+            if self.val_loader is not None:
+                if self.step % self.val_step == 0:
+                    self.submit(epoch)
+                self.poll()
+                if self.patience is not None:
+                    if self.steps_without_improvement > self.patience:
+                        break
+
+            if self.ckpt_step:
+                if self.step % self.ckpt_step == 0:
+                    self.save_checkpoint(epoch)
+
+        avg_loss = total_loss / batch_total
+        print(f'\tTraining Avg. Loss: {avg_loss:7.3f}')
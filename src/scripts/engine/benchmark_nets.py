@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""benchmark throughput and peak memory of the architectures used in configs, on the cpu.
+
+The 'run' command measures, for each net, batch size, number of threads, and input size:
+- 'forward': forward pass in eval mode without gradients, as in testing
+- 'train': forward and backward pass and optimizer step on all parameters, as with METHOD = initialize
+- 'transfer': forward and backward pass and optimizer step on only the final layer,
+  as with METHOD = transfer and FREEZE_TRAINED_WEIGHTS = True
+Each measurement runs in its own process, so peak memory (maximum resident set size) isn't
+inflated by earlier measurements. Results are saved to a .csv, along with the host, versions of
+python and torch, and the git commit, so they can be compared across machines and over time.
+
+The 'compare' command compares a .csv of results with a baseline .csv,
+and flags regressions: throughput lower than the baseline, or peak memory higher,
+by more than a threshold, and measurements that succeeded in the baseline
+but failed or are missing in the results. It exits with status 1 if there are any regressions,
+so it can be used to check that changes to model code or dependencies don't make training slower.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import platform
+import queue
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyprojroot
+import torch
+import torch.multiprocessing
+import torch.nn as nn
+
+import test_replicates
+from tune_loader import default_threads, get_n_cores
+
+NETS = ['alexnet', 'VGG16', 'CORnet_Z', 'CORnet_S']
+MODES = ['forward', 'train', 'transfer']
+BATCH_SIZES = [1, 16, 64]
+INPUT_SIZES = [224, 227]
+NUM_CLASSES = 2
+N_STEPS = 20
+WARMUP_STEPS = 3
+THRESHOLD = 0.1
+POLL_SEC = 1.
+
+KEY_COLS = ['net_name', 'mode', 'batch_size', 'n_threads', 'input_size']
+# missing from results where every measurement failed, or none did
+RESULT_COLS = ['samples_per_sec', 'peak_mb', 'error']
+
+ROOT = pyprojroot.here()
+BENCHMARKS_ROOT = ROOT.joinpath('results', 'benchmarks')
+
+
+def max_rss_mb():
+    """maximum resident set size of this process so far, in megabytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+def head_name(model):
+    """name of the last linear layer, the only one trained with METHOD = transfer"""
+    return [name for name, module in model.named_modules() if isinstance(module, nn.Linear)][-1]
+
+
+def get_step(model, mode, x, y):
+    """get function that runs one step of mode with inputs x and targets y"""
+    criterion = nn.CrossEntropyLoss()
+    if mode == 'forward':
+        model.eval()
+
+        def step():
+            with torch.no_grad():
+                model(x)
+        return step
+
+    if mode == 'transfer':
+        head = head_name(model)
+        for name, param in model.named_parameters():
+            param.requires_grad = name.startswith(head + '.')
+    elif mode != 'train':
+        raise ValueError(
+            f'invalid mode: {mode}, must be one of: {MODES}'
+        )
+    model.train()
+    optimizer = torch.optim.SGD([param for param in model.parameters() if param.requires_grad], lr=1e-6)
+
+    def step():
+        optimizer.zero_grad()
+        criterion(model(x), y).backward()
+        optimizer.step()
+    return step
+
+
+def measure(net_name, mode, batch_size, n_threads, input_size, n_steps, results):
+    """target of measurement process: time steps and put result in results queue"""
+    try:
+        torch.set_num_threads(n_threads)
+        torch.manual_seed(0)
+        model = test_replicates.build_model(net_name, NUM_CLASSES)
+        x = torch.randn(batch_size, 3, input_size, input_size)
+        y = torch.randint(0, NUM_CLASSES, (batch_size,))
+        step = get_step(model, mode, x, y)
+        max_rss_before = max_rss_mb()
+        for _ in range(WARMUP_STEPS):
+            step()
+        step_secs = []
+        for _ in range(n_steps):
+            tic = time.perf_counter()
+            step()
+            step_secs.append(time.perf_counter() - tic)
+        step_secs = np.array(step_secs)
+        results.put(dict(
+            step_sec_median=np.median(step_secs),
+            step_sec_p90=np.percentile(step_secs, 90),
+            samples_per_sec=batch_size / np.median(step_secs),
+            peak_mb=max_rss_mb(),
+            peak_step_mb=max_rss_mb() - max_rss_before,
+        ))
+    except Exception as e:
+        results.put(dict(error=repr(e)))
+
+
+def get_result(process, results):
+    """get the result that process puts in results queue, or an error if process exits without putting one,
+    e.g. when it is killed for using too much memory"""
+    while True:
+        try:
+            return results.get(timeout=POLL_SEC)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    # result may have been put just before process exited
+    try:
+        return results.get(timeout=POLL_SEC)
+    except queue.Empty:
+        return dict(error=f'measurement process exited with code {process.exitcode} without a result')
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(host=socket.gethostname(),
+                processor=platform.processor() or platform.machine(),
+                n_cores=get_n_cores(),
+                python=platform.python_version(),
+                torch=torch.__version__,
+                commit=commit,
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def run(output,
+        net_names=NETS,
+        modes=MODES,
+        batch_sizes=BATCH_SIZES,
+        threads=None,
+        input_sizes=INPUT_SIZES,
+        n_steps=N_STEPS):
+    """run benchmarks and save results to output .csv
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per measurement
+    """
+    if threads is None:
+        threads = default_threads(get_n_cores())
+    metadata = get_metadata()
+    context = torch.multiprocessing.get_context('spawn')
+    rows = []
+    for net_name in net_names:
+        for mode in modes:
+            for batch_size in batch_sizes:
+                for n_threads in threads:
+                    for input_size in input_sizes:
+                        results = context.Queue()
+                        process = context.Process(target=measure,
+                                                  args=(net_name, mode, batch_size, n_threads, input_size, n_steps,
+                                                        results))
+                        process.start()
+                        result = get_result(process, results)
+                        process.join()
+                        row = dict(zip(KEY_COLS, (net_name, mode, batch_size, n_threads, input_size)), **result)
+                        if 'error' in result:
+                            print(f'{net_name}, {mode}, batch size {batch_size}, {n_threads} threads, '
+                                  f'input size {input_size}: failed with {result["error"]}')
+                        else:
+                            print(f'{net_name}, {mode}, batch size {batch_size}, {n_threads} threads, '
+                                  f'input size {input_size}: {result["samples_per_sec"]:.1f} samples/s, '
+                                  f'peak {result["peak_mb"]:.0f} MB')
+                        rows.append(row)
+
+    df = pd.DataFrame.from_records(rows).assign(**metadata)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(output, index=False)
+    print(f'saved results in {output}')
+    return df
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """compare benchmark results with a baseline
+
+    Parameters
+    ----------
+    baseline, current : pandas.DataFrame
+        results saved by ``run``
+    threshold : float
+        relative change counted as a regression. Default is 0.1, i.e. 10% slower, or 10% more memory.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per measurement in baseline, with ratios of current to baseline.
+        Measurements that succeeded in baseline but failed or are missing in current are regressions.
+    """
+    baseline, current = [df.assign(**{col: np.nan for col in RESULT_COLS if col not in df})
+                          for df in (baseline, current)]
+    cols = KEY_COLS + RESULT_COLS
+    df = baseline[cols].merge(current[cols], on=KEY_COLS, how='left', suffixes=('_baseline', '_current'),
+                              indicator=True)
+    df['error_current'] = df['error_current'].astype(object).where(df['_merge'] != 'left_only',
+                                                                   'missing from results')
+    df = df.drop(columns='_merge')
+    df['speed_ratio'] = df['samples_per_sec_current'] / df['samples_per_sec_baseline']
+    df['memory_ratio'] = df['peak_mb_current'] / df['peak_mb_baseline']
+    failed = df['samples_per_sec_baseline'].notna() & df['samples_per_sec_current'].isna()
+    df['regression'] = (df['speed_ratio'] < 1 - threshold) | (df['memory_ratio'] > 1 + threshold) | failed
+    return df
+
+
+def main(command,
+         output=None,
+         baseline=None,
+         net_names=NETS,
+         modes=MODES,
+         batch_sizes=BATCH_SIZES,
+         threads=None,
+         input_sizes=INPUT_SIZES,
+         n_steps=N_STEPS,
+         threshold=THRESHOLD):
+    """run benchmarks, or compare results with a baseline
+
+    Parameters
+    ----------
+    command : str
+        one of {'run', 'compare'}
+    output : str, Path
+        .csv where 'run' saves results, or that 'compare' compares with baseline.
+        Default for 'run' is results/benchmarks/benchmark_nets-{host}-{time}.csv.
+    baseline : str, Path
+        .csv of results saved by 'run' that output is compared with. Only used by 'compare'.
+        If specified with 'run', results are compared with it after running.
+    net_names : list
+        of str, architectures to benchmark. Default is all in NETS.
+    modes : list
+        of str, any of {'forward', 'train', 'transfer'}. Default is all.
+    batch_sizes : list
+        of int. Default is [1, 16, 64].
+    threads : list
+        of int, numbers of threads. Default is None, in which case powers of 2 up to the number of cores are used.
+    input_sizes : list
+        of int, height and width of inputs. Default is [224, 227].
+    n_steps : int
+        number of timed steps per measurement. Default is 20.
+    threshold : float
+        relative change counted as a regression by 'compare'. Default is 0.1.
+    """
+    if command == 'run':
+        if output is None:
+            output = BENCHMARKS_ROOT.joinpath(
+                f'benchmark_nets-{socket.gethostname()}-{time.strftime("%Y%m%d-%H%M%S")}.csv'
+            )
+        current = run(Path(output), net_names, modes, batch_sizes, threads, input_sizes, n_steps)
+        if baseline is None:
+            return
+    elif command == 'compare':
+        if output is None or baseline is None:
+            raise ValueError(
+                "'compare' requires both output and baseline"
+            )
+        current = pd.read_csv(output)
+    else:
+        raise ValueError(
+            f'invalid command: {command}, must be one of: {COMMANDS}'
+        )
+
+    baseline_df = pd.read_csv(baseline)
+    for col in ['host', 'torch', 'commit']:
+        before, after = baseline_df[col].iloc[0], current[col].iloc[0]
+        if before != after:
+            print(f'{col} changed: {before} -> {after}')
+    df = compare(baseline_df, current, threshold)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df.drop(columns=['samples_per_sec_baseline', 'peak_mb_baseline', 'error_baseline']).to_string(
+            index=False, float_format='%.3f'))
+    n_regressions = int(df['regression'].sum())
+    print(f'{n_regressions} regressions of {len(df)} measurements, threshold {threshold:.0%}')
+    if n_regressions > 0:
+        sys.exit(1)
+
+
+COMMANDS = ['run', 'compare']
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=COMMANDS,
+                        help='"run" to run benchmarks, "compare" to compare results with a baseline')
+    parser.add_argument('--output', default=None,
+                        help=('.csv where "run" saves results, or that "compare" compares with baseline. '
+                              'Default for "run" is results/benchmarks/benchmark_nets-{host}-{time}.csv'))
+    parser.add_argument('--baseline', default=None,
+                        help='.csv of results saved by a previous run, to compare with')
+    parser.add_argument('--net_names', nargs='+', default=NETS, choices=NETS,
+                        help='architectures to benchmark')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES,
+                        help='what to measure for each architecture')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=BATCH_SIZES)
+    parser.add_argument('--threads', nargs='+', type=int, default=None,
+                        help='numbers of threads. Default is powers of 2 up to number of cores')
+    parser.add_argument('--input_sizes', nargs='+', type=int, default=INPUT_SIZES)
+    parser.add_argument('--n_steps', type=int, default=N_STEPS,
+                        help='number of timed steps per measurement')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='relative change in throughput or peak memory counted as a regression')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(command=args.command,
+         output=args.output,
+         baseline=args.baseline,
+         net_names=args.net_names,
+         modes=args.modes,
+         batch_sizes=args.batch_sizes,
+         threads=args.threads,
+         input_sizes=args.input_sizes,
+         n_steps=args.n_steps,
+         threshold=args.threshold,
+         )
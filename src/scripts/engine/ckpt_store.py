@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""deduplicate checkpoints saved by searchnets, using a content-addressed blob store.
+
+When training with 'transfer' and FREEZE_TRAINED_WEIGHTS = True,
+every checkpoint of every replicate holds another copy of the same frozen ImageNet weights.
+This script converts checkpoints so that any tensor found in more than one checkpoint
+is saved once in a blob store, as a .npy file named by a hash of its contents.
+Each deduplicated checkpoint keeps only the tensors unique to it (e.g. the re-initialized fc8 layer),
+the optimizer state, and references to its tensors in the blob store.
+
+Tensors in the blob store are loaded lazily with memory-mapping,
+so restoring a model from a deduplicated checkpoint only reads the weights that are actually used.
+"""
+from argparse import ArgumentParser
+from collections import Counter
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+
+CKPT_SUFFIX = '-ckpt.pt'
+DEDUP_SUFFIX = '.dedup.pt'
+BLOBS_DIRNAME = 'blobs'
+
+
+def tensor_hash(tensor):
+    """compute hash of a tensor's dtype, shape, and contents
+
+    Returns
+    -------
+    digest : str
+        hexadecimal digest, or None if tensor's dtype can't be represented by numpy
+    """
+    try:
+        arr = np.ascontiguousarray(tensor.detach().cpu().numpy())
+    except TypeError:  # e.g. bfloat16
+        return None
+    sha = hashlib.sha256(f'{arr.dtype.str}{arr.shape}'.encode())
+    sha.update(arr.data)
+    return sha.hexdigest()
+
+
+def blob_path(store_root, digest):
+    """path to blob in store. Uses first two characters of digest as a sub-directory,
+    to avoid having many files in a single directory"""
+    return Path(store_root).joinpath(digest[:2], digest + '.npy')
+
+
+def put(store_root, tensor, digest=None):
+    """save tensor in blob store, if it is not already there
+
+    Returns
+    -------
+    digest : str
+        hash of tensor, used to get it from store
+    """
+    if digest is None:
+        digest = tensor_hash(tensor)
+    path = blob_path(store_root, digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to temporary file then rename, so a blob is never seen partially written
+        tmp_path = path.parent.joinpath(f'{digest}.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as fp:
+            np.save(fp, tensor.detach().cpu().numpy())
+        os.replace(tmp_path, path)
+    return digest
+
+
+def get(store_root, digest, mmap=True):
+    """get tensor from blob store. If mmap is True, the tensor is memory-mapped (copy-on-write)"""
+    arr = np.load(blob_path(store_root, digest), mmap_mode='c' if mmap else None)
+    return torch.from_numpy(arr)
+
+
+def dedup_path(ckpt_path):
+    """path to deduplicated version of a checkpoint"""
+    ckpt_path = Path(ckpt_path)
+    return ckpt_path.with_suffix(DEDUP_SUFFIX)
+
+
+def save(checkpoint, path, store_root, shared_digests):
+    """save a deduplicated checkpoint
+
+    Parameters
+    ----------
+    checkpoint : dict
+        as saved by searchnets.engine.abstract_trainer.AbstractTrainer.save_checkpoint,
+        with keys 'epoch', 'step', 'model', and one for each optimizer
+    path : str, Path
+        where deduplicated checkpoint should be saved
+    store_root : str, Path
+        root of blob store
+    shared_digests : set
+        of digests of tensors that should be saved in the blob store.
+        Tensors in the model state dict with other digests are saved in the checkpoint itself.
+    """
+    path = Path(path)
+    manifest = {key: val for key, val in checkpoint.items() if key != 'model'}
+    manifest['model_keys'] = list(checkpoint['model'].keys())
+    manifest['model'] = {}
+    manifest['model_blobs'] = {}
+    for key, tensor in checkpoint['model'].items():
+        digest = tensor_hash(tensor)
+        if digest is not None and digest in shared_digests:
+            manifest['model_blobs'][key] = put(store_root, tensor, digest)
+        else:
+            manifest['model'][key] = tensor
+    manifest['blob_root'] = os.path.relpath(store_root, path.parent)
+    torch.save(manifest, path)
+
+
+def load(path, mmap=True):
+    """load a deduplicated checkpoint
+
+    Returns
+    -------
+    checkpoint : dict
+        with the same keys and values as the original checkpoint
+    """
+    path = Path(path)
+    manifest = torch.load(path, map_location='cpu')
+    store_root = path.parent.joinpath(manifest.pop('blob_root'))
+    inline = manifest.pop('model')
+    blobs = manifest.pop('model_blobs')
+    manifest['model'] = {
+        key: inline[key] if key in inline else get(store_root, blobs[key], mmap)
+        for key in manifest.pop('model_keys')
+    }
+    return manifest
+
+
+def load_checkpoint(path):
+    """load a checkpoint, either deduplicated or as saved by searchnets"""
+    if str(path).endswith(DEDUP_SUFFIX):
+        return load(path)
+    return torch.load(path, map_location='cpu')
+
+
+def main(checkpoints_root,
+         store_root=None,
+         remove_originals=False,
+         ):
+    """deduplicate all checkpoints found in checkpoints_root
+
+    Parameters
+    ----------
+    checkpoints_root : str, Path
+        path to root of directory with checkpoints saved by searchnets.
+        All files ending with '-ckpt.pt' are deduplicated.
+    store_root : str, Path
+        path to root of blob store. Default is None,
+        in which case a 'blobs' directory in checkpoints_root is used.
+    remove_originals : bool
+        if True, remove each original checkpoint after checking that the deduplicated version
+        restores identical tensors. Default is False.
+    """
+    checkpoints_root = Path(checkpoints_root)
+    if not checkpoints_root.is_dir():
+        raise NotADirectoryError(
+            f'checkpoints_root not found: {checkpoints_root}'
+        )
+    if store_root is None:
+        store_root = checkpoints_root.joinpath(BLOBS_DIRNAME)
+
+    ckpt_paths = sorted(checkpoints_root.glob(f'**/*{CKPT_SUFFIX}'))
+    print(f'found {len(ckpt_paths)} checkpoints in {checkpoints_root}')
+
+    # first pass: find tensors that are in more than one checkpoint, or already in the store.
+    # Tensors in the store count as shared even if only one checkpoint has them now,
+    # e.g. when a replicate is added after the originals of earlier replicates were removed
+    digest_counts = Counter()
+    for ckpt_path in ckpt_paths:
+        print(f'hashing tensors in: {ckpt_path}')
+        checkpoint = torch.load(ckpt_path, map_location='cpu')
+        digest_counts.update(set(tensor_hash(tensor) for tensor in checkpoint['model'].values()))
+    shared_digests = {digest for digest, count in digest_counts.items()
+                      if digest is not None and (count > 1 or blob_path(store_root, digest).exists())}
+
+    # second pass: save
+    size_before = size_after = 0
+    for ckpt_path in ckpt_paths:
+        print(f'deduplicating: {ckpt_path}')
+        checkpoint = torch.load(ckpt_path, map_location='cpu')
+        path = dedup_path(ckpt_path)
+        save(checkpoint, path, store_root, shared_digests)
+
+        restored = load(path)
+        for key, tensor in checkpoint['model'].items():
+            if not torch.equal(tensor, restored['model'][key]):
+                raise ValueError(
+                    f'restored tensor {key} does not match original in checkpoint: {ckpt_path}'
+                )
+
+        size_before += ckpt_path.stat().st_size
+        size_after += path.stat().st_size
+        if remove_originals:
+            ckpt_path.unlink()
+
+    size_after += sum(blob.stat().st_size for blob in Path(store_root).glob('**/*.npy'))
+    print(f'size of checkpoints before: {size_before / 1e6:.1f} MB, '
+          f'after (including blob store): {size_after / 1e6:.1f} MB')
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('checkpoints_root',
+                        help=('path to root of directory with checkpoints saved by searchnets, '
+                              'e.g. results/searchstims/checkpoints'))
+    parser.add_argument('--store_root',
+                        help=('path to root of blob store where tensors shared by checkpoints are saved. '
+                              'Default is a "blobs" directory in checkpoints_root'),
+                        default=None)
+    parser.add_argument('--remove_originals', action='store_true',
+                        help=('if specified, remove original checkpoints after verifying '
+                              'that deduplicated checkpoints restore identical tensors'))
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(checkpoints_root=args.checkpoints_root,
+         store_root=args.store_root,
+         remove_originals=args.remove_originals,
+         )
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""compare accuracy and speed of cpu inference backends to the original fp32 models,
+for each training replicate specified by a config.
+
+For searchstims datasets, accuracy is computed for each visual search stimulus and set size,
+so it's possible to see whether e.g. quantization changes the effect of set size.
+For the Visual Search Difficulty dataset, accuracy is the label-wise accuracy, as computed by `searchnets assay`.
+
+Saves a .csv in the test results directory specified by the config,
+with one row per replicate, backend, stimulus, and set size.
+Use the results to choose a backend for test_replicates.py.
+"""
+from argparse import ArgumentParser
+import os
+from pathlib import Path
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from searchnets.config import parse_config
+from searchnets.utils.general import make_save_path
+
+import cpu_backends
+import test_replicates
+
+
+def predict(output, dataset_type, loss_func):
+    """convert outputs of a network into predictions"""
+    if dataset_type == 'VSD':
+        if loss_func == 'BCE':
+            return (torch.sigmoid(output) > test_replicates.SIGMOID_THRESHOLD).numpy()
+        else:
+            y_pred = np.zeros(output.shape, dtype=bool)
+            y_pred[np.arange(output.shape[0]), output.argmax(dim=1).numpy()] = True
+            return y_pred
+    else:
+        return output.argmax(dim=1).numpy()
+
+
+def correct(y_pred, decoded, dataset_type):
+    """score predictions for each sample. For VSD, the score is the fraction of labels predicted correctly"""
+    if dataset_type == 'VSD':
+        return (y_pred == (decoded['target'].numpy() == 1)).mean(axis=1)
+    else:
+        return (y_pred == decoded['target'].numpy()).astype(float)
+
+
+def main(config_file,
+         backends,
+         n_calib_batches=test_replicates.N_CALIB_BATCHES,
+         replicates=None,
+         ):
+    """compare cpu inference backends to fp32
+
+    Parameters
+    ----------
+    config_file : str, Path
+        path to config.ini file used with searchnets
+    backends : list
+        of str, backends to compare with fp32. Any of cpu_backends.BACKENDS.
+    n_calib_batches : int
+        number of batches from the validation set used to calibrate the 'static-int8' backend.
+        Default is 10.
+    replicates : list
+        of int, training replicates to compare. Default is None, in which case all replicates are compared.
+    """
+    config = parse_config(config_file)
+    dataset_type = config.data.dataset_type
+    net_name = config.train.net_name
+    loss_func = config.train.loss_func
+    batch_size = config.train.batch_size
+    if replicates is None:
+        replicates = list(range(1, config.train.number_nets_to_train + 1))
+    backends = [backend for backend in backends if backend != 'fp32']
+
+    if config.train.random_seed:
+        np.random.seed(config.train.random_seed)
+        torch.manual_seed(config.train.random_seed)
+    device = torch.device('cpu')
+
+    testset = test_replicates.get_dataset(
+        config, 'test', test_replicates.get_uint8_transform(dataset_type, config.data.pad_size)
+    )
+    decoded = test_replicates.decode_testset(testset, batch_size, config.train.num_workers)
+    if dataset_type == 'searchstims':
+        conditions = pd.DataFrame({'stimulus': testset.df['stimulus'].values,
+                                   'set_size': testset.set_size})
+    else:
+        conditions = pd.DataFrame({'stimulus': np.full(len(testset), 'VSD'),
+                                   'set_size': np.full(len(testset), np.nan)})
+
+    if 'static-int8' in backends:
+        calib_inputs = test_replicates.get_calibration_inputs(config, n_calib_batches)
+    else:
+        calib_inputs = None
+    example_input = test_replicates.to_float(decoded['img'][:batch_size], dataset_type)
+
+    model = test_replicates.build_model(net_name, config.data.num_classes)
+
+    test_results_save_path = config.test.test_results_save_path
+    if not os.path.isdir(test_results_save_path):
+        os.makedirs(test_results_save_path)
+    results_fname_stem = str(Path(config_file).stem)  # remove .ini extension
+
+    for epochs in config.train.epochs_list:
+        dfs = []
+        for net_number in replicates:
+            restore_path = make_save_path(config.train.save_path, net_name, net_number, epochs)
+            ckpt_path = test_replicates.get_ckpt_path(restore_path)
+            print(f'Loading model from {ckpt_path}')
+            model.load_state_dict(test_replicates.load_state_dict(ckpt_path))
+
+            y_pred = {}
+            images_per_sec = {}
+            for backend in ['fp32'] + backends:
+                try:
+                    exported = cpu_backends.export(model, backend, example_input, calib_inputs)
+                except ValueError as e:
+                    print(f'skipping backend {backend}: {e}')
+                    continue
+                tic = time.perf_counter()
+                output = test_replicates.forward(exported, decoded['img'], batch_size, device, dataset_type,
+                                                 desc=f'replicate {net_number}, {backend}')
+                images_per_sec[backend] = len(testset) / (time.perf_counter() - tic)
+                y_pred[backend] = predict(output, dataset_type, loss_func)
+
+            correct_fp32 = correct(y_pred['fp32'], decoded, dataset_type)
+            for backend, y_pred_backend in y_pred.items():
+                df = conditions.copy()
+                df['acc'] = correct(y_pred_backend, decoded, dataset_type)
+                df['acc_fp32'] = correct_fp32
+                same = y_pred_backend == y_pred['fp32']
+                df['agreement'] = same.all(axis=1) if same.ndim > 1 else same
+                # VSD has no set sizes. Don't group by the column of NaNs, because groupby drops NaN keys
+                group_cols = ['stimulus', 'set_size'] if dataset_type == 'searchstims' else ['stimulus']
+                df = df.groupby(group_cols).mean().reset_index()
+                df['acc_delta'] = df['acc'] - df['acc_fp32']
+                df.insert(0, 'replicate', net_number)
+                df.insert(1, 'backend', backend)
+                df['images_per_sec'] = images_per_sec[backend]
+                dfs.append(df)
+
+        df = pd.concat(dfs)
+        df.insert(0, 'net_name', net_name)
+        df.insert(3, 'loss_func', loss_func)
+        csv_fname = os.path.join(test_results_save_path,
+                                 f'{results_fname_stem}_trained_{epochs}_epochs_cpu_backends.csv')
+        df.to_csv(csv_fname, index=False)
+
+        summary = df.groupby('backend').agg(max_abs_acc_delta=('acc_delta', lambda x: x.abs().max()),
+                                            min_agreement=('agreement', 'min'),
+                                            images_per_sec=('images_per_sec', 'mean'))
+        print(f'{net_name} trained for {epochs} epochs, comparison with fp32:')
+        print(summary)
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('config_file',
+                        help='path to config.ini file used with searchnets')
+    parser.add_argument('--backends', nargs='+',
+                        help='backends to compare with fp32',
+                        choices=cpu_backends.BACKENDS,
+                        default=cpu_backends.BACKENDS[1:])
+    parser.add_argument('--n_calib_batches', type=int,
+                        help='number of batches from validation set used to calibrate static-int8 backend',
+                        default=test_replicates.N_CALIB_BATCHES)
+    parser.add_argument('--replicates', nargs='+', type=int,
+                        help='training replicates to compare. Default is all replicates',
+                        default=None)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(config_file=args.config_file,
+         backends=args.backends,
+         n_calib_batches=args.n_calib_batches,
+         replicates=args.replicates,
+         )
@@ -0,0 +1,140 @@
+"""backends for running inference with trained models on the CPU.
+
+Each backend "exports" a module:
+
+- 'fp32' : the module as is, in eval mode.
+- 'traced' : the module traced into a TorchScript graph.
+  With versions of torch that support them, inputs are converted to channels-last memory format,
+  and the graph is frozen and optimized for inference
+  (which folds batch norm into convolutions and fuses conv / linear layers with activations).
+- 'dynamic-int8' : linear layers quantized to int8 with dynamic activation ranges, then traced.
+  Linear layers hold most of the parameters of alexnet and VGG16.
+- 'static-int8' : convolutional and linear layers quantized to int8 with eager mode static quantization,
+  using activation ranges observed on calibration batches, e.g. from the validation set. Then traced.
+
+All backends accept and return float tensors, so an exported module can be used anywhere the original was.
+"""
+import copy
+
+import torch
+import torch.nn as nn
+from torch.quantization import QuantWrapper, convert, fuse_modules, get_default_qconfig, prepare, quantize_dynamic
+
+BACKENDS = ['fp32', 'traced', 'dynamic-int8', 'static-int8']
+
+# memory formats and ``torch.jit.optimize_for_inference`` were added in later versions of torch
+# than the one in environment.yml, so they are only used when available
+HAS_CHANNELS_LAST = hasattr(torch, 'channels_last')
+HAS_OPTIMIZE_FOR_INFERENCE = hasattr(torch.jit, 'optimize_for_inference')
+
+# (layer, activation) pairs that fuse_modules can fuse
+FUSABLE = [(nn.Conv2d, nn.ReLU), (nn.Linear, nn.ReLU)]
+
+
+class ChannelsLast(nn.Module):
+    """convert 4-D inputs to channels-last memory format.
+    Used as the first layer of traced modules, so callers can pass in contiguous tensors."""
+    def forward(self, x):
+        if x.dim() == 4:
+            return x.contiguous(memory_format=torch.channels_last)
+        return x
+
+
+def fusable_names(module):
+    """get names of layers in module that can be fused with the activation that follows them,
+    i.e. consecutive children of a ``torch.nn.Sequential``, in the format expected by ``fuse_modules``"""
+    names = []
+    for parent_name, parent in module.named_modules():
+        if not isinstance(parent, nn.Sequential):
+            continue
+        children = list(parent.named_children())
+        for (name, child), (next_name, next_child) in zip(children[:-1], children[1:]):
+            if any(isinstance(child, layer) and isinstance(next_child, activation)
+                   for layer, activation in FUSABLE):
+                prefix = f'{parent_name}.' if parent_name else ''
+                names.append([prefix + name, prefix + next_name])
+    return names
+
+
+def quantize_static(module, calib_inputs):
+    """quantize module to int8 with eager mode static quantization
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+        in eval mode, on the cpu
+    calib_inputs : iterable
+        of torch.Tensor, batches used to observe ranges of activations
+
+    Returns
+    -------
+    quantized : torch.nn.Module
+        that quantizes its float inputs and dequantizes its outputs
+    """
+    names = fusable_names(module)
+    if names:
+        module = fuse_modules(module, names)
+    module = QuantWrapper(module)
+    module.qconfig = get_default_qconfig(torch.backends.quantized.engine)
+    prepare(module, inplace=True)
+    with torch.no_grad():
+        for x in calib_inputs:
+            module(x)
+    return convert(module)
+
+
+def export(module, backend, example_input, calib_inputs=None):
+    """export a module for inference on the CPU with the specified backend
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+        to export. Not modified; backends other than 'fp32' export a copy,
+        so that e.g. weights for another training replicate can still be loaded into the original.
+    backend : str
+        one of ``BACKENDS``
+    example_input : torch.Tensor
+        a batch of input with the shape expected by module, used for tracing
+    calib_inputs : iterable
+        of torch.Tensor, batches used to calibrate 'static-int8'.
+        Required when backend is 'static-int8', ignored otherwise.
+
+    Returns
+    -------
+    exported : torch.nn.Module or torch.jit.ScriptModule
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'invalid backend: {backend}. Valid backends are: {BACKENDS}'
+        )
+
+    module.eval()
+    if backend == 'fp32':
+        return module
+
+    module = copy.deepcopy(module).cpu()
+    example_input = example_input.cpu()
+    if backend == 'dynamic-int8':
+        module = quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+    elif backend == 'static-int8':
+        if calib_inputs is None:
+            raise ValueError(
+                "must specify calib_inputs when backend is 'static-int8'"
+            )
+        if any(type(submodule).__name__ == 'CORblock_S' for submodule in module.modules()):
+            # CORblock_S re-uses conv2 across time steps, changing its stride during the forward pass,
+            # but a quantized convolution has a fixed stride
+            raise ValueError(
+                "backend 'static-int8' is not supported for CORnet_S"
+            )
+        module = quantize_static(module, [x.cpu() for x in calib_inputs])
+
+    if HAS_CHANNELS_LAST:
+        module = nn.Sequential(ChannelsLast(), module).to(memory_format=torch.channels_last)
+    module.eval()
+    with torch.no_grad():
+        exported = torch.jit.trace(module, example_input)
+        if HAS_OPTIMIZE_FOR_INFERENCE:
+            # optimize_for_inference freezes the module first, then fuses ops
+            exported = torch.jit.optimize_for_inference(exported)
+    return exported
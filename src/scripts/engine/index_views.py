@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""make index views: subsets of one canonical searchstims dataset, defined by an array of row indices and a seed.
+
+Instead of preparing a separate split .csv for every variant of a dataset
+(e.g. 30000, 60000, and 120000 training samples, or only set size 1, or targets only in some locations),
+prepare one canonical split .csv with the largest training set, then make a view for each variant:
+
+    python index_views.py canonical_split.csv 30000samples.view.npz --train_size_per_set_size 200,400,800,1600
+
+A view file holds the indices of the rows of the canonical .csv that are in the view,
+the seed, and the arguments used to make it, so it takes a few kilobytes.
+To train or test with a view, set CSV_FILE_OUT in the config to the path of the view file.
+``get_dataset`` in test_replicates.py then loads the canonical .csv and keeps only the rows in the view.
+
+Training sets are sampled separately from each stratum of stimulus type, set size, and target condition,
+in an order determined only by the seed and the stratum, so views made with the same seed are nested:
+a view with 200 samples per stratum contains the view with 100 samples per stratum.
+Validation and test sets are only filtered by stimulus type and set size,
+so all views of a canonical dataset are evaluated on the same stimuli.
+"""
+from argparse import ArgumentParser
+import json
+import os
+from pathlib import Path
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from searchnets.datasets import Searchstims
+
+VIEW_SUFFIX = '.view.npz'
+SEED = 42
+
+
+def is_view(path):
+    return str(path).endswith(VIEW_SUFFIX)
+
+
+def stratum_order(n_rows, seed, key):
+    """order in which rows of one stratum are sampled, determined only by the seed and the stratum"""
+    # RandomState, not default_rng, which needs numpy >= 1.17
+    rng = np.random.RandomState([seed, zlib.crc32(json.dumps(key).encode())])
+    return rng.permutation(n_rows)
+
+
+def target_in_mask(df, target_mask):
+    """for each row of a searchstims .csv, whether any target in the stimulus is in a cell where target_mask is 1"""
+    in_mask = np.zeros(len(df), dtype=bool)
+    for ind, (root_output_dir, meta_file) in enumerate(zip(df['root_output_dir'], df['meta_file'])):
+        meta_file = Path(meta_file)
+        if not meta_file.is_absolute():
+            meta_file = Path(root_output_dir).joinpath(meta_file)
+        with meta_file.open() as fp:
+            grid_as_char = np.asarray(json.load(fp)['grid_as_char'])
+        in_mask[ind] = np.any(np.logical_and(grid_as_char == 't', target_mask))
+    return in_mask
+
+
+def select(df,
+           stim_types=None,
+           set_sizes=None,
+           train_size_per_set_size=None,
+           train_size=None,
+           target_mask=None,
+           seed=SEED):
+    """select rows of a canonical split .csv that are in a view
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        canonical split .csv, as generated by ``searchnets split``
+    stim_types : list
+        of str, visual search stimulus types to keep. Default is None, in which case all are kept.
+    set_sizes : list
+        of int, visual search set sizes to keep. Default is None, in which case all are kept.
+    train_size_per_set_size : list
+        of int, number of training samples of each stimulus type for each set size, in order of set size,
+        half with target present and half with target absent, like TRAIN_SIZE_PER_SET_SIZE in a config.
+        Default is None.
+    train_size : int
+        total number of training samples, split evenly across stimulus types, set sizes, and target conditions.
+        Only used if train_size_per_set_size is None. Default is None, in which case all are kept.
+    target_mask : numpy.ndarray
+        of 0s and 1s, with the shape of the grid used to make stimuli.
+        If not None, training samples with target present are only kept if a target is in a cell where
+        target_mask is 1, and samples with target absent are then dropped
+        so the two conditions have the same number of samples for each stimulus type and set size.
+        Default is None.
+    seed : int
+        seed that determines which training samples are kept from each stratum. Default is 42.
+
+    Returns
+    -------
+    rows : numpy.ndarray
+        indices of rows in view, sorted
+    """
+    keep = np.ones(len(df), dtype=bool)
+    if stim_types is not None:
+        keep &= df['stimulus'].isin(stim_types).values
+    if set_sizes is not None:
+        keep &= df['set_size'].isin(set_sizes).values
+    is_train = (df['split'] == 'train').values
+
+    if target_mask is not None:
+        present = keep & is_train & (df['target_condition'] == 'present').values
+        keep[present] = target_in_mask(df[present], target_mask)
+
+    df_train = df[keep & is_train]
+    view_set_sizes = np.sort(df_train['set_size'].unique())
+    view_stim_types = sorted(df_train['stimulus'].unique())
+    if train_size_per_set_size is not None:
+        if len(train_size_per_set_size) != len(view_set_sizes):
+            raise ValueError(
+                f'train_size_per_set_size has length {len(train_size_per_set_size)} '
+                f'but there are {len(view_set_sizes)} set sizes in view: {view_set_sizes}'
+            )
+        size_by_set_size = dict(zip(view_set_sizes, train_size_per_set_size))
+    elif train_size is not None:
+        size_by_set_size = {set_size: train_size // (len(view_stim_types) * len(view_set_sizes))
+                            for set_size in view_set_sizes}
+    else:
+        size_by_set_size = None
+
+    train_rows = []
+    for (stim_type, set_size), df_stratum in df_train.groupby(['stimulus', 'set_size']):
+        by_target_condition = {
+            target_condition: df_stratum.index.values[(df_stratum['target_condition'] == target_condition).values]
+            for target_condition in ('present', 'absent')
+        }
+        if size_by_set_size is None:
+            n_by_target_condition = {target_condition: len(rows)
+                                     for target_condition, rows in by_target_condition.items()}
+            if target_mask is not None:
+                n_balanced = min(n_by_target_condition.values())
+                n_by_target_condition = {'present': n_balanced, 'absent': n_balanced}
+        else:
+            n_present = size_by_set_size[set_size] // 2
+            n_by_target_condition = {'present': n_present, 'absent': size_by_set_size[set_size] - n_present}
+
+        for target_condition, rows in by_target_condition.items():
+            n_rows = n_by_target_condition[target_condition]
+            if n_rows > len(rows):
+                raise ValueError(
+                    f'view needs {n_rows} training samples with stimulus {stim_type}, set size {set_size}, '
+                    f'and target {target_condition}, but canonical dataset only has {len(rows)}'
+                )
+            order = stratum_order(len(rows), seed, [str(stim_type), int(set_size), target_condition])
+            train_rows.append(rows[order[:n_rows]])
+
+    rows = np.concatenate([df.index.values[keep & ~is_train]] + train_rows)
+    return np.sort(rows)
+
+
+class View:
+    """rows of a canonical split .csv that are in a view, loaded from a view file"""
+    def __init__(self, path):
+        path = Path(path)
+        with np.load(path) as npz:
+            self.rows = npz['rows'].astype(np.int64)
+            self.n_rows_canonical = int(npz['n_rows_canonical'])
+            self.seed = int(npz['seed'])
+            self.spec = json.loads(str(npz['spec']))
+            csv_file = Path(str(npz['csv_file']))
+        # relative to the view file, so a directory with both can be moved
+        self.csv_file = csv_file if csv_file.is_absolute() else path.parent.joinpath(csv_file)
+
+
+def read_csv(csv_file):
+    """read a split .csv, or the rows of a canonical split .csv that are in a view, if csv_file is a view file"""
+    if not is_view(csv_file):
+        return pd.read_csv(csv_file)
+    view = View(csv_file)
+    df = pd.read_csv(view.csv_file)
+    if len(df) != view.n_rows_canonical:
+        raise ValueError(
+            f'view {csv_file} was made from a .csv with {view.n_rows_canonical} rows, '
+            f'but {view.csv_file} has {len(df)} rows'
+        )
+    return df.iloc[view.rows]
+
+
+def apply(dataset, view):
+    """keep only the samples in a Searchstims dataset that are in view, in place
+
+    Parameters
+    ----------
+    dataset : searchnets.datasets.Searchstims
+        made from view.csv_file
+    view : View
+
+    Returns
+    -------
+    dataset
+    """
+    if not isinstance(dataset, Searchstims):
+        raise TypeError(
+            f'views can only be applied to Searchstims datasets, not: {type(dataset)}'
+        )
+    # Searchstims keeps the index of the canonical .csv when it selects rows of a split
+    keep = np.isin(dataset.df.index.values, view.rows)
+    dataset.df = dataset.df[keep]
+    dataset.img_paths = dataset.img_paths[keep]
+    dataset.target_condition = dataset.target_condition[keep]
+    dataset.set_size = dataset.set_size[keep]
+    return dataset
+
+
+def main(csv_file,
+         view_file,
+         stim_types=None,
+         set_sizes=None,
+         train_size_per_set_size=None,
+         train_size=None,
+         target_mask=None,
+         seed=SEED):
+    """make a view of a canonical split .csv and save it
+
+    Parameters
+    ----------
+    csv_file : str, Path
+        path to canonical split .csv, as generated by ``searchnets split``
+    view_file : str, Path
+        path where view is saved, must end with '.view.npz'
+    stim_types, set_sizes, train_size_per_set_size, train_size, target_mask, seed
+        see ``select``
+    """
+    if not is_view(view_file):
+        raise ValueError(
+            f'filename of view must end with {VIEW_SUFFIX}, but was: {view_file}'
+        )
+    csv_file, view_file = Path(csv_file), Path(view_file)
+    df = pd.read_csv(csv_file)
+    rows = select(df, stim_types, set_sizes, train_size_per_set_size, train_size, target_mask, seed)
+    spec = {
+        'stim_types': stim_types,
+        'set_sizes': set_sizes,
+        'train_size_per_set_size': train_size_per_set_size,
+        'train_size': train_size,
+        'target_mask': None if target_mask is None else np.asarray(target_mask).tolist(),
+    }
+    view_file.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(view_file,
+                        rows=rows.astype(np.uint32),
+                        n_rows_canonical=len(df),
+                        seed=seed,
+                        spec=json.dumps(spec),
+                        csv_file=os.path.relpath(csv_file.resolve(), view_file.parent.resolve()))
+    df_view = df.iloc[rows]
+    print(f'saved view with {len(rows)} of {len(df)} rows in {view_file}, samples per split:\n'
+          f'{df_view["split"].value_counts().to_string()}')
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('csv_file',
+                        help='path to canonical split .csv generated by searchnets split')
+    parser.add_argument('view_file',
+                        help=f'path where view is saved, must end with {VIEW_SUFFIX}')
+    parser.add_argument('--stim_types', default=None,
+                        help='comma-separated list of visual search stimulus types to keep',
+                        type=lambda stim_types: stim_types.split(','))
+    parser.add_argument('--set_sizes', default=None,
+                        help='comma-separated list of set sizes to keep',
+                        type=lambda set_sizes: [int(set_size) for set_size in set_sizes.split(',')])
+    parser.add_argument('--train_size_per_set_size', default=None,
+                        help=('comma-separated list, number of training samples of each stimulus type '
+                              'for each set size, like TRAIN_SIZE_PER_SET_SIZE in a config'),
+                        type=lambda sizes: [int(size) for size in sizes.split(',')])
+    parser.add_argument('--train_size', type=int, default=None,
+                        help='total number of training samples, split evenly across stimulus types and set sizes')
+    parser.add_argument('--target_mask', default=None,
+                        help=('comma-separated rows of the grid used to make stimuli, 1 where targets can be, '
+                              'e.g. 11100,11100,11100,11100,11100 for the left three columns of a 5x5 grid'),
+                        type=lambda mask: np.array([[int(cell) for cell in row] for row in mask.split(',')]))
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed that determines which training samples are kept')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(csv_file=args.csv_file,
+         view_file=args.view_file,
+         stim_types=args.stim_types,
+         set_sizes=args.set_sizes,
+         train_size_per_set_size=args.train_size_per_set_size,
+         train_size=args.train_size,
+         target_mask=args.target_mask,
+         seed=args.seed,
+         )
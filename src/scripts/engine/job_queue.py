@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""job queue on a shared filesystem, for training replicates of many configs across many nodes.
+
+Each job trains one replicate of one config, with train_replicates.py.
+The queue is a directory with one sub-directory per job state:
+
+    queue_root/
+        pending/   jobs waiting for a worker
+        running/   jobs claimed by a worker. The file is the worker's lease,
+                   named {job_id}.{claim_id}.json, with an id unique to each claim
+        done/      jobs that finished
+        failed/    jobs that failed max_attempts times
+
+Each job is a .json file that moves between these directories.
+Workers claim a job by renaming it from pending/ to running/,
+which is atomic, so exactly one worker gets each job without any server or lock manager.
+While a job runs, its worker "heartbeats" by updating the modification time of the lease.
+Any worker that finds a lease with no heartbeat for longer than lease_timeout
+(e.g. because the node died) moves that job back to pending/.
+Since each claim has its own lease file, a worker whose lease was reclaimed can't heartbeat or finish
+a later claim of the same job by another worker; it finds its lease gone, and stops.
+Because train_replicates.py is resumable, the next worker to claim it resumes from the latest checkpoint.
+
+Start any number of workers on any number of nodes that can see queue_root, e.g.
+
+    $ python src/scripts/engine/job_queue.py add queue/ data/configs/searchstims/*.ini
+    $ python src/scripts/engine/job_queue.py work queue/ --n_workers 4
+    $ python src/scripts/engine/job_queue.py status queue/
+"""
+from argparse import ArgumentParser
+import json
+from multiprocessing import Process
+import os
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from searchnets.config import parse_config
+
+STATES = ('pending', 'running', 'done', 'failed')
+
+HEARTBEAT_INTERVAL = 30  # seconds
+LEASE_TIMEOUT = 600
+POLL_INTERVAL = 10
+MAX_ATTEMPTS = 3
+
+TRAIN_SCRIPT = Path(__file__).parent.joinpath('train_replicates.py')
+
+
+def make_dirs(queue_root):
+    queue_root = Path(queue_root)
+    for state in STATES:
+        queue_root.joinpath(state).mkdir(parents=True, exist_ok=True)
+
+
+def write_json(path, obj):
+    """write .json file to a temporary file then rename, so it is never read partially written"""
+    path = Path(path)
+    tmp_path = path.parent.joinpath(f'.{path.name}.{socket.gethostname()}.{os.getpid()}.tmp')
+    with tmp_path.open('w') as fp:
+        json.dump(obj, fp, indent=2)
+    os.replace(tmp_path, path)
+
+
+def add(queue_root, job_id, command):
+    """add a job to the queue, unless a job with the same id is already in it
+
+    Parameters
+    ----------
+    queue_root : str, Path
+        root of queue directory
+    job_id : str
+        unique name of job, used as its filename
+    command : list
+        of str, command line to run, passed to subprocess.Popen
+
+    Returns
+    -------
+    added : bool
+        True if job was added
+    """
+    queue_root = Path(queue_root)
+    make_dirs(queue_root)
+    fname = f'{job_id}.json'
+    if (any(queue_root.joinpath(state, fname).exists() for state in STATES if state != 'running')
+            or any(queue_root.joinpath('running').glob(f'{job_id}.*.json'))):
+        return False
+    write_json(queue_root.joinpath('pending', fname),
+               {'job_id': job_id, 'command': [str(arg) for arg in command], 'attempts': 0, 'history': []})
+    return True
+
+
+def add_configs(queue_root, config_files, replicates=None):
+    """add one job for each replicate of each config
+
+    Parameters
+    ----------
+    queue_root : str, Path
+        root of queue directory
+    config_files : list
+        of paths to config.ini files
+    replicates : list
+        of int, replicates to add. Default is None, in which case
+        all replicates are added, i.e. 1 to NUMBER_NETS_TO_TRAIN.
+    """
+    n_added = 0
+    for config_file in config_files:
+        config_file = Path(config_file).resolve()
+        if replicates is None:
+            replicates_this_config = range(1, parse_config(config_file).train.number_nets_to_train + 1)
+        else:
+            replicates_this_config = replicates
+        for net_number in replicates_this_config:
+            job_id = f'{config_file.stem}_net_number_{net_number}'
+            command = [sys.executable, TRAIN_SCRIPT, config_file, '--replicates', net_number]
+            n_added += add(queue_root, job_id, command)
+    print(f'added {n_added} jobs to queue: {queue_root}')
+
+
+def claim(queue_root, worker_id):
+    """claim a pending job, by renaming it into running/
+
+    Returns
+    -------
+    lease_path : Path
+        path to job file in running/, or None if there were no pending jobs
+    """
+    queue_root = Path(queue_root)
+    for job_path in sorted(queue_root.joinpath('pending').glob('*.json')):
+        claim_id = uuid.uuid4().hex[:12]
+        lease_path = queue_root.joinpath('running', f'{job_path.stem}.{claim_id}.json')
+        try:
+            # first heartbeat, before the rename, since rename keeps the modification time
+            # and a job that waited in pending/ longer than the lease timeout would arrive looking stale
+            os.utime(job_path)
+            os.rename(job_path, lease_path)
+            job = json.loads(lease_path.read_text())
+        except FileNotFoundError:
+            continue  # another worker claimed it first, or reclaimed it
+        job['attempts'] += 1
+        job['history'].append({'worker': worker_id, 'claim_id': claim_id, 'claimed': time.time()})
+        write_json(lease_path, job)
+        return lease_path
+    return None
+
+
+def reclaim_stale(queue_root, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+    """move jobs whose lease has not had a heartbeat for longer than lease_timeout back to pending/,
+    or to failed/ if they have already been attempted max_attempts times"""
+    queue_root = Path(queue_root)
+    now = time.time()
+    for lease_path in queue_root.joinpath('running').glob('*.json'):
+        try:
+            if now - lease_path.stat().st_mtime < lease_timeout:
+                continue
+            job = json.loads(lease_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue  # finished, or being re-written by its worker
+        state = 'failed' if job['attempts'] >= max_attempts else 'pending'
+        try:
+            os.rename(lease_path, queue_root.joinpath(state, f'{job["job_id"]}.json'))
+        except FileNotFoundError:
+            continue  # another worker reclaimed it, or it finished
+        print(f'reclaimed stale job {job["job_id"]}, moved to {state}/')
+
+
+def run(lease_path, heartbeat_interval=HEARTBEAT_INTERVAL):
+    """run job, heartbeating while it runs.
+    If the lease disappears, e.g. because the job was reclaimed as stale, the job is killed.
+
+    Returns
+    -------
+    returncode : int
+        of job's process, or None if the lease was lost
+    """
+    job = json.loads(lease_path.read_text())
+    proc = subprocess.Popen(job['command'])
+    while True:
+        try:
+            returncode = proc.wait(timeout=heartbeat_interval)
+            return returncode
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            os.utime(lease_path)
+        except FileNotFoundError:
+            print(f'lost lease for job {job["job_id"]}, killing it')
+            proc.kill()
+            proc.wait()
+            return None
+
+
+def finish(queue_root, lease_path, returncode, max_attempts=MAX_ATTEMPTS):
+    """move job out of running/ after it exits:
+    to done/ if it succeeded, back to pending/ to be retried if it failed, or to failed/ after max_attempts"""
+    queue_root = Path(queue_root)
+    # first rename lease to a name that reclaim_stale doesn't look for, so it can't be reclaimed while it's updated
+    finish_path = lease_path.with_name(f'.{lease_path.name}.finishing')
+    try:
+        os.rename(lease_path, finish_path)
+    except FileNotFoundError:
+        return  # lease was reclaimed
+    job = json.loads(finish_path.read_text())
+    job['history'][-1].update({'finished': time.time(), 'returncode': returncode})
+    if returncode == 0:
+        state = 'done'
+    elif job['attempts'] >= max_attempts:
+        state = 'failed'
+    else:
+        state = 'pending'
+    write_json(finish_path, job)
+    os.rename(finish_path, queue_root.joinpath(state, f'{job["job_id"]}.json'))
+    print(f'job {job["job_id"]} exited with return code {returncode}, moved to {state}/')
+
+
+def work(queue_root,
+         heartbeat_interval=HEARTBEAT_INTERVAL,
+         lease_timeout=LEASE_TIMEOUT,
+         poll_interval=POLL_INTERVAL,
+         max_attempts=MAX_ATTEMPTS,
+         exit_when_empty=True):
+    """worker loop: claim and run jobs until there are none left"""
+    queue_root = Path(queue_root)
+    make_dirs(queue_root)
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    while True:
+        reclaim_stale(queue_root, lease_timeout, max_attempts)
+        lease_path = claim(queue_root, worker_id)
+        if lease_path is None:
+            # keep waiting while other workers' jobs are running, in case they fail or go stale
+            if exit_when_empty and not any(queue_root.joinpath('running').glob('*.json')):
+                print(f'worker {worker_id}: no jobs left, exiting')
+                return
+            time.sleep(poll_interval)
+            continue
+        print(f'worker {worker_id}: running job {lease_path.stem.rsplit(".", 1)[0]}')
+        returncode = run(lease_path, heartbeat_interval)
+        if returncode is not None:
+            finish(queue_root, lease_path, returncode, max_attempts)
+
+
+def status(queue_root):
+    """print number of jobs in each state, and running jobs"""
+    queue_root = Path(queue_root)
+    for state in STATES:
+        job_paths = sorted(queue_root.joinpath(state).glob('*.json'))
+        print(f'{state}: {len(job_paths)}')
+        if state == 'running':
+            for job_path in job_paths:
+                seconds = time.time() - job_path.stat().st_mtime
+                print(f'    {job_path.stem.rsplit(".", 1)[0]}, last heartbeat {seconds:.0f} seconds ago')
+
+
+def main(command,
+         queue_root,
+         config_files=None,
+         replicates=None,
+         n_workers=1,
+         heartbeat_interval=HEARTBEAT_INTERVAL,
+         lease_timeout=LEASE_TIMEOUT,
+         max_attempts=MAX_ATTEMPTS,
+         ):
+    """run command on the job queue in queue_root
+
+    Parameters
+    ----------
+    command : str
+        one of {'add', 'work', 'status'}
+    queue_root : str, Path
+        root of queue directory, on a filesystem shared by all nodes
+    config_files : list
+        of paths to config.ini files. Used with 'add'.
+    replicates : list
+        of int, replicates to add. Default is None, in which case all replicates are added.
+        Used with 'add'.
+    n_workers : int
+        number of worker processes to start on this node. Used with 'work'. Default is 1.
+    heartbeat_interval : int
+        seconds between heartbeats. Default is 30.
+    lease_timeout : int
+        seconds without a heartbeat after which a running job is considered stale. Default is 600.
+    max_attempts : int
+        number of times a job is attempted before it is moved to failed/. Default is 3.
+    """
+    if command == 'add':
+        add_configs(queue_root, config_files, replicates)
+    elif command == 'work':
+        kwargs = dict(heartbeat_interval=heartbeat_interval, lease_timeout=lease_timeout,
+                      max_attempts=max_attempts)
+        if n_workers == 1:
+            work(queue_root, **kwargs)
+        else:
+            workers = [Process(target=work, args=(queue_root,), kwargs=kwargs) for _ in range(n_workers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+    elif command == 'status':
+        status(queue_root)
+    else:
+        raise ValueError(
+            f'invalid command: {command}'
+        )
+
+
+COMMANDS = ['add', 'work', 'status']
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=COMMANDS,
+                        help=('"add" to add jobs for configs, "work" to start workers that run jobs, '
+                              'or "status" to print number of jobs in each state'))
+    parser.add_argument('queue_root',
+                        help='path to root of queue directory, on a filesystem shared by all nodes')
+    parser.add_argument('config_files', nargs='*',
+                        help='paths to config.ini files, used with "add"')
+    parser.add_argument('--replicates', nargs='+', type=int,
+                        help='replicates to add for each config. Default is all replicates',
+                        default=None)
+    parser.add_argument('--n_workers', type=int, default=1,
+                        help='number of worker processes to start on this node')
+    parser.add_argument('--heartbeat_interval', type=int, default=HEARTBEAT_INTERVAL,
+                        help='seconds between heartbeats')
+    parser.add_argument('--lease_timeout', type=int, default=LEASE_TIMEOUT,
+                        help='seconds without a heartbeat after which a running job is reclaimed')
+    parser.add_argument('--max_attempts', type=int, default=MAX_ATTEMPTS,
+                        help='number of times a job is attempted before it is moved to failed')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(command=args.command,
+         queue_root=args.queue_root,
+         config_files=args.config_files,
+         replicates=args.replicates,
+         n_workers=args.n_workers,
+         heartbeat_interval=args.heartbeat_interval,
+         lease_timeout=args.lease_timeout,
+         max_attempts=args.max_attempts,
+         )
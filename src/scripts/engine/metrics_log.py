@@ -0,0 +1,148 @@
+"""buffered logging of scalar metrics, a low-overhead replacement for writing summaries with SummaryWriter.
+
+``MetricsLogger.add_scalar`` only copies the step and wall time into preallocated NumPy arrays,
+and keeps a reference to the value, which may be a tensor still on the GPU.
+Values are converted and written to disk in batches, when a buffer is full or when ``flush`` is called,
+so logging every step doesn't add a device sync or a file write to every step.
+
+Each scalar tag is saved in its own append-only file in the log directory,
+named by the URL-quoted tag with the suffix '.metrics',
+e.g. 'loss%2Ftrain.metrics' for 'loss/train'.
+A file is a sequence of fixed-size records with the fields in RECORD_DTYPE,
+so it can be read with a single call to numpy.frombuffer.
+Use ``log_dir2df`` to load all tags in a directory into a DataFrame
+with the same layout as ``searchnets.tensorboard.logdir2df``.
+"""
+import os
+from pathlib import Path
+import time
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+RECORD_DTYPE = np.dtype([('step', '<i8'), ('wall_time', '<f8'), ('value', '<f8')])
+SUFFIX = '.metrics'
+BUFFER_SIZE = 1000
+
+
+def tag_path(log_dir, tag):
+    return Path(log_dir).joinpath(quote(tag, safe='') + SUFFIX)
+
+
+def path_tag(path):
+    return unquote(Path(path).name[:-len(SUFFIX)])
+
+
+def read_records(path):
+    """read records from a .metrics file, ignoring a partially-written record at the end"""
+    data = Path(path).read_bytes()
+    n_records = len(data) // RECORD_DTYPE.itemsize
+    return np.frombuffer(data[:n_records * RECORD_DTYPE.itemsize], dtype=RECORD_DTYPE)
+
+
+def purge(path, purge_step=None):
+    """remove records with step greater than or equal to purge_step, like SummaryWriter's purge_step,
+    and a partially-written record at the end, e.g. from a process killed while writing.
+    The partial record has to be removed, even if no steps are purged,
+    or records appended after it would start at the wrong offset and be read as garbage"""
+    records = read_records(path)
+    keep = np.ones(records.shape[0], dtype=bool) if purge_step is None else records['step'] < purge_step
+    is_partial = path.stat().st_size % RECORD_DTYPE.itemsize != 0
+    if keep.all() and not is_partial:
+        return
+    tmp_path = path.parent.joinpath(path.name + '.tmp')
+    tmp_path.write_bytes(records[keep].tobytes())
+    os.replace(tmp_path, path)
+
+
+class MetricsLogger:
+    """logs scalars to .metrics files, with the same ``add_scalar`` method as SummaryWriter
+
+    Parameters
+    ----------
+    log_dir : str, Path
+        directory where .metrics files are saved
+    buffer_size : int
+        number of values of each tag to buffer before writing them to disk. Default is 1000.
+    mirror : torch.utils.tensorboard.SummaryWriter
+        if not None, scalars logged at steps that are multiples of mirror_step are also written to it,
+        so training can still be watched with TensorBoard. Default is None.
+    mirror_step : int
+        interval at which scalars are written to mirror
+    purge_step : int
+        if not None, remove records with step greater than or equal to purge_step
+        from files already in log_dir, e.g. when resuming training from a checkpoint. Default is None.
+        Partially-written records at the end of files already in log_dir are always removed.
+    """
+    def __init__(self, log_dir, buffer_size=BUFFER_SIZE, mirror=None, mirror_step=None, purge_step=None):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.buffer_size = buffer_size
+        self.mirror = mirror
+        self.mirror_step = mirror_step
+        self.records = {}
+        self.values = {}
+        for path in self.log_dir.glob(f'*{SUFFIX}'):
+            purge(path, purge_step)
+
+    def add_scalar(self, tag, scalar_value, global_step=None, walltime=None):
+        if tag not in self.records:
+            self.records[tag] = np.zeros(self.buffer_size, dtype=RECORD_DTYPE)
+            self.values[tag] = []
+        values = self.values[tag]
+        ind = len(values)
+        self.records[tag]['step'][ind] = global_step
+        self.records[tag]['wall_time'][ind] = time.time() if walltime is None else walltime
+        # keep tensors as they are, so they are copied from the device when flushed instead of now
+        values.append(scalar_value.detach() if hasattr(scalar_value, 'detach') else scalar_value)
+
+        if self.mirror is not None and global_step % self.mirror_step == 0:
+            self.mirror.add_scalar(tag, scalar_value, global_step, walltime)
+
+        if len(values) == self.buffer_size:
+            self.flush_tag(tag)
+
+    def flush_tag(self, tag):
+        values = self.values[tag]
+        if not values:
+            return
+        records = self.records[tag][:len(values)]
+        records['value'] = [float(value) for value in values]
+        with tag_path(self.log_dir, tag).open('ab') as fp:
+            fp.write(records.tobytes())
+        self.values[tag] = []
+
+    def flush(self):
+        for tag in self.records:
+            self.flush_tag(tag)
+        if self.mirror is not None:
+            self.mirror.flush()
+
+    def close(self):
+        self.flush()
+        if self.mirror is not None:
+            self.mirror.close()
+
+
+def read_tag(log_dir, tag):
+    """read records for one tag
+
+    Returns
+    -------
+    records : numpy.ndarray
+        structured array with fields 'step', 'wall_time', and 'value'
+    """
+    return read_records(tag_path(log_dir, tag))
+
+
+def log_dir2df(log_dir):
+    """load all tags in a log directory into a DataFrame,
+    indexed by step, with one column per tag, like searchnets.tensorboard.logdir2df"""
+    dfs = []
+    for path in sorted(Path(log_dir).glob(f'*{SUFFIX}')):
+        records = read_records(path)
+        df = pd.DataFrame({path_tag(path): records['value']}, index=pd.Index(records['step'], name='step'))
+        # keep the last value if a step was logged more than once
+        dfs.append(df[~df.index.duplicated(keep='last')])
+    return pd.concat(dfs, axis=1).sort_index()
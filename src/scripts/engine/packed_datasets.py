@@ -0,0 +1,97 @@
+"""pack the filenames in searchnets datasets into flat buffers, so DataLoader workers don't copy them.
+
+VOCDetection keeps the paths to images and annotations as Python lists of str.
+Every time a DataLoader worker gets an item, it increments the reference count of the path str,
+which writes to the page of memory that holds it, so the operating system copies the page into that worker.
+Over an epoch each worker ends up with its own copy of every page, and memory grows with the number of workers.
+Searchstims keeps its paths in a NumPy array of fixed-width unicode strings, which doesn't have this problem,
+but uses 4 bytes per character times the length of the longest path for every path.
+
+``StringTable`` stores strings as a single buffer of utf-8 bytes plus an array of offsets.
+Getting a string creates a new str from the buffer, without touching any shared Python objects.
+With ``share_memory``, the buffers are moved into shared memory, so workers started with 'spawn'
+also map the same memory instead of getting a pickled copy.
+"""
+import numpy as np
+import torch
+
+from searchnets.datasets import Searchstims, VOCDetection
+
+
+class StringTable:
+    """immutable sequence of strings, stored as one array of utf-8 bytes and an array of offsets into it"""
+    def __init__(self, strings):
+        encoded = [string.encode() for string in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(bytes_) for bytes_ in encoded], out=self.offsets[1:])
+        self.data = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+        self.shared = None
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(
+                f'index {idx} out of range for StringTable with length {len(self)}'
+            )
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode()
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def share_memory(self):
+        """move buffers into shared memory. Pickling with torch.multiprocessing then shares them"""
+        if self.shared is None:
+            self.shared = (torch.from_numpy(self.data).share_memory_(),
+                           torch.from_numpy(self.offsets).share_memory_())
+            self.data, self.offsets = self.shared[0].numpy(), self.shared[1].numpy()
+        return self
+
+    def __getstate__(self):
+        if self.shared is not None:
+            return {'shared': self.shared}
+        return {'data': self.data, 'offsets': self.offsets}
+
+    def __setstate__(self, state):
+        if 'shared' in state:
+            self.shared = state['shared']
+            self.data, self.offsets = self.shared[0].numpy(), self.shared[1].numpy()
+        else:
+            self.shared = None
+            self.data, self.offsets = state['data'], state['offsets']
+
+
+def pack(dataset, share_memory=True):
+    """replace the paths in a searchnets dataset with StringTables, in place.
+    Labels and set sizes are already NumPy arrays of numbers.
+
+    Parameters
+    ----------
+    dataset : searchnets.datasets.Searchstims or searchnets.datasets.VOCDetection
+    share_memory : bool
+        if True, move StringTables into shared memory. Default is True.
+
+    Returns
+    -------
+    dataset
+        the same dataset, which can be used exactly as before
+    """
+    if isinstance(dataset, VOCDetection):
+        dataset.images = StringTable(dataset.images)
+        dataset.annotations = StringTable(dataset.annotations)
+        tables = [dataset.images, dataset.annotations]
+    elif isinstance(dataset, Searchstims):
+        dataset.img_paths = StringTable(dataset.img_paths)
+        tables = [dataset.img_paths]
+    else:
+        raise TypeError(
+            f'can only pack Searchstims or VOCDetection datasets, not: {type(dataset)}'
+        )
+    if share_memory:
+        for table in tables:
+            table.share_memory()
+    return dataset
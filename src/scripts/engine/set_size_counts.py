@@ -0,0 +1,85 @@
+"""counts of predictions on the validation set for each visual search stimulus, set size, and target condition,
+computed from the predictions made during validation, so accuracy by set size can be tracked every epoch
+without another pass over a dataset.
+
+Counts for one validation are an array with shape (stimuli, set sizes, target conditions, predictions),
+i.e., a 2 x 2 confusion matrix for each stimulus and set size,
+where index 0 is 'target absent' and 1 is 'target present'.
+"""
+import numpy as np
+
+N_CLASSES = 2  # target absent, target present
+
+COUNTS_SUFFIX = '_val_counts_by_epoch.npz'
+
+
+def get_conditions(dataset):
+    """get condition of each sample in a Searchstims dataset, as an integer code
+    that indexes into the flattened counts array
+
+    Returns
+    -------
+    stimuli : numpy.ndarray
+        unique visual search stimuli in dataset
+    set_sizes : numpy.ndarray
+        unique set sizes in dataset
+    codes : numpy.ndarray
+        of int, code for (stimulus, set size, target condition) of each sample, in dataset order
+    """
+    stimuli, stim_inds = np.unique(np.asarray(dataset.df['stimulus'], dtype=str), return_inverse=True)
+    set_sizes, set_size_inds = np.unique(dataset.set_size, return_inverse=True)
+    codes = (stim_inds * set_sizes.shape[0] + set_size_inds) * N_CLASSES + dataset.target_condition
+    return stimuli, set_sizes, codes
+
+
+def count(codes, y_pred, n_stimuli, n_set_sizes):
+    """count predictions for each condition with a single bincount
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        returned by ``get_conditions``
+    y_pred : numpy.ndarray
+        of int, predicted class for each sample, in dataset order
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        with shape (n_stimuli, n_set_sizes, N_CLASSES, N_CLASSES)
+    """
+    counts = np.bincount(codes * N_CLASSES + y_pred,
+                         minlength=n_stimuli * n_set_sizes * N_CLASSES * N_CLASSES)
+    return counts.reshape(n_stimuli, n_set_sizes, N_CLASSES, N_CLASSES)
+
+
+def acc_by_set_size(counts):
+    """accuracy for each set size, across stimuli and target conditions
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        returned by ``count``, or with extra leading dimensions, e.g. (epochs, stimuli, set sizes, ...)
+    """
+    correct = np.trace(counts, axis1=-2, axis2=-1).sum(axis=-2)
+    total = counts.sum(axis=(-4, -2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return correct / total
+
+
+def save(path, counts_by_epoch, steps, stimuli, set_sizes):
+    """save counts for every epoch in a single .npz file"""
+    np.savez_compressed(path, counts=counts_by_epoch, steps=steps, stimuli=stimuli, set_sizes=set_sizes)
+
+
+def load(path):
+    """load counts saved by ``save``
+
+    Returns
+    -------
+    counts : dict
+        with keys 'counts', an array with shape (epochs, stimuli, set sizes, N_CLASSES, N_CLASSES),
+        'steps', the step of the validation used for each epoch (0 if none),
+        'stimuli', and 'set_sizes'
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        return {key: npz[key] for key in npz.files}
@@ -0,0 +1,121 @@
+"""loader that decodes the training set ahead of training, one "shard" at a time, in a background thread.
+
+The order of samples for an epoch comes from a sampler, as for a DataLoader,
+so shuffling is across the whole training set, not within shards.
+That order is cut into shards of shard_size samples.
+While training runs on the batches of shard k, a background thread decodes shard k + 1 into memory
+(with DataLoader workers, if num_workers > 0), so training never waits on reading files at a shard boundary
+as long as decoding a shard takes less time than training on one.
+
+At most three shards are in memory at once: the one being trained on, the next one (decoded and waiting),
+and the one after that (being decoded). shard_size can be chosen from a memory budget with ``shard_size_from_budget``.
+"""
+import queue
+import threading
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+MEMORY_BUDGET_MB = 2048
+N_SHARDS_IN_MEMORY = 3
+PUT_TIMEOUT = 1  # seconds, to check whether iteration stopped while waiting to put a shard in the queue
+
+
+def sample_nbytes(dataset):
+    """number of bytes used by the tensors and arrays in one decoded sample of dataset"""
+    nbytes = 0
+    for value in dataset[0].values():
+        if torch.is_tensor(value):
+            nbytes += value.element_size() * value.nelement()
+        elif isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+    return nbytes
+
+
+def shard_size_from_budget(dataset, memory_budget_mb, batch_size):
+    """largest number of samples per shard, in whole batches,
+    that keeps N_SHARDS_IN_MEMORY decoded shards within memory_budget_mb"""
+    n_samples = int(memory_budget_mb * 2 ** 20 / (N_SHARDS_IN_MEMORY * sample_nbytes(dataset)))
+    return max(1, n_samples // batch_size) * batch_size
+
+
+class ShardPrefetchLoader:
+    """iterable over batches of a dataset, like a DataLoader, that decodes a shard ahead in a background thread
+
+    Parameters
+    ----------
+    dataset : torch.utils.data.Dataset
+    batch_size : int
+    sampler : torch.utils.data.Sampler
+        determines order of samples. Iterated once per epoch.
+    num_workers : int
+        number of DataLoader workers used by the background thread. Default is 0.
+    shard_size : int
+        number of samples per shard, rounded down to a whole number of batches.
+        Default is None, in which case it is determined from memory_budget_mb.
+    memory_budget_mb : int
+        maximum memory used by decoded shards, in megabytes. Default is 2048.
+    pin_memory : bool
+        passed to DataLoader. Default is False.
+    """
+    def __init__(self, dataset, batch_size, sampler, num_workers=0, shard_size=None,
+                 memory_budget_mb=MEMORY_BUDGET_MB, pin_memory=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        if shard_size is None:
+            shard_size = shard_size_from_budget(dataset, memory_budget_mb, batch_size)
+        self.shard_size = max(1, shard_size // batch_size) * batch_size
+
+    def __len__(self):
+        return int(np.ceil(len(self.sampler) / self.batch_size))
+
+    def load_shards(self, indices, shards, stopped):
+        """target of background thread: decode batches and put them in the shards queue, one shard at a time"""
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    shards.put(item, timeout=PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        loader = DataLoader(self.dataset, batch_size=self.batch_size, sampler=indices,
+                            num_workers=self.num_workers, pin_memory=self.pin_memory)
+        try:
+            shard = []
+            for batch in loader:
+                shard.append(batch)
+                if len(shard) * self.batch_size >= self.shard_size:
+                    if not put(shard):
+                        return
+                    shard = []
+            if shard and not put(shard):
+                return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    def __iter__(self):
+        # maxsize 1: one shard waiting while the next is decoded
+        shards = queue.Queue(maxsize=N_SHARDS_IN_MEMORY - 2)
+        stopped = threading.Event()
+        thread = threading.Thread(target=self.load_shards, args=(list(self.sampler), shards, stopped),
+                                  daemon=True)
+        thread.start()
+        try:
+            while True:
+                shard = shards.get()
+                if shard is None:
+                    return
+                if isinstance(shard, Exception):
+                    raise shard
+                yield from shard
+        finally:
+            # e.g. training stopped early, don't leave the thread waiting to put a shard
+            stopped.set()
+            thread.join()
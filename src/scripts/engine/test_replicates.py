@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""evaluate all training replicates for a config in a single pass over the test set.
+
+The `searchnets test` and `searchnets assay` commands restore each replicate's checkpoint,
+then load and decode the entire test set again for that replicate.
+This script decodes the test set once, keeps it in memory as a tensor of uint8 images,
+and streams that tensor through every replicate.
+
+For configs where part of the network was frozen during training
+(i.e. 'transfer' with FREEZE_TRAINED_WEIGHTS = True), the frozen "trunk" is run only once,
+and its output is streamed through the remaining layers ("heads") of each replicate.
+The trunk is found by comparing checkpoints, not assumed from the config,
+because e.g. the running statistics of batch norm layers in CORnet_S
+are updated during training even when weights are frozen.
+
+Models can also be run with one of the cpu inference backends in cpu_backends.py,
+e.g. traced and quantized to int8, by specifying --backend.
+
+Writes the same output files as `searchnets test` and `searchnets assay`.
+Note that because images are decoded once, all replicates see the same random padding
+of Visual Search Difficulty images, and the same random class for 'CE-random' targets.
+"""
+from argparse import ArgumentParser
+from collections import defaultdict, OrderedDict
+import os
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn.metrics
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from searchnets import nets
+from searchnets.analysis.searchstims import compute_d_prime
+from searchnets.config import parse_config
+from searchnets.datasets import Searchstims, VOCDetection
+from searchnets.engine.abstract_trainer import AbstractTrainer
+from searchnets.transforms.util import get_transforms
+from searchnets.utils.general import make_save_path
+
+import ckpt_store
+import cpu_backends
+import index_views
+from uint8_batches import get_uint8_transform, to_float
+
+SIGMOID_THRESHOLD = 0.5
+N_CALIB_BATCHES = 10
+
+
+def get_dataset(config, split, transform):
+    """get split of dataset specified by config, with targets transformed as they are by searchnets.
+    For searchstims, CSV_FILE_OUT can also be a view made with index_views.py"""
+    _, target_transform = get_transforms(config.data.dataset_type, config.train.loss_func, config.data.pad_size)
+    if config.data.dataset_type == 'VSD':
+        return VOCDetection(root=config.data.root,
+                            csv_file=config.data.csv_file_out,
+                            image_set='trainval',
+                            split=split,
+                            download=True,
+                            transform=transform,
+                            target_transform=target_transform)
+    elif config.data.dataset_type == 'searchstims':
+        if index_views.is_view(config.data.csv_file_out):
+            view = index_views.View(config.data.csv_file_out)
+            return index_views.apply(Searchstims(csv_file=view.csv_file,
+                                                 split=split,
+                                                 transform=transform,
+                                                 target_transform=target_transform),
+                                     view)
+        return Searchstims(csv_file=config.data.csv_file_out,
+                           split=split,
+                           transform=transform,
+                           target_transform=target_transform)
+    else:
+        raise ValueError(
+            f'invalid dataset_type: {config.data.dataset_type}'
+        )
+
+
+def get_calibration_inputs(config, n_batches):
+    """get batches of images from validation set, to calibrate quantized models.
+    Batches are drawn randomly, so they include all stimuli and set sizes."""
+    valset = get_dataset(config, 'val', get_uint8_transform(config.data.dataset_type, config.data.pad_size))
+    generator = torch.Generator()
+    generator.manual_seed(config.train.random_seed)
+    # a shuffled list of indices as the sampler, since DataLoader only takes a generator in torch >= 1.6
+    order = torch.randperm(len(valset), generator=generator).tolist()
+    loader = DataLoader(valset, batch_size=config.train.batch_size, sampler=order,
+                        num_workers=config.train.num_workers)
+    calib_inputs = []
+    for batch in loader:
+        calib_inputs.append(to_float(batch['img'], config.data.dataset_type))
+        if len(calib_inputs) == n_batches:
+            break
+    return calib_inputs
+
+
+def decode_testset(testset, batch_size, num_workers):
+    """decode all samples in test set into memory
+
+    Parameters
+    ----------
+    testset : searchnets.datasets.Searchstims, searchnets.datasets.VOCDetection
+        with transform returned by ``get_uint8_transform``
+    batch_size : int
+        number of samples loaded at a time
+    num_workers : int
+        number of workers used by torch.DataLoader
+
+    Returns
+    -------
+    decoded : dict
+        with same keys as samples from test set.
+        'img' is a uint8 tensor with shape (n_samples, channels, height, width),
+        other tensor-valued keys are concatenated, and others (e.g. 'name') are lists.
+    """
+    loader = DataLoader(testset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    imgs = None
+    start = 0
+    decoded = defaultdict(list)
+    for batch in tqdm(loader, desc='decoding test set'):
+        img_batch = batch.pop('img')
+        if imgs is None:
+            # pre-allocate so we don't need memory for a copy when concatenating
+            imgs = torch.empty((len(testset), *img_batch.shape[1:]), dtype=torch.uint8)
+        imgs[start:start + img_batch.shape[0]] = img_batch
+        start += img_batch.shape[0]
+        for key, val in batch.items():
+            decoded[key].append(val)
+
+    decoded = {
+        key: torch.cat(val) if isinstance(val[0], torch.Tensor) else [el for batch in val for el in batch]
+        for key, val in decoded.items()
+    }
+    decoded['img'] = imgs
+    return decoded
+
+
+def build_model(net_name, num_classes):
+    """build model without pre-trained weights, like searchnets.engine.tester.Tester.from_config"""
+    if net_name == 'alexnet':
+        model = nets.alexnet.build(pretrained=False, progress=False, num_classes=num_classes)
+    elif net_name == 'VGG16':
+        model = nets.vgg16.build(pretrained=False, progress=False, num_classes=num_classes)
+    elif 'cornet' in net_name.lower():
+        model = nets.cornet.build(model_name=net_name, pretrained=False, num_classes=num_classes)
+    else:
+        raise ValueError(
+            f'invalid value for net_name: {net_name}'
+        )
+    return model
+
+
+def get_stages(model, net_name):
+    """get modules that, applied in order, compute the same output as ``model.forward``
+
+    Returns
+    -------
+    stages : list
+        of (name, module) tuples, where name is the prefix of that module's keys in the model's state dict
+    """
+    if net_name == 'alexnet' or net_name == 'VGG16':
+        stages = [('features', model.features), ('avgpool', model.avgpool), ('flatten', nn.Flatten(1))]
+        stages += [(f'classifier.{name}', module) for name, module in model.classifier.named_children()]
+    elif 'cornet' in net_name.lower():
+        stages = [(name, module) for name, module in model.named_children() if name != 'decoder']
+        stages += [(f'decoder.{name}', module) for name, module in model.decoder.named_children()]
+    else:
+        raise ValueError(
+            f'invalid value for net_name: {net_name}'
+        )
+    return stages
+
+
+def as_module(stages):
+    """combine stages returned by ``get_stages`` into one module"""
+    return nn.Sequential(OrderedDict([(name.replace('.', '_'), module) for name, module in stages]))
+
+
+def get_ckpt_path(restore_path):
+    """get path to checkpoint saved upon best validation accuracy,
+    or if there is none, to the checkpoint saved during or at the end of training.
+    Same logic as searchnets.engine.tester.Tester,
+    except that checkpoints deduplicated by ckpt_store.py are also found."""
+    best_ckpt_path = restore_path.parent.joinpath(
+        restore_path.name + AbstractTrainer.BEST_VAL_ACC_CKPT_SUFFIX
+    )
+    ckpt_path = restore_path.parent.joinpath(
+        restore_path.name + AbstractTrainer.DEFAULT_CKPT_SUFFIX)
+    for path in (best_ckpt_path, ckpt_store.dedup_path(best_ckpt_path),
+                 ckpt_path, ckpt_store.dedup_path(ckpt_path)):
+        if path.exists():
+            return path
+
+    raise ValueError(
+        f'did not find a checkpoint file in restore path: {restore_path}.\n'
+        f'Looked for a checkpoint saved upon best val accuracy: {best_ckpt_path.name} \n'
+        f'and for a checkpoint saved during or at the end of training: {ckpt_path.name}'
+    )
+
+
+def load_state_dict(ckpt_path):
+    """load model state dict from a checkpoint, onto the cpu.
+    Removes the 'module.' prefix added to keys when a model was trained with torch.nn.DataParallel"""
+    checkpoint = ckpt_store.load_checkpoint(ckpt_path)
+    return {
+        key[len('module.'):] if key.startswith('module.') else key: val
+        for key, val in checkpoint['model'].items()
+    }
+
+
+def n_shared_stages(stages, state_dicts):
+    """find number of stages, counting from the input, with identical parameters and buffers in all state dicts"""
+    reference = state_dicts[0]
+    for stage_ind, (name, _) in enumerate(stages):
+        keys = [key for key in reference.keys() if key.startswith(name + '.')]
+        for state_dict in state_dicts[1:]:
+            if not all(torch.equal(reference[key], state_dict[key]) for key in keys):
+                return stage_ind
+    return len(stages)
+
+
+def forward(module, inputs, batch_size, device, dataset_type=None, desc=None):
+    """apply module to inputs one batch at a time.
+    If dataset_type is specified, inputs are uint8 images that are converted with ``to_float``.
+
+    Returns
+    -------
+    outputs : torch.Tensor
+        on the cpu, concatenated across batches
+    """
+    outputs = []
+    with torch.no_grad():
+        for start in tqdm(range(0, inputs.shape[0], batch_size), desc=desc):
+            x = inputs[start:start + batch_size].to(device)
+            if dataset_type is not None:
+                x = to_float(x, dataset_type)
+            outputs.append(module(x).cpu())
+    return torch.cat(outputs)
+
+
+def batch_mean(values, batch_size):
+    """mean of means computed on each batch,
+    to match how searchnets.engine.tester.Tester averages metrics across batches"""
+    return np.mean([values[start:start + batch_size].mean()
+                    for start in range(0, values.shape[0], batch_size)])
+
+
+def get_loss(output, decoded, loss_func):
+    """compute loss for each sample"""
+    if loss_func in {'CE', 'BCE'}:
+        target = decoded['target']
+    elif loss_func == 'CE-largest':
+        target = decoded['largest']
+    elif loss_func == 'CE-random':
+        target = decoded['random']
+
+    if loss_func in {'CE', 'CE-largest', 'CE-random'}:
+        loss = F.cross_entropy(output, target, reduction='none')
+    elif loss_func == 'BCE':
+        loss = F.binary_cross_entropy_with_logits(output, target.float(), reduction='none')
+        loss = loss.reshape(loss.shape[0], -1).mean(dim=1)
+    else:
+        raise ValueError(
+            f'invalid value for loss function: {loss_func}'
+        )
+    return loss.numpy()
+
+
+def test_metrics(output, decoded, dataset_type, loss_func, batch_size):
+    """compute same metrics as ``searchnets.engine.tester.Tester.test``, from outputs for the entire test set"""
+    test_results = {'loss': batch_mean(get_loss(output, decoded, loss_func), batch_size)}
+    pred_max = output.argmax(dim=1).numpy()
+    if dataset_type == 'searchstims':
+        test_results['acc'] = batch_mean(pred_max == decoded['target'].numpy(), batch_size)
+        test_results['pred'] = pred_max
+    elif dataset_type == 'VSD':
+        y_true_onehot = decoded['target'].numpy()
+        pred_sig = (torch.sigmoid(output) > SIGMOID_THRESHOLD).float().numpy()
+        test_results['f1'] = np.mean([
+            sklearn.metrics.f1_score(y_true_onehot[start:start + batch_size],
+                                     pred_sig[start:start + batch_size],
+                                     average='macro')
+            for start in range(0, y_true_onehot.shape[0], batch_size)
+        ])
+        test_results['acc_largest'] = batch_mean(pred_max == decoded['largest'].numpy(), batch_size)
+        test_results['acc_random'] = batch_mean(pred_max == decoded['random'].numpy(), batch_size)
+        test_results['pred'] = pred_sig if loss_func == 'BCE' else pred_max
+        test_results['img_names'] = decoded['name']
+    return test_results
+
+
+def assay(output, decoded, loss_func, img_paths):
+    """compute same results as ``searchnets.engine.voc_assayer.VOCAssayer.assay``,
+    from outputs for the entire test set"""
+    y_true_onehot = decoded['target'].numpy()
+    if loss_func == 'BCE':
+        out = torch.sigmoid(output)
+        y_pred = (out > SIGMOID_THRESHOLD).float()
+    elif loss_func == 'CE-largest' or loss_func == 'CE-random':
+        out = torch.softmax(output, dim=1)
+        y_pred = torch.zeros(y_true_onehot.shape)
+        y_pred.scatter_(1, out.argmax(dim=1, keepdim=True), 1)
+    else:
+        raise ValueError(
+            f'invalid value for loss function: {loss_func}'
+        )
+    out, y_pred = out.numpy(), y_pred.numpy()
+
+    true, pred = y_true_onehot == 1, y_pred == 1
+    index = decoded['index'].numpy()
+    images_df = pd.DataFrame({
+        'voc_test_index': index,
+        'img_path': [Path(img_paths[idx]) for idx in index],
+        'img_name': [Path(img_paths[idx]).name for idx in index],
+        'vsd_score': decoded['vsd_score'].numpy(),
+        'TP': (true & pred).sum(axis=1),
+        'FP': (~true & pred).sum(axis=1),
+        'TN': (~true & ~pred).sum(axis=1),
+        'FN': (true & ~pred).sum(axis=1),
+        'n_items': y_true_onehot.sum(axis=1).astype(int),
+    })
+
+    # each class is a trial, so repeat each image's row once per class
+    n_images, n_classes = y_true_onehot.shape
+    trials_df = images_df.loc[images_df.index.repeat(n_classes)].reset_index(drop=True)
+    trials_df['class'] = np.tile(np.arange(n_classes), n_images)
+    trials_df['prob'] = out.ravel()
+    trials_df['pred'] = y_pred.ravel()
+    trials_df['target_present'] = y_true_onehot.ravel()
+
+    y_pred_all, y_true_all = y_pred.ravel(), y_true_onehot.ravel()
+    acc = sklearn.metrics.accuracy_score(y_pred=y_pred_all, y_true=y_true_all)
+    _, _, d_prime = compute_d_prime(y_pred=y_pred_all, y_true=y_true_all)
+
+    return {
+        'arrays': {'y_true_onehot': y_true_onehot, 'out': out, 'y_pred': y_pred},
+        'images_df': images_df,
+        'trials_df': trials_df,
+        'acc': acc,
+        'd_prime': d_prime,
+    }
+
+
+def get_set_sizes(csv_file):
+    """get set sizes from dataset .csv or view, checking they are the same for all visual search stimuli"""
+    df_dataset = index_views.read_csv(csv_file)
+    set_sizes = None
+    for stim_type in df_dataset['stimulus'].unique():
+        set_sizes_this_stim = df_dataset[df_dataset['stimulus'] == stim_type]['set_size'].unique()
+        if set_sizes is None:
+            set_sizes = set_sizes_this_stim
+        elif not np.array_equal(set_sizes_this_stim, set_sizes):
+            raise ValueError('set sizes are not the same across visual search stimuli')
+    return set_sizes
+
+
+def main(config_file, command='all', backend='fp32', n_calib_batches=N_CALIB_BATCHES):
+    """evaluate all training replicates specified by a config.ini file
+
+    Parameters
+    ----------
+    config_file : str, Path
+        path to config.ini file used with searchnets
+    command : str
+        one of {'test', 'assay', 'all'}.
+        'test' saves the same files as the `searchnets test` command,
+        'assay' saves the same files as the `searchnets assay` command,
+        'all' saves both, from one pass through the test set per replicate.
+        Default is 'all'.
+    backend : str
+        backend used to run models, one of cpu_backends.BACKENDS.
+        Default is 'fp32', i.e. the models as they were trained.
+        Other backends always run on the cpu.
+        Use compare_backends.py to check how much they change accuracy before choosing one.
+    n_calib_batches : int
+        number of batches from the validation set used to calibrate the 'static-int8' backend.
+        Default is 10.
+    """
+    config = parse_config(config_file)
+    dataset_type = config.data.dataset_type
+    net_name = config.train.net_name
+    loss_func = config.train.loss_func
+    method = config.train.method
+    mode = config.train.mode
+    batch_size = config.train.batch_size
+
+    if mode != 'classify':
+        raise ValueError(
+            f"only 'classify' mode is supported, but mode was: {mode}"
+        )
+    if command in {'assay', 'all'} and dataset_type != 'VSD':
+        if command == 'assay':
+            raise ValueError(
+                f"'assay' is only defined for dataset_type 'VSD', but dataset_type was: {dataset_type}"
+            )
+        command = 'test'
+
+    if config.train.random_seed:
+        np.random.seed(config.train.random_seed)
+        torch.manual_seed(config.train.random_seed)
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+
+    if torch.cuda.is_available() and backend == 'fp32':
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+
+    testset = get_dataset(config, 'test', get_uint8_transform(dataset_type, config.data.pad_size))
+    if dataset_type == 'searchstims':
+        set_sizes = get_set_sizes(config.data.csv_file_out)
+        set_size_vec_test = testset.set_size
+
+    if backend == 'static-int8':
+        calib_inputs = get_calibration_inputs(config, n_calib_batches)
+    else:
+        calib_inputs = None
+
+    decoded = decode_testset(testset, batch_size, config.train.num_workers)
+    if dataset_type == 'searchstims':
+        y_test = decoded['target'].numpy()
+
+    model = build_model(net_name, config.data.num_classes)
+    model.eval()
+    model.to(device)
+    stages = get_stages(model, net_name)
+
+    test_results_save_path = config.test.test_results_save_path
+    if not os.path.isdir(test_results_save_path):
+        os.makedirs(test_results_save_path)
+    results_fname_stem = str(Path(config_file).stem)  # remove .ini extension
+
+    for epochs in config.train.epochs_list:
+        print(f'evaluating {net_name} models trained for {epochs} epochs on test set')
+
+        restore_paths = [make_save_path(config.train.save_path, net_name, net_number, epochs)
+                         for net_number in range(1, config.train.number_nets_to_train + 1)]
+        ckpt_paths = [get_ckpt_path(restore_path) for restore_path in restore_paths]
+
+        # compare each checkpoint to the first, one at a time, so only two are in memory at once
+        reference = load_state_dict(ckpt_paths[0])
+        n_shared = len(stages)
+        for ckpt_path in ckpt_paths[1:]:
+            n_shared = min(n_shared, n_shared_stages(stages, [reference, load_state_dict(ckpt_path)]))
+        del reference
+
+        inputs = decoded['img']
+        input_type = dataset_type
+        example_input = to_float(inputs[:batch_size], dataset_type)
+        head_calib_inputs = calib_inputs
+        if n_shared > 0:
+            print(f'stages shared by all replicates: {[name for name, _ in stages[:n_shared]]}')
+            model.load_state_dict(load_state_dict(ckpt_paths[0]))
+            trunk = cpu_backends.export(as_module(stages[:n_shared]), backend, example_input, calib_inputs)
+            inputs = forward(trunk, inputs, batch_size, device, input_type, desc='shared stages')
+            input_type = None
+            example_input = inputs[:batch_size]
+            if calib_inputs is not None:
+                with torch.no_grad():
+                    head_calib_inputs = [trunk(x) for x in calib_inputs]
+
+        test_records = defaultdict(list)
+        predictions_per_model_dict = {}
+        acc_per_set_size_per_model = []
+        acc_per_set_size_model_dict = {}
+        img_names_per_model_dict = {}
+
+        assay_records = defaultdict(list)
+        df_lists = defaultdict(list)
+        arrays_per_model = {}
+
+        for net_number, (restore_path, ckpt_path) in enumerate(zip(restore_paths, ckpt_paths), start=1):
+            print(f'Loading model from {ckpt_path}')
+            model.load_state_dict(load_state_dict(ckpt_path))
+            head = as_module(stages[n_shared:])
+            if len(head) > 0:
+                head = cpu_backends.export(head, backend, example_input, head_calib_inputs)
+            output = forward(head, inputs, batch_size, device, input_type,
+                             desc=f'replicate {net_number}')
+
+            if command in {'test', 'all'}:
+                test_results = test_metrics(output, decoded, dataset_type, loss_func, batch_size)
+
+                test_records['net_name'].append(net_name)
+                test_records['replicate'].append(net_number)
+                test_records['method'].append(method)
+                test_records['loss_func'].append(loss_func)
+                # searchnets.test assigns the last restore path to every row; here each row gets its own
+                test_records['restore_path'].append(restore_path)
+
+                if dataset_type == 'searchstims':
+                    test_records['acc'].append(test_results['acc'])
+                    correct = test_results['pred'] == y_test
+                    acc_per_set_size = [correct[set_size_vec_test == set_size].mean() for set_size in set_sizes]
+                    print(' '.join([f'set size {set_size}: {acc}.'
+                                    for set_size, acc in zip(set_sizes, acc_per_set_size)]))
+                    acc_per_set_size_per_model.append(acc_per_set_size)
+                    acc_per_set_size_model_dict[restore_path] = acc_per_set_size
+                elif dataset_type == 'VSD':
+                    for metric in ['f1', 'acc_largest', 'acc_random']:
+                        test_records[metric].append(test_results[metric])
+                    results_str = ', '.join(
+                        [f'{key}: {test_results[key]:7.3f}'
+                         for key in ['loss', 'f1', 'acc_largest', 'acc_random']]
+                    )
+                    print(f'test results: {results_str}')
+                    img_names_per_model_dict[restore_path] = test_results['img_names']
+
+                predictions_per_model_dict[restore_path] = test_results['pred']
+
+            if command in {'assay', 'all'}:
+                results = assay(output, decoded, loss_func, testset.images)
+                for key in ('images_df', 'trials_df'):
+                    df = results[key]
+                    df['net_name'] = net_name
+                    df['replicate'] = net_number
+                    df['mode'] = mode
+                    df['method'] = method
+                    df['loss_func'] = loss_func
+                    df['restore_path'] = restore_path
+                    df_lists[key].append(df)
+
+                assay_records['net_name'].append(net_name)
+                assay_records['replicate'].append(net_number)
+                assay_records['mode'].append(mode)
+                assay_records['method'].append(method)
+                assay_records['loss_func'].append(loss_func)
+                assay_records['restore_path'].append(restore_path)
+                for metric in ['acc', 'd_prime']:
+                    assay_records[metric].append(results[metric])
+                print(f"assay results: acc: {results['acc']:7.3f}, d_prime: {results['d_prime']:7.3f}")
+
+                arrays_per_model[restore_path] = results['arrays']
+
+        fname_stem = os.path.join(test_results_save_path, f'{results_fname_stem}_trained_{epochs}_epochs')
+        if command in {'test', 'all'}:
+            results_dict = dict(predictions_per_model_dict=predictions_per_model_dict)
+            if dataset_type == 'searchstims':
+                results_dict.update(dict(acc_per_set_size_per_model=np.squeeze(np.asarray(acc_per_set_size_per_model)),
+                                         acc_per_set_size_model_dict=acc_per_set_size_model_dict,
+                                         set_sizes=set_sizes))
+            elif dataset_type == 'VSD':
+                results_dict.update(dict(img_names_per_model_dict=img_names_per_model_dict))
+            joblib.dump(results_dict, f'{fname_stem}_test_results.gz')
+            pd.DataFrame.from_records(test_records).to_csv(f'{fname_stem}_test_results.csv', index=False)
+
+        if command in {'assay', 'all'}:
+            joblib.dump(arrays_per_model, f'{fname_stem}_assay_arrays.gz')
+            pd.DataFrame.from_records(assay_records).to_csv(f'{fname_stem}_assay_results.csv', index=False)
+            for key, df_list in df_lists.items():
+                pd.concat(df_list).to_csv(f"{fname_stem}_assay_{key.replace('_df', '')}.csv", index=False)
+
+
+COMMANDS = ['test', 'assay', 'all']
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('command',
+                        help=('which output files to save: "test" for the same files as searchnets test, '
+                              '"assay" for the same files as searchnets assay, or "all" for both'),
+                        choices=COMMANDS)
+    parser.add_argument('config_file',
+                        help='path to config.ini file used with searchnets')
+    parser.add_argument('--backend',
+                        help='backend used to run models. Backends other than fp32 always run on the cpu',
+                        choices=cpu_backends.BACKENDS,
+                        default='fp32')
+    parser.add_argument('--n_calib_batches', type=int,
+                        help='number of batches from validation set used to calibrate static-int8 backend',
+                        default=N_CALIB_BATCHES)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(config_file=args.config_file,
+         command=args.command,
+         backend=args.backend,
+         n_calib_batches=args.n_calib_batches,
+         )
@@ -0,0 +1,717 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""train all replicates specified by a config, like `searchnets train`, but resumable.
+
+Checkpoints saved every CKPT_STEP steps also hold everything needed to resume training exactly where it was:
+optimizer state, random number generator states, the early stopping counter and best validation accuracy,
+and the position within the epoch of the sampler that shuffles the training set.
+If training is interrupted, running this script again with the same config resumes each replicate
+from its latest checkpoint, so at most CKPT_STEP steps of work are lost.
+Replicates that finished training are skipped, including replicates trained with `searchnets train`
+whose last checkpoint was saved when training ended.
+
+Each replicate seeds random number generators with RANDOM_SEED + its number,
+so that results for one replicate don't depend on whether the others were skipped.
+
+If SAVE_ACC_BY_SET_SIZE_BY_EPOCH is True and USE_VAL is True, accuracy by set size for each epoch
+is computed from the predictions of the latest validation, instead of with another pass over the training set,
+and counts of predictions for each stimulus, set size, and target condition are saved for each epoch
+(see set_size_counts.py). Since these are accuracies on the validation set, they are saved in
+a separate file ending with '_val_acc_by_epoch_by_set_size.txt', not in the file with accuracies on the training set.
+
+With --async_val, validation runs in a separate process while training continues (see async_validation.py).
+With --metrics_log, summaries are buffered and written in batches to .metrics files (see metrics_log.py),
+instead of being written to a TensorBoard events file every step.
+With --uint8_batches, loader workers decode images to uint8, and batches are converted to float
+and normalized on the training device, one batch at a time (see uint8_batches.py).
+With --peak_memory_mb, blocks of VGG16 and CORnet_S are checkpointed, so their activations
+are recomputed during the backward pass instead of being kept, to fit training within a memory budget
+(see activation_checkpointing.py).
+With --prefetch_memory_mb, the training set is decoded a shard at a time in a background thread,
+ahead of training, using at most that much memory (see shard_prefetch.py).
+"""
+from argparse import ArgumentParser
+import inspect
+import os
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.tensorboard import SummaryWriter
+
+from searchnets.config import parse_config
+from searchnets.engine.trainer import Trainer
+from searchnets.engine.transfer_trainer import TransferTrainer
+from searchnets.transforms.util import get_transforms
+from searchnets.utils.general import make_save_path
+
+import activation_checkpointing
+from async_validation import AsyncValidationMixin, VAL_THREADS
+import metrics_log
+import packed_datasets
+import set_size_counts
+from shard_prefetch import ShardPrefetchLoader
+from uint8_batches import get_uint8_transform, to_float, Uint8Batches
+import test_replicates
+
+# DataLoader accepts prefetch_factor in later versions of torch than the one in environment.yml
+LOADER_HAS_PREFETCH_FACTOR = 'prefetch_factor' in inspect.signature(DataLoader.__init__).parameters
+
+
+class ResumableSampler(Sampler):
+    """samples elements of a dataset in random order, like torch.utils.data.RandomSampler,
+    but the order is determined by a seed and the epoch,
+    so the same order can be re-created after an interruption, starting from any position in the epoch"""
+    def __init__(self, data_source, seed):
+        self.n_samples = len(data_source)
+        self.seed = seed
+        self.epoch = 1
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        """set epoch, and index of the first sample to yield from that epoch's order"""
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.n_samples, generator=generator)
+        return iter(order[self.start:].tolist())
+
+    def __len__(self):
+        return self.n_samples - self.start
+
+
+def get_rng_states():
+    """get states of all random number generators used during training"""
+    return {
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        'numpy': np.random.get_state(),
+        'random': random.getstate(),
+    }
+
+
+def set_rng_states(rng_states):
+    """set states of random number generators, inverse of ``get_rng_states``"""
+    torch.set_rng_state(rng_states['torch'])
+    if rng_states['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_states['cuda'])
+    np.random.set_state(rng_states['numpy'])
+    random.setstate(rng_states['random'])
+
+
+class ResumableMixin:
+    """mixin that makes searchnets trainers resumable.
+    Must come before the trainer class in the list of base classes."""
+    FINISHED_SUFFIX = '-finished.txt'
+    CHECKPOINTING_PLAN_SUFFIX = '_checkpointing_plan.csv'
+    VAL_ACC_BY_EPOCH_BY_SET_SIZE_SUFFIX = '_val_acc_by_epoch_by_set_size.txt'
+
+    def __init__(self, metrics_log=False, tensorboard_step=None, prefetch_memory_mb=None, uint8_dataset_type=None,
+                 prefetch_factor=None, peak_memory_mb=None, **kwargs):
+        """accepts the same keyword arguments as the trainer, plus:
+
+        metrics_log : bool
+            if True, log summaries with a buffered metrics_log.MetricsLogger instead of a SummaryWriter.
+            Default is False.
+        tensorboard_step : int
+            if not None, the MetricsLogger also writes summaries to TensorBoard every tensorboard_step steps.
+            Default is None.
+        prefetch_memory_mb : int
+            if not None, load the training set with a shard_prefetch.ShardPrefetchLoader
+            that uses at most this many megabytes for decoded shards. Default is None.
+        uint8_dataset_type : str
+            if not None, datasets return uint8 images, made with uint8_batches.get_uint8_transform,
+            and loaders are wrapped with uint8_batches.Uint8Batches for this dataset type. Default is None.
+        prefetch_factor : int
+            if not None, passed to the training set DataLoader, if it has workers
+            and prefetch_memory_mb is None. Default is None.
+        peak_memory_mb : float
+            if not None, checkpoint blocks of the model so the estimated peak memory of a training step
+            is within this many megabytes, see activation_checkpointing.py. Default is None.
+        """
+        super().__init__(**kwargs)
+        self.metrics_log = metrics_log
+        self.tensorboard_step = tensorboard_step
+        if self.train_writer is not None and self.metrics_log:
+            if self.tensorboard_step:
+                self.train_writer = self.get_metrics_logger(mirror=self.train_writer)
+            else:
+                self.train_writer.close()
+                self.train_writer = self.get_metrics_logger()
+
+        # replace loader that shuffles with RandomSampler, whose position we can't restore
+        self.sampler = ResumableSampler(self.trainset, seed=int(torch.randint(2 ** 31, (1,)).item()))
+        if prefetch_memory_mb is None:
+            num_workers = self.train_loader.num_workers
+            loader_kwargs = ({'prefetch_factor': prefetch_factor}
+                             if prefetch_factor and num_workers > 0 and LOADER_HAS_PREFETCH_FACTOR else {})
+            self.train_loader = DataLoader(self.trainset, batch_size=self.batch_size,
+                                           sampler=self.sampler, num_workers=num_workers,
+                                           pin_memory=True, **loader_kwargs)
+        else:
+            self.train_loader = ShardPrefetchLoader(self.trainset, batch_size=self.batch_size,
+                                                    sampler=self.sampler, num_workers=self.train_loader.num_workers,
+                                                    memory_budget_mb=prefetch_memory_mb, pin_memory=True)
+        self.uint8_dataset_type = uint8_dataset_type
+        if self.uint8_dataset_type is not None:
+            self.train_loader = Uint8Batches(self.train_loader, self.uint8_dataset_type, self.device)
+            if self.val_loader is not None:
+                self.val_loader = Uint8Batches(self.val_loader, self.uint8_dataset_type, self.device)
+        if peak_memory_mb is not None:
+            self.checkpoint_activations(peak_memory_mb)
+        self.n_batches = int(np.ceil(len(self.trainset) / self.batch_size))
+        self.epoch_start = 1
+        self.batch_start = 0
+        self.epoch_start_step = 0
+
+        if self.save_acc_by_set_size_by_epoch and self.valset is not None:
+            # track accuracy by set size with counts from validation, instead of a pass over the training set
+            self.val_stimuli, self.val_set_sizes, self.val_codes = set_size_counts.get_conditions(self.valset)
+            self.val_counts = None
+            self.val_counts_step = 0
+            self.val_counts_by_epoch = np.zeros(
+                (self.epochs, self.val_stimuli.shape[0], self.val_set_sizes.shape[0],
+                 set_size_counts.N_CLASSES, set_size_counts.N_CLASSES),
+                dtype=np.int32
+            )
+            self.val_counts_steps = np.zeros(self.epochs, dtype=np.int64)
+            self.val_counts_savepath = str(self.save_path) + set_size_counts.COUNTS_SUFFIX
+        else:
+            self.val_codes = None
+
+    def get_metrics_logger(self, mirror=None, purge_step=None):
+        return metrics_log.MetricsLogger(self.save_path.joinpath('train'), mirror=mirror,
+                                         mirror_step=self.tensorboard_step, purge_step=purge_step)
+
+    @property
+    def ckpt_path(self):
+        return self.save_path.parent.joinpath(self.save_path.name + self.DEFAULT_CKPT_SUFFIX)
+
+    @property
+    def finished_path(self):
+        return self.save_path.parent.joinpath(self.save_path.name + self.FINISHED_SUFFIX)
+
+    def checkpoint_activations(self, peak_memory_mb):
+        """checkpoint blocks of the model so a training step fits within peak_memory_mb,
+        and save the plan, with the memory and time of each block"""
+        model = self.model.module if isinstance(self.model, nn.DataParallel) else self.model
+        batch = next(iter(DataLoader(self.trainset, batch_size=self.batch_size)))['img']
+        if self.uint8_dataset_type is not None:
+            batch = to_float(batch, self.uint8_dataset_type)
+        # with DataParallel, each device only gets part of the batch, so this overestimates memory per device
+        df, estimates = activation_checkpointing.plan(model, self.net_name, batch.to(self.device),
+                                                      peak_memory_mb, self.optimizers)
+        print(activation_checkpointing.report(df, estimates))
+        df.to_csv(str(self.save_path) + self.CHECKPOINTING_PLAN_SUFFIX, index=False)
+
+    def save_checkpoint(self, epoch, ckpt_path=None):
+        """save checkpoint with the same keys as AbstractTrainer.save_checkpoint,
+        plus a 'resume' key with the state needed to resume training"""
+        print(f'Saving checkpoint in {self.save_path}')
+        batches_done = self.step - self.epoch_start_step
+        if batches_done >= self.n_batches:
+            resume_epoch, resume_batch = epoch + 1, 0
+        else:
+            resume_epoch, resume_batch = epoch, batches_done
+
+        ckpt = {
+            'epoch': epoch,
+            'step': self.step,
+            'model': self.model.state_dict(),
+        }
+        for ind, optimizer in enumerate(self.optimizers):
+            ckpt[f'optimizer_{ind}'] = optimizer.state_dict()
+        ckpt['resume'] = {
+            'epoch': resume_epoch,
+            'batch': resume_batch,
+            'sampler_seed': self.sampler.seed,
+            'rng_states': get_rng_states(),
+            'best_val_acc': getattr(self, 'best_val_acc', None),
+            'steps_without_improvement': getattr(self, 'steps_without_improvement', None),
+            'acc_by_epoch_by_set_size': getattr(self, 'acc_by_epoch_by_set_size', None),
+            'val_counts_by_epoch': getattr(self, 'val_counts_by_epoch', None),
+            'val_counts_steps': getattr(self, 'val_counts_steps', None),
+        }
+        if ckpt_path is None:
+            ckpt_path = self.ckpt_path
+        if self.train_writer is not None:
+            self.train_writer.flush()  # so summaries on disk are complete up to the checkpoint
+        # save to a temporary file then rename, so being killed while saving can't corrupt the last checkpoint
+        tmp_path = str(ckpt_path) + '.tmp'
+        torch.save(ckpt, tmp_path)
+        os.replace(tmp_path, ckpt_path)
+
+    def resume(self, ckpt_path=None):
+        """restore state from a checkpoint saved by ``save_checkpoint``"""
+        if ckpt_path is None:
+            ckpt_path = self.ckpt_path
+        print(f'Resuming training from checkpoint: {ckpt_path}')
+        checkpoint = torch.load(ckpt_path, map_location='cpu')
+        if 'resume' not in checkpoint:
+            raise ValueError(
+                f'checkpoint was not saved by a resumable trainer, cannot resume: {ckpt_path}\n'
+                'Remove it to train this replicate from the start.'
+            )
+        self.model.load_state_dict(checkpoint['model'])
+        for ind, optimizer in enumerate(self.optimizers):
+            optimizer.load_state_dict(checkpoint[f'optimizer_{ind}'])
+        self.step = checkpoint['step']
+
+        resume = checkpoint['resume']
+        self.epoch_start = resume['epoch']
+        self.batch_start = resume['batch']
+        self.sampler.seed = resume['sampler_seed']
+        # best validation accuracy decides when the best checkpoint is saved, even without early stopping
+        if resume['best_val_acc'] is not None:
+            self.best_val_acc = resume['best_val_acc']
+        if self.patience is not None:
+            self.steps_without_improvement = resume['steps_without_improvement']
+        if self.save_acc_by_set_size_by_epoch:
+            self.acc_by_epoch_by_set_size = resume['acc_by_epoch_by_set_size']
+        if self.val_codes is not None:
+            self.val_counts_by_epoch = resume['val_counts_by_epoch']
+            self.val_counts_steps = resume['val_counts_steps']
+        set_rng_states(resume['rng_states'])
+
+        if self.train_writer is not None:
+            # discard summaries written after the checkpoint, they will be written again
+            self.train_writer.close()
+            if self.metrics_log:
+                if self.tensorboard_step:
+                    mirror = SummaryWriter(log_dir=str(self.save_path.joinpath('train')), purge_step=self.step + 1)
+                else:
+                    mirror = None
+                self.train_writer = self.get_metrics_logger(mirror=mirror, purge_step=self.step + 1)
+            else:
+                self.train_writer = SummaryWriter(log_dir=str(self.save_path.joinpath('train')),
+                                                  purge_step=self.step + 1)
+
+    def record_val_counts(self, y_pred, step):
+        """count predictions from a validation for each stimulus, set size, and target condition"""
+        self.val_counts = set_size_counts.count(self.val_codes, y_pred,
+                                                self.val_stimuli.shape[0], self.val_set_sizes.shape[0])
+        self.val_counts_step = step
+
+    def validate(self):
+        """same as AbstractTrainer.validate, but also records counts from its predictions
+        if accuracy by set size is tracked"""
+        if self.val_codes is None:
+            return super().validate()
+        y_pred = []
+        handle = self.model.register_forward_hook(
+            lambda module, inputs, output: y_pred.append(output.detach().argmax(dim=1).cpu())
+        )
+        try:
+            val_metrics = super().validate()
+        finally:
+            handle.remove()
+        self.record_val_counts(torch.cat(y_pred).numpy(), self.step)
+        return val_metrics
+
+    def train_acc_by_set_size(self, epoch):
+        """record accuracy by set size for this epoch, from the counts of the latest validation.
+        Without a validation set, falls back to AbstractTrainer.train_acc_by_set_size,
+        a pass over the training set"""
+        if self.val_codes is None:
+            return super().train_acc_by_set_size(epoch)
+        if self.val_counts is None:
+            print('no validation yet, cannot compute accuracy by set size for this epoch')
+            return
+        self.val_counts_by_epoch[epoch - 1] = self.val_counts
+        self.val_counts_steps[epoch - 1] = self.val_counts_step
+        acc_by_set_size = set_size_counts.acc_by_set_size(self.val_counts)
+        print(''.join(
+            [f'set size {set_size}: {acc}. ' for set_size, acc in zip(self.val_set_sizes, acc_by_set_size)]
+        ))
+        for set_size, acc in zip(self.val_set_sizes, acc_by_set_size):
+            self.acc_by_epoch_by_set_size[epoch - 1, np.nonzero(self.set_sizes == set_size)[0]] = acc
+        set_size_counts.save(self.val_counts_savepath, self.val_counts_by_epoch, self.val_counts_steps,
+                             self.val_stimuli, self.val_set_sizes)
+
+    def start_epoch(self, epoch):
+        """set sampler to start epoch from position restored by ``resume``"""
+        self.sampler.set_epoch(epoch, start=self.batch_start * self.batch_size)
+        self.epoch_start_step = self.step - self.batch_start
+        self.batch_start = 0
+
+    def train_one_epoch(self, epoch):
+        self.start_epoch(epoch)
+        super().train_one_epoch(epoch)
+
+    def train(self):
+        """same as AbstractTrainer.train, but starts from epoch restored by ``resume``,
+        and marks training as finished when done"""
+        epoch = self.epoch_start - 1
+        for epoch in range(self.epoch_start, self.epochs + 1):
+            if self.patience is not None:
+                # in case training was interrupted after stopping early, but before saving
+                if self.steps_without_improvement > self.patience:
+                    break
+            print(f'\nEpoch {epoch}')
+            self.train_one_epoch(epoch=epoch)
+            if self.patience is not None:
+                if self.steps_without_improvement > self.patience:
+                    # need to break here, in addition to inside train_one_epoch method
+                    break
+            if self.save_acc_by_set_size_by_epoch:
+                split = 'training' if self.val_codes is None else 'validation'
+                print(f'Computing accuracy per visual search stimulus set size on {split} set')
+                self.train_acc_by_set_size(epoch)
+
+        self.save_checkpoint(epoch)
+        if self.save_acc_by_set_size_by_epoch:
+            if self.val_codes is None:
+                acc_epoch_set_size_savepath = self.acc_epoch_set_size_savepath
+            else:
+                # different file from accuracies on the training set, so the two are never mixed up
+                acc_epoch_set_size_savepath = str(self.save_path) + self.VAL_ACC_BY_EPOCH_BY_SET_SIZE_SUFFIX
+            np.savetxt(acc_epoch_set_size_savepath,
+                       self.acc_by_epoch_by_set_size,
+                       delimiter=',')
+        self.finished_path.write_text(f'epoch: {epoch}, step: {self.step}\n')
+
+
+class ResumableTrainer(ResumableMixin, Trainer):
+    pass
+
+
+class ResumableTransferTrainer(ResumableMixin, TransferTrainer):
+    pass
+
+
+class AsyncResumableTrainer(AsyncValidationMixin, ResumableTrainer):
+    pass
+
+
+class AsyncResumableTransferTrainer(AsyncValidationMixin, ResumableTransferTrainer):
+    pass
+
+
+def get_device():
+    if torch.cuda.is_available():
+        return torch.device('cuda')
+    else:
+        return torch.device('cpu')
+
+
+def get_trainer_kwargs(config, device, uint8_batches=False):
+    """get keyword arguments for trainer ``from_config`` methods that are the same for all replicates,
+    including datasets and loss function.
+    If uint8_batches is True, datasets return uint8 images, converted to float a batch at a time by the trainer"""
+    dataset_type = config.data.dataset_type
+    loss_func = config.train.loss_func
+    use_val = config.train.use_val
+
+    if config.train.mode != 'classify':
+        raise ValueError(
+            f"only 'classify' mode is supported, but mode was: {config.train.mode}"
+        )
+    if use_val is False and config.train.patience is not None:
+        raise ValueError('patience argument only works with a validation set')
+
+    if uint8_batches:
+        transform = get_uint8_transform(dataset_type, config.data.pad_size)
+    else:
+        transform, _ = get_transforms(dataset_type, loss_func, config.data.pad_size)
+    # pack paths, so memory used by loader workers doesn't grow with NUM_WORKERS
+    trainset = packed_datasets.pack(test_replicates.get_dataset(config, 'train', transform))
+    valset = packed_datasets.pack(test_replicates.get_dataset(config, 'val', transform)) if use_val else None
+
+    if loss_func in {'CE', 'CE-largest', 'CE-random'}:
+        criterion = nn.CrossEntropyLoss()
+    elif loss_func == 'BCE':
+        criterion = nn.BCEWithLogitsLoss()
+    else:
+        raise ValueError(
+            f'invalid value for loss function: {loss_func}'
+        )
+
+    return dict(trainset=trainset,
+                num_classes=config.data.num_classes,
+                criterion=criterion,
+                loss_func=loss_func,
+                embedding_n_out=config.train.embedding_n_out,
+                optimizer=config.train.optimizer,
+                mode=config.train.mode,
+                save_acc_by_set_size_by_epoch=config.train.save_acc_by_set_size_by_epoch,
+                batch_size=config.train.batch_size,
+                use_val=use_val,
+                valset=valset,
+                val_step=config.train.val_step,
+                patience=config.train.patience,
+                ckpt_step=config.train.ckpt_step,
+                summary_step=config.train.summary_step,
+                device=device,
+                num_workers=config.train.num_workers,
+                data_parallel=config.train.data_parallel,
+                uint8_dataset_type=dataset_type if uint8_batches else None)
+
+
+def get_finished_path(config, net_number, epochs):
+    """get path to file that marks a replicate as finished training"""
+    save_path = make_save_path(config.train.save_path, config.train.net_name, net_number, epochs)
+    return save_path.parent.joinpath(save_path.name + ResumableMixin.FINISHED_SUFFIX)
+
+
+def mark_legacy_finished(config, net_number, epochs, n_batches):
+    """if a replicate has a checkpoint saved by `searchnets train` when training ended, mark it as finished
+
+    Checkpoints saved by `searchnets train` can't be resumed. Its trainers save a checkpoint
+    every CKPT_STEP steps, and once more when training ends, after the last epoch or after stopping early.
+    So a checkpoint is from the end of training if it is from the last step of the last epoch,
+    from a step that isn't a multiple of CKPT_STEP, or from the step where training stopped early:
+    PATIENCE + 1 validations after the one with the best accuracy, when the best checkpoint was saved.
+
+    Parameters
+    ----------
+    config : searchnets.config.classes.Config
+        returned by searchnets.config.parse_config
+    net_number : int
+        number of replicate
+    epochs : int
+        number of epochs to train
+    n_batches : int
+        number of batches in an epoch
+
+    Returns
+    -------
+    finished : bool
+        True if replicate was marked as finished
+    """
+    save_path = make_save_path(config.train.save_path, config.train.net_name, net_number, epochs)
+    ckpt_path = save_path.parent.joinpath(save_path.name + ResumableTrainer.DEFAULT_CKPT_SUFFIX)
+    if not ckpt_path.exists():
+        return False
+    checkpoint = torch.load(str(ckpt_path), map_location='cpu')
+    if 'resume' in checkpoint:
+        return False
+    step, ckpt_step, patience = checkpoint['step'], config.train.ckpt_step, config.train.patience
+    stopped_early = False
+    if patience is not None:
+        best_ckpt_path = save_path.parent.joinpath(save_path.name + ResumableTrainer.BEST_VAL_ACC_CKPT_SUFFIX)
+        best_step = torch.load(str(best_ckpt_path), map_location='cpu')['step'] if best_ckpt_path.exists() else 0
+        stopped_early = step - best_step >= (patience + 1) * config.train.val_step
+    if not stopped_early and step < epochs * n_batches and ckpt_step and step % ckpt_step == 0:
+        raise ValueError(
+            f'checkpoint was saved by searchnets train before training finished, cannot resume: {ckpt_path}\n'
+            'Remove it to train this replicate from the start.'
+        )
+    get_finished_path(config, net_number, epochs).write_text(f'epoch: {checkpoint["epoch"]}, step: {step}\n')
+    return True
+
+
+def make_trainer(config, net_number, epochs, trainer_kwargs,
+                 trainer_class=ResumableTrainer,
+                 transfer_trainer_class=ResumableTransferTrainer):
+    """make trainer for one replicate, and resume from its checkpoint if there is one
+
+    Parameters
+    ----------
+    config : searchnets.config.classes.Config
+        returned by searchnets.config.parse_config
+    net_number : int
+        number of replicate
+    epochs : int
+        number of epochs to train
+    trainer_kwargs : dict
+        returned by ``get_trainer_kwargs``
+    trainer_class : class
+        used when METHOD is 'initialize'. Default is ResumableTrainer.
+    transfer_trainer_class : class
+        used when METHOD is 'transfer'. Default is ResumableTransferTrainer.
+
+    Returns
+    -------
+    trainer
+    """
+    if config.train.random_seed:
+        seed = config.train.random_seed + net_number
+        np.random.seed(seed)
+        random.seed(seed)
+        torch.manual_seed(seed)
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+
+    save_path = make_save_path(config.train.save_path, config.train.net_name, net_number, epochs)
+    trainer = trainer_from_config(config, save_path, epochs, trainer_kwargs, trainer_class, transfer_trainer_class)
+    if trainer.ckpt_path.exists():
+        trainer.resume()
+    return trainer
+
+
+def trainer_from_config(config, save_path, epochs, trainer_kwargs, trainer_class, transfer_trainer_class):
+    """make trainer with model and optimizers for METHOD specified in config,
+    e.g. with trained weights frozen when METHOD is 'transfer' and FREEZE_TRAINED_WEIGHTS is True"""
+    if config.train.method == 'transfer':
+        trainer = transfer_trainer_class.from_config(
+            net_name=config.train.net_name,
+            new_learn_rate_layers=config.train.new_learn_rate_layers,
+            freeze_trained_weights=config.train.freeze_trained_weights,
+            base_learning_rate=config.train.base_learning_rate,
+            new_layer_learning_rate=config.train.new_layer_learning_rate,
+            save_path=save_path,
+            epochs=epochs,
+            **trainer_kwargs)
+    elif config.train.method == 'initialize':
+        trainer = trainer_class.from_config(
+            net_name=config.train.net_name,
+            learning_rate=config.train.learning_rate,
+            save_path=save_path,
+            epochs=epochs,
+            **trainer_kwargs)
+    else:
+        raise ValueError(
+            f'invalid value for method: {config.train.method}'
+        )
+    return trainer
+
+
+def main(config_file,
+         replicates=None,
+         async_val=False,
+         exact_val=False,
+         val_threads=VAL_THREADS,
+         metrics_log=False,
+         tensorboard_step=None,
+         prefetch_memory_mb=None,
+         uint8_batches=False,
+         prefetch_factor=None,
+         num_threads=None,
+         peak_memory_mb=None,
+         ):
+    """train all replicates specified by a config.ini file,
+    resuming any that were interrupted and skipping any that finished
+
+    Parameters
+    ----------
+    config_file : str, Path
+        path to config.ini file used with searchnets
+    replicates : list
+        of int, numbers of replicates to train. Default is None, in which case
+        all replicates are trained, i.e. 1 to NUMBER_NETS_TO_TRAIN.
+    async_val : bool
+        if True, compute validation metrics in a separate process while training continues.
+        Default is False.
+    exact_val : bool
+        if True, wait for each validation result from the separate process before continuing,
+        so that early stopping happens at the same step as with synchronous validation.
+        Only used when async_val is True. Default is False.
+    val_threads : int
+        number of threads used by the validation process. Only used when async_val is True. Default is 1.
+    metrics_log : bool
+        if True, log summaries every SUMMARY_STEP steps to buffered .metrics files (see metrics_log.py)
+        instead of TensorBoard events files. Default is False.
+    tensorboard_step : int
+        if not None, also write summaries to TensorBoard every tensorboard_step steps.
+        Only used when metrics_log is True. Default is None.
+    prefetch_memory_mb : int
+        if not None, decode the training set a shard at a time in a background thread,
+        using at most this many megabytes (see shard_prefetch.py). Default is None.
+    uint8_batches : bool
+        if True, loader workers decode images to uint8, and batches are converted to float
+        and normalized on the training device (see uint8_batches.py). Default is False.
+    prefetch_factor : int
+        number of batches loaded ahead by each training set loader worker.
+        Default is None, in which case the DataLoader default is used.
+    num_threads : int
+        number of intra-op threads used by torch. Default is None, in which case the torch default is used.
+        Use tune_loader.py to choose prefetch_factor and num_threads, along with NUM_WORKERS and BATCH_SIZE.
+    peak_memory_mb : float
+        if not None, use activation checkpointing so the estimated peak memory of a training step
+        is within this many megabytes. Only for VGG16 and CORnet_S. Default is None.
+    """
+    if prefetch_factor is not None and not LOADER_HAS_PREFETCH_FACTOR:
+        raise ValueError(
+            f'prefetch_factor was specified but DataLoader does not accept it in this version of torch: '
+            f'{torch.__version__}'
+        )
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    config = parse_config(config_file)
+    trainer_kwargs = get_trainer_kwargs(config, get_device(), uint8_batches)
+    trainer_kwargs.update(metrics_log=metrics_log, tensorboard_step=tensorboard_step,
+                          prefetch_memory_mb=prefetch_memory_mb, prefetch_factor=prefetch_factor,
+                          peak_memory_mb=peak_memory_mb)
+
+    if replicates is None:
+        replicates = list(range(1, config.train.number_nets_to_train + 1))
+    n_batches = int(np.ceil(len(trainer_kwargs['trainset']) / config.train.batch_size))
+
+    for epochs in config.train.epochs_list:
+        print(f'training {config.train.net_name} model for {epochs} epochs')
+        for net_number in replicates:
+            finished_path = get_finished_path(config, net_number, epochs)
+            if finished_path.exists():
+                print(f'skipping replicate {net_number}, already finished training: {finished_path}')
+                continue
+            if mark_legacy_finished(config, net_number, epochs, n_batches):
+                print(f'skipping replicate {net_number}, already finished training with searchnets train: '
+                      f'{finished_path}')
+                continue
+
+            if async_val:
+                trainer = make_trainer(config, net_number, epochs, trainer_kwargs,
+                                       trainer_class=AsyncResumableTrainer,
+                                       transfer_trainer_class=AsyncResumableTransferTrainer)
+                trainer.exact_val = exact_val
+                trainer.val_threads = val_threads
+            else:
+                trainer = make_trainer(config, net_number, epochs, trainer_kwargs)
+            trainer.train()
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('config_file',
+                        help='path to config.ini file used with searchnets')
+    parser.add_argument('--replicates', nargs='+', type=int,
+                        help='numbers of replicates to train. Default is all replicates',
+                        default=None)
+    parser.add_argument('--async_val', action='store_true',
+                        help='if specified, compute validation metrics in a separate process')
+    parser.add_argument('--exact_val', action='store_true',
+                        help=('if specified with --async_val, wait for each validation result, '
+                              'so early stopping happens at the same step as with synchronous validation'))
+    parser.add_argument('--val_threads', type=int, default=VAL_THREADS,
+                        help='number of threads used by the validation process')
+    parser.add_argument('--metrics_log', action='store_true',
+                        help='if specified, log summaries to buffered .metrics files instead of TensorBoard')
+    parser.add_argument('--tensorboard_step', type=int, default=None,
+                        help='with --metrics_log, also write summaries to TensorBoard every this many steps')
+    parser.add_argument('--prefetch_memory_mb', type=int, default=None,
+                        help=('if specified, decode the training set ahead of training in a background thread, '
+                              'a shard at a time, using at most this many megabytes'))
+    parser.add_argument('--uint8_batches', action='store_true',
+                        help=('if specified, loader workers decode images to uint8, and batches are converted '
+                              'to float and normalized on the training device'))
+    parser.add_argument('--prefetch_factor', type=int, default=None,
+                        help='number of batches loaded ahead by each loader worker, see tune_loader.py')
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help='number of intra-op threads used by torch, see tune_loader.py')
+    parser.add_argument('--peak_memory_mb', type=float, default=None,
+                        help=('if specified, checkpoint activations of VGG16 or CORnet_S blocks '
+                              'to keep peak memory of a training step within this many megabytes'))
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(config_file=args.config_file,
+         replicates=args.replicates,
+         async_val=args.async_val,
+         exact_val=args.exact_val,
+         val_threads=args.val_threads,
+         metrics_log=args.metrics_log,
+         tensorboard_step=args.tensorboard_step,
+         prefetch_memory_mb=args.prefetch_memory_mb,
+         uint8_batches=args.uint8_batches,
+         prefetch_factor=args.prefetch_factor,
+         num_threads=args.num_threads,
+         peak_memory_mb=args.peak_memory_mb,
+         )
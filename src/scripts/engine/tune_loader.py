@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""measure how fast data can be loaded and how fast the model trains on this host, for a config,
+and pick the number of loader workers, prefetch factor, batch size, and intra-op threads
+that give the most training samples per second.
+
+Loading and training run at the same time (workers load the next batches while the model trains on one),
+so training throughput is estimated as the smaller of:
+- loader throughput, measured for each number of workers, prefetch factor, and batch size, and
+- model throughput, measured for each batch size and number of intra-op threads,
+  with a training step (forward, backward, and optimizer step) on a real batch,
+  using the model and optimizers built by the trainer, e.g. with trained weights frozen
+  when METHOD is 'transfer' and FREEZE_TRAINED_WEIGHTS is True.
+Combinations where workers plus intra-op threads would use more cores than this process can run on are skipped.
+Prefetch factor is only swept with versions of torch where DataLoader accepts it.
+
+Batch size is only swept when --batch_sizes is specified, because it changes optimization,
+not just speed: models trained with a different batch size may need a different learning rate.
+
+Measurements are appended to a .csv in the test results directory specified by the config,
+with the name of the host, so they can be compared later, e.g. across machines.
+With --write, NUM_WORKERS (and BATCH_SIZE, if swept) are written back into the config file;
+pass the recommended prefetch factor and threads to train_replicates.py with --prefetch_factor and --num_threads.
+"""
+from argparse import ArgumentParser
+import os
+from pathlib import Path
+import re
+import socket
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from searchnets.config import parse_config
+from searchnets.engine.trainer import Trainer
+from searchnets.engine.transfer_trainer import TransferTrainer
+
+from async_validation import TARGET_KEY
+import train_replicates
+from uint8_batches import to_float, Uint8Batches
+
+N_BATCHES = 50
+WARMUP_BATCHES = 5  # not timed, includes time for workers to start
+PREFETCH_FACTORS = [2, 4, 8]
+TIE_TOLERANCE = 0.05  # prefer fewer cores if throughput is within 5% of the best
+
+
+def get_n_cores():
+    """number of cores this process can run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def default_workers(n_cores):
+    """0, and powers of 2 up to the number of cores"""
+    workers = [0]
+    n_workers = 1
+    while n_workers < n_cores:
+        workers.append(n_workers)
+        n_workers *= 2
+    return workers + [n_cores]
+
+
+def default_threads(n_cores):
+    """powers of 2 up to the number of cores"""
+    threads = []
+    n_threads = 1
+    while n_threads < n_cores:
+        threads.append(n_threads)
+        n_threads *= 2
+    return threads + [n_cores]
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def loader_throughput(trainset, batch_size, num_workers, prefetch_factor, n_batches, device, uint8_dataset_type):
+    """samples per second loaded by a DataLoader, including copying batches to device"""
+    loader_kwargs = {'prefetch_factor': prefetch_factor} if num_workers > 0 and prefetch_factor is not None else {}
+    loader = DataLoader(trainset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                        pin_memory=device.type == 'cuda', drop_last=True, **loader_kwargs)
+    if uint8_dataset_type is not None:
+        loader = Uint8Batches(loader, uint8_dataset_type, device)
+    n_samples = 0
+    for ind, batch in enumerate(loader):
+        if ind == WARMUP_BATCHES:
+            sync(device)
+            tic = time.perf_counter()
+        elif ind > WARMUP_BATCHES:
+            n_samples += batch['img'].shape[0]
+        if uint8_dataset_type is None:
+            batch['img'].to(device, non_blocking=True)
+        if ind == WARMUP_BATCHES + n_batches:
+            break
+    sync(device)
+    if n_samples == 0:
+        raise ValueError(
+            f'training set has too few batches of size {batch_size} to measure loader throughput'
+        )
+    return n_samples / (time.perf_counter() - tic)
+
+
+def model_throughput(model, optimizers, criterion, batch, target_key, n_batches, device):
+    """samples per second of training steps on batch"""
+    model.train()
+    x, y = batch['img'].to(device), batch[target_key].to(device)
+    for ind in range(WARMUP_BATCHES + n_batches):
+        if ind == WARMUP_BATCHES:
+            sync(device)
+            tic = time.perf_counter()
+        for optimizer in optimizers:
+            optimizer.zero_grad()
+        loss = criterion(model(x), y)
+        loss.backward()
+        for optimizer in optimizers:
+            optimizer.step()
+    sync(device)
+    return x.shape[0] * n_batches / (time.perf_counter() - tic)
+
+
+def get_model_and_optimizers(config, trainer_kwargs):
+    """get model and optimizers the way the trainer builds them for config,
+    without a summary writer or checkpoints"""
+    trainer_kwargs = {key: val for key, val in trainer_kwargs.items() if key != 'uint8_dataset_type'}
+    trainer_kwargs.update(summary_step=None, save_acc_by_set_size_by_epoch=False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trainer = train_replicates.trainer_from_config(config, Path(tmp_dir).joinpath('tune_loader'), 1,
+                                                       trainer_kwargs, Trainer, TransferTrainer)
+    return trainer.model, trainer.optimizers
+
+
+def get_batch(trainset, batch_size, uint8_dataset_type):
+    """one batch of images and targets, converted to float like the trainer sees them"""
+    batch = next(iter(DataLoader(trainset, batch_size=batch_size, shuffle=True, drop_last=True)))
+    if uint8_dataset_type is not None:
+        batch['img'] = to_float(batch['img'], uint8_dataset_type)
+    return batch
+
+
+def recommend(df_loader, df_model, n_cores, device):
+    """combine measurements, and pick settings with the most samples per second that don't oversubscribe cores
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per combination of settings, with estimated samples per second, best first
+    """
+    df = df_loader.merge(df_model, on='batch_size', suffixes=('_loader', '_model'))
+    if device.type == 'cpu':
+        # loader workers each use one thread
+        df = df[df['num_workers'] + df['num_threads'] <= n_cores]
+    else:
+        df = df[df['num_workers'] + 1 <= n_cores]
+    df = df.assign(samples_per_sec=np.minimum(df['samples_per_sec_loader'], df['samples_per_sec_model']))
+    best = df['samples_per_sec'].max()
+    df = df.assign(n_cores_used=df['num_workers'] + df['num_threads'],
+                   near_best=df['samples_per_sec'] >= best * (1 - TIE_TOLERANCE))
+    return df.sort_values(['near_best', 'n_cores_used', 'samples_per_sec'],
+                          ascending=[False, True, False]).reset_index(drop=True)
+
+
+def write_config(config_file, num_workers, batch_size=None):
+    """write NUM_WORKERS and BATCH_SIZE into [TRAIN] section of config file, keeping the rest as it is"""
+    config_file = Path(config_file)
+    text = config_file.read_text()
+    match = re.search(r'^\[TRAIN\].*?(?=^\[|\Z)', text, flags=re.M | re.S)
+    if match is None:
+        raise ValueError(
+            f'no [TRAIN] section in config file: {config_file}'
+        )
+    section = match.group(0)
+    options = {'NUM_WORKERS': num_workers}
+    if batch_size is not None:
+        options['BATCH_SIZE'] = batch_size
+    for option, value in options.items():
+        if re.search(rf'^{option}\s*=', section, flags=re.M):
+            section = re.sub(rf'^{option}\s*=.*$', f'{option} = {value}', section, count=1, flags=re.M)
+        else:
+            section = section.rstrip('\n') + f'\n{option} = {value}\n\n'
+    config_file.write_text(text[:match.start()] + section + text[match.end():])
+
+
+def main(config_file,
+         workers=None,
+         prefetch_factors=PREFETCH_FACTORS,
+         batch_sizes=None,
+         threads=None,
+         n_batches=N_BATCHES,
+         uint8_batches=False,
+         write=False,
+         ):
+    """measure loader and model throughput for a config on this host, and recommend settings
+
+    Parameters
+    ----------
+    config_file : str, Path
+        path to config.ini file used with searchnets
+    workers : list
+        of int, numbers of loader workers to measure.
+        Default is None, in which case 0 and powers of 2 up to the number of cores are measured.
+    prefetch_factors : list
+        of int, prefetch factors to measure, for loaders with workers. Default is [2, 4, 8].
+        Ignored with versions of torch where DataLoader does not accept a prefetch factor.
+    batch_sizes : list
+        of int, batch sizes to measure. Default is None, in which case only BATCH_SIZE from the config is measured.
+    threads : list
+        of int, numbers of intra-op threads to measure for training steps.
+        Default is None, in which case powers of 2 up to the number of cores are measured
+        when training on the cpu, and only the current number of threads when training on a gpu.
+    n_batches : int
+        number of batches timed for each measurement. Default is 50.
+    uint8_batches : bool
+        if True, measure with loader workers that decode images to uint8, as with
+        train_replicates.py --uint8_batches. Default is False.
+    write : bool
+        if True, write recommended NUM_WORKERS, and BATCH_SIZE if batch_sizes was specified, into config file.
+        Default is False.
+    """
+    config = parse_config(config_file)
+    device = train_replicates.get_device()
+    n_cores = get_n_cores()
+    if workers is None:
+        workers = default_workers(n_cores)
+    if threads is None:
+        threads = default_threads(n_cores) if device.type == 'cpu' else [torch.get_num_threads()]
+    swept_batch_size = batch_sizes is not None
+    if batch_sizes is None:
+        batch_sizes = [config.train.batch_size]
+    if not train_replicates.LOADER_HAS_PREFETCH_FACTOR:
+        prefetch_factors = [None]
+
+    trainer_kwargs = train_replicates.get_trainer_kwargs(config, device, uint8_batches)
+    trainset, criterion = trainer_kwargs['trainset'], trainer_kwargs['criterion'].to(device)
+    uint8_dataset_type = trainer_kwargs['uint8_dataset_type']
+    target_key = TARGET_KEY[config.train.loss_func]
+
+    loader_rows = []
+    for batch_size in batch_sizes:
+        for num_workers in workers:
+            for prefetch_factor in (prefetch_factors if num_workers > 0 else [None]):
+                samples_per_sec = loader_throughput(trainset, batch_size, num_workers, prefetch_factor,
+                                                    n_batches, device, uint8_dataset_type)
+                print(f'loader: batch size {batch_size}, {num_workers} workers, '
+                      f'prefetch factor {prefetch_factor}: {samples_per_sec:.1f} samples/s')
+                loader_rows.append(dict(batch_size=batch_size, num_workers=num_workers,
+                                        prefetch_factor=prefetch_factor, samples_per_sec=samples_per_sec))
+    df_loader = pd.DataFrame.from_records(loader_rows)
+
+    n_threads_before = torch.get_num_threads()
+    model, optimizers = get_model_and_optimizers(config, trainer_kwargs)
+    model_rows = []
+    for batch_size in batch_sizes:
+        batch = get_batch(trainset, batch_size, uint8_dataset_type)
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            samples_per_sec = model_throughput(model, optimizers, criterion, batch, target_key, n_batches, device)
+            print(f'model: batch size {batch_size}, {num_threads} threads: {samples_per_sec:.1f} samples/s')
+            model_rows.append(dict(batch_size=batch_size, num_threads=num_threads, samples_per_sec=samples_per_sec))
+    torch.set_num_threads(n_threads_before)
+    df_model = pd.DataFrame.from_records(model_rows)
+
+    df = recommend(df_loader, df_model, n_cores, device)
+    if len(df) == 0:
+        raise ValueError(
+            f'all combinations of workers and threads measured use more than the {n_cores} cores available'
+        )
+    best = df.iloc[0]
+
+    test_results_save_path = config.test.test_results_save_path
+    if not os.path.isdir(test_results_save_path):
+        os.makedirs(test_results_save_path)
+    csv_fname = os.path.join(test_results_save_path, f'{Path(config_file).stem}_loader_tuning.csv')
+    df_save = df.drop(columns='near_best').assign(host=socket.gethostname(), device=str(device),
+                                                 n_cores=n_cores, uint8_batches=uint8_batches,
+                                                 time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    df_save.to_csv(csv_fname, mode='a', header=not os.path.exists(csv_fname), index=False)
+
+    prefetch = ('' if best['num_workers'] == 0 or pd.isnull(best['prefetch_factor'])
+                else f' --prefetch_factor {int(best["prefetch_factor"])}')
+    print(f'\nmeasurements saved in {csv_fname}\n'
+          f'recommended: BATCH_SIZE = {int(best["batch_size"])}, NUM_WORKERS = {int(best["num_workers"])}, '
+          f'with train_replicates.py{prefetch} --num_threads {int(best["num_threads"])}\n'
+          f'estimated {best["samples_per_sec"]:.1f} samples/s '
+          f'(loader {best["samples_per_sec_loader"]:.1f}, model {best["samples_per_sec_model"]:.1f}), '
+          f'with current config: {config.train.num_workers} workers, batch size {config.train.batch_size}')
+    if write:
+        write_config(config_file, int(best['num_workers']),
+                     int(best['batch_size']) if swept_batch_size else None)
+        print(f'wrote recommended settings to {config_file}')
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('config_file',
+                        help='path to config.ini file used with searchnets')
+    parser.add_argument('--workers', nargs='+', type=int, default=None,
+                        help='numbers of loader workers to measure. Default is 0 and powers of 2 up to number of cores')
+    parser.add_argument('--prefetch_factors', nargs='+', type=int, default=PREFETCH_FACTORS,
+                        help='prefetch factors to measure, for loaders with workers')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=None,
+                        help='batch sizes to measure. Default is only BATCH_SIZE from config')
+    parser.add_argument('--threads', nargs='+', type=int, default=None,
+                        help='numbers of intra-op threads to measure for training steps')
+    parser.add_argument('--n_batches', type=int, default=N_BATCHES,
+                        help='number of batches timed for each measurement')
+    parser.add_argument('--uint8_batches', action='store_true',
+                        help='if specified, measure with loader workers that decode images to uint8')
+    parser.add_argument('--write', action='store_true',
+                        help='if specified, write recommended settings into config file')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(config_file=args.config_file,
+         workers=args.workers,
+         prefetch_factors=args.prefetch_factors,
+         batch_sizes=args.batch_sizes,
+         threads=args.threads,
+         n_batches=args.n_batches,
+         uint8_batches=args.uint8_batches,
+         write=args.write,
+         )
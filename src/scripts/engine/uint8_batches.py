@@ -0,0 +1,94 @@
+"""load batches of uint8 images, and convert them to normalized float once per batch.
+
+The transforms returned by ``searchnets.transforms.util.get_transforms`` convert each image to float
+and normalize it in the DataLoader worker that decodes it,
+so workers send batches of float32 images back to the main process, four times the size of the decoded images.
+With ``get_uint8_transform``, workers only decode images into uint8 tensors,
+which are sent to the main process through shared memory as usual for DataLoader workers.
+``Uint8Batches`` wraps the loader, moves each batch to the device where the model is,
+and converts it with ``to_float``, one vectorized operation per batch instead of one per image.
+"""
+import numpy as np
+import torch
+import torchvision.transforms as vis_transforms
+
+from searchnets.transforms import transforms
+from searchnets.transforms.util import MEAN, STD
+
+
+class ToUint8Tensor:
+    """convert image to a torch.uint8 tensor with shape (channels, height, width).
+    Like torchvision.transforms.ToTensor, but without converting to float and scaling to [0, 1],
+    so that decoded images take up a quarter of the memory."""
+    def __call__(self, img):
+        img = np.array(img, dtype=np.uint8)
+        if img.ndim == 2:
+            img = img[:, :, np.newaxis]
+        return torch.from_numpy(img).permute(2, 0, 1).contiguous()
+
+
+def get_uint8_transform(dataset_type, pad_size):
+    """get transform that decodes images to uint8 tensors.
+    Scaling and normalization are applied later to batches, by ``to_float``"""
+    if dataset_type == 'searchstims':
+        return ToUint8Tensor()
+    elif dataset_type == 'VSD':
+        # random_pad returns a float tensor, values are still integers in [0, 255]
+        return vis_transforms.Compose([ToUint8Tensor(),
+                                       transforms.RandomPad(pad_size=pad_size),
+                                       torch.Tensor.byte])
+    else:
+        raise ValueError(
+            f'invalid dataset_type: {dataset_type}'
+        )
+
+
+# scaling to [0, 1] and normalizing, (img / 255 - MEAN) / STD, folded into img * SCALE + SHIFT
+SCALE = 1 / (255 * torch.tensor(STD)).view(-1, 1, 1)
+SHIFT = (-torch.tensor(MEAN) / torch.tensor(STD)).view(-1, 1, 1)
+
+
+def to_float(img_batch, dataset_type):
+    """convert a batch of uint8 images to float,
+    giving the same values as the transforms returned by searchnets.transforms.util.get_transforms"""
+    img_batch = img_batch.float()
+    if dataset_type == 'searchstims':
+        return img_batch.mul_(SCALE.to(img_batch.device)).add_(SHIFT.to(img_batch.device))
+    return img_batch.div_(255)
+
+
+class Uint8Batches:
+    """wraps a loader of batches with uint8 images,
+    moving each batch of images to device and converting it with ``to_float``
+
+    Parameters
+    ----------
+    loader : torch.utils.data.DataLoader
+        loads dataset with transform returned by ``get_uint8_transform``
+    dataset_type : str
+        one of {'searchstims', 'VSD'}
+    device : str, torch.device
+        where images are converted. Should be the device where the model is,
+        so images are also copied to it as uint8.
+    """
+    def __init__(self, loader, dataset_type, device):
+        self.loader = loader
+        self.dataset_type = dataset_type
+        self.device = torch.device(device)
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def num_workers(self):
+        return self.loader.num_workers
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for batch in self.loader:
+            batch = dict(batch)
+            batch['img'] = to_float(batch['img'].to(self.device, non_blocking=True), self.dataset_type)
+            yield batch
@@ -1,15 +1,145 @@
 #!/usr/bin/env python
 # coding: utf-8
-"""script that generates source data csvs for searchstims experiment figures"""
+"""script that generates source data csvs for searchstims experiment figures
+
+With ``--incremental``, the script keeps partial results for each run, i.e. each results.gz file,
+in source_data_root/partials:
+- {net_name}-{method}-{mode}.rows.csv, the rows of all.csv from the run
+- {net_name}-{method}-{mode}.sums.csv, the sum and count of accuracies
+  for each net name, method, mode, stimulus, and set size
+- index.json, with the size and modification time of the results.gz and split .csv files each run was made from
+Only runs whose results.gz or split .csv changed since the partials were saved are loaded again,
+e.g. after testing a new replicate. Mean accuracies are then computed from the sums and counts of all runs,
+the tables derived from them are saved, and all.csv is re-assembled by concatenating the rows of all runs.
+"""
 from argparse import ArgumentParser
 from collections import defaultdict
+import json
+import os
 from pathlib import Path
+import shutil
+import sys
 
 import pandas as pd
 import pyprojroot
 
 import searchnets
 
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+
+PARTIALS_DIRNAME = 'partials'
+PARTIALS_INDEX_JSON = 'index.json'
+# columns that partial sums and counts of accuracies are grouped by
+PARTIAL_GROUP_COLS = ['net_name', 'method', 'mode', 'stimulus', 'set_size']
+
+
+def run_signature(results_gz_path, csv_path, learning_rate):
+    """identifies the files a run was made from, by path, size, and modification time.
+    If the signature of a run changes, its partials are made again"""
+    signature = {}
+    for key, path in (('results_gz', results_gz_path), ('split_csv', csv_path)):
+        stat = Path(path).stat()
+        signature[key] = [str(path), stat.st_size, stat.st_mtime_ns]
+    signature['learning_rate'] = str(learning_rate)
+    return signature
+
+
+def save_partials(df, partials_root, run_name):
+    """save rows of all.csv and partial sums and counts of accuracies from one run"""
+    sums = df.groupby(PARTIAL_GROUP_COLS)['accuracy'].agg(['sum', 'count']).reset_index()
+    for suffix, to_save in (('rows', df), ('sums', sums)):
+        path = partials_root.joinpath(f'{run_name}.{suffix}.csv')
+        tmp_path = partials_root.joinpath(f'{run_name}.{suffix}.tmp.csv')
+        to_save.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def save_partials_index(index, partials_root):
+    tmp_path = partials_root.joinpath(PARTIALS_INDEX_JSON + '.tmp')
+    tmp_path.write_text(json.dumps(index, indent=1))
+    os.replace(tmp_path, partials_root.joinpath(PARTIALS_INDEX_JSON))
+
+
+def transfer_acc_mn_from_partials(partials_root, run_names):
+    """mean accuracy for each net name, stimulus, and set size of nets trained with transfer learning,
+    computed from partial sums and counts. Same as grouping all rows of all.csv and taking the mean"""
+    sums = pd.concat([pd.read_csv(partials_root.joinpath(f'{run_name}.sums.csv')) for run_name in run_names])
+    sums = sums[sums['method'] == 'transfer']
+    sums = sums.groupby(['net_name', 'stimulus', 'set_size'])[['sum', 'count']].sum()
+    df_transfer_acc_mn = (sums['sum'] / sums['count']).rename('accuracy').to_frame()
+    return df_transfer_acc_mn.reset_index()
+
+
+def concat_rows(partials_root, run_names, csv_path):
+    """write rows of all runs to one .csv, by copying lines of the partials, with the header only once"""
+    tmp_path = csv_path.parent.joinpath(csv_path.stem + '.tmp.csv')
+    with tmp_path.open('w') as csv_fp:
+        for run_num, run_name in enumerate(run_names):
+            with partials_root.joinpath(f'{run_name}.rows.csv').open() as rows_fp:
+                header = rows_fp.readline()
+                if run_num == 0:
+                    csv_fp.write(header)
+                shutil.copyfileobj(rows_fp, csv_fp)
+    os.replace(tmp_path, csv_path)
+
+
+def acc_diff_tables(df_transfer_acc_mn):
+    """make tables with difference of mean accuracies on set size 1 and set size 8, from mean accuracies
+
+    Returns
+    -------
+    df_acc_diff : pandas.DataFrame
+        with difference for each net name and stimulus
+    stim_acc_diff_df : pandas.DataFrame
+        with mean difference for each stimulus, sorted
+    net_acc_diff_df : pandas.DataFrame
+        with mean difference for each net name, sorted
+    df_acc_diff_by_stim : pandas.DataFrame
+        pivoted so that rows are net names and columns are stimuli, both sorted
+    """
+    records = defaultdict(list)
+
+    for net_name in df_transfer_acc_mn['net_name'].unique():
+        df_net = df_transfer_acc_mn[df_transfer_acc_mn['net_name'] == net_name]
+        for stim in df_net['stimulus'].unique():
+            df_stim = df_net[df_net['stimulus'] == stim]
+            set_size_1_acc = df_stim[df_stim['set_size'] == 1]['accuracy'].values.item()
+            set_size_8_acc = df_stim[df_stim['set_size'] == 8]['accuracy'].values.item()
+            acc_diff = set_size_1_acc - set_size_8_acc
+            records['net_name'].append(net_name)
+            records['stimulus'].append(stim)
+            records['set_size_1_acc'].append(set_size_1_acc)
+            records['set_size_8_acc'].append(set_size_8_acc)
+            records['acc_diff'].append(acc_diff)
+
+    df_acc_diff = pd.DataFrame.from_records(records)
+    df_acc_diff = df_acc_diff[['net_name', 'stimulus', 'set_size_1_acc', 'set_size_8_acc', 'acc_diff']]
+
+    # columns will be stimuli, in increasing order of accuracy drop across models
+    stim_acc_diff_df = df_acc_diff.groupby(['stimulus']).agg({'acc_diff': 'mean', 'set_size_1_acc': 'mean'})
+    stim_acc_diff_df = stim_acc_diff_df.reset_index()
+    stim_acc_diff_df = stim_acc_diff_df.sort_values(by=['set_size_1_acc', 'acc_diff'], ascending=False)
+
+    # rows will be nets, in decreasing order of accuracy drops across stimuli
+    net_acc_diff_df = df_acc_diff.groupby(['net_name']).agg({'acc_diff': 'mean'})
+    net_acc_diff_df = net_acc_diff_df.reset_index()
+    net_acc_diff_df = net_acc_diff_df.sort_values(by='acc_diff', ascending=False)
+
+    # no idea how much I am abusing the Pandas API, just trying to make a pivot table into a data frame here
+    # https://stackoverflow.com/a/42708606/4906855
+    # want the columns to be (sorted) stimulus type,
+    # and rows be (sorted) network names,
+    # with values in cells being effect size
+    df_acc_diff_only = df_acc_diff[['net_name', 'stimulus', 'acc_diff']]
+    df_acc_diff_by_stim = df_acc_diff_only.pivot_table(index='net_name', columns='stimulus')
+    df_acc_diff_by_stim.columns = df_acc_diff_by_stim.columns.get_level_values(1)
+    df_acc_diff_by_stim = pd.DataFrame(df_acc_diff_by_stim.to_records())
+    df_acc_diff_by_stim = df_acc_diff_by_stim.set_index('net_name')
+    df_acc_diff_by_stim = df_acc_diff_by_stim.reindex(net_acc_diff_df['net_name'].values.tolist())
+    df_acc_diff_by_stim = df_acc_diff_by_stim[stim_acc_diff_df['stimulus'].values.tolist()]
+    return df_acc_diff, stim_acc_diff_df, net_acc_diff_df, df_acc_diff_by_stim
+
 
 def main(results_gz_root,
          source_data_root,
@@ -24,6 +154,7 @@ def main(results_gz_root,
          alexnet_split_csv_path,
          VGG16_split_csv_path,
          learning_rate=1e-3,
+         incremental=False,
          ):
     """generate .csv files used as source data for figures corresponding to experiments
     carried out with stimuli generated by searchstims library
@@ -67,6 +198,10 @@ def main(results_gz_root,
         path to .csv that contains dataset splits for "VGG16-sized" searchstim images
     learning_rate
         float, learning rate value for all experiments. Default is 1e-3.
+    incremental : bool
+        if True, only load results.gz files that changed since the last time the script was run
+        with incremental=True, and compute tables from partial results saved for each results.gz file,
+        in source_data_root/partials. Default is False.
     """
     results_gz_root = Path(results_gz_root)
 
@@ -77,6 +212,12 @@ def main(results_gz_root,
         )
 
     df_list = []
+    if incremental:
+        partials_root = source_data_root.joinpath(PARTIALS_DIRNAME)
+        partials_root.mkdir(exist_ok=True)
+        index_path = partials_root.joinpath(PARTIALS_INDEX_JSON)
+        index = json.loads(index_path.read_text()) if index_path.exists() else {}
+        run_names = []
 
     for net_name in net_names:
         for method in methods:
@@ -85,16 +226,18 @@ def main(results_gz_root,
                     f'invalid method: {method}, must be one of: {METHODS}'
                 )
             for mode in modes:
-                results_gz_path = sorted(results_gz_root.glob(f'**/*{net_name}*{method}*gz'))
-
-                if mode == 'classify':                
-                    results_gz_path = [results_gz for results_gz in results_gz_path if 'detect' not in str(results_gz)]
-                elif mode == 'detect':
-                    results_gz_path = [results_gz for results_gz in results_gz_path if 'detect' in str(results_gz)]
-                else:
-                    raise ValueError(
-                        f'invalid mode: {mode}, must be one of: {MODES}'
-                    )
+                with instrumentation.stage('discovery') as discovery:
+                    results_gz_path = sorted(results_gz_root.glob(f'**/*{net_name}*{method}*gz'))
+
+                    if mode == 'classify':
+                        results_gz_path = [results_gz for results_gz in results_gz_path if 'detect' not in str(results_gz)]
+                    elif mode == 'detect':
+                        results_gz_path = [results_gz for results_gz in results_gz_path if 'detect' in str(results_gz)]
+                    else:
+                        raise ValueError(
+                            f'invalid mode: {mode}, must be one of: {MODES}'
+                        )
+                    discovery.rows_out = len(results_gz_path)
 
                 if len(results_gz_path) != 1:
                     raise ValueError(f'found more than one results.gz file: {results_gz_path}')
@@ -107,75 +250,69 @@ def main(results_gz_root,
                 else:
                     raise ValueError(f'no csv path defined for net_name: {net_name}')
 
-                df = searchnets.analysis.searchstims.results_gz_to_df(results_gz_path, 
-                                                                      csv_path, 
-                                                                      net_name,
-                                                                      method,
-                                                                      mode,
-                                                                      learning_rate)
-                df_list.append(df)
-
-    df_all = pd.concat(df_list)
-
-    # Get just the transfer learning results,
-    # then group by network, stimulus, and set size,
-    # and compute the mean accuracy for each set size.
-    df_transfer = df_all[df_all['method'] == 'transfer']
-    df_transfer_acc_mn = df_transfer.groupby(['net_name', 'stimulus', 'set_size']).agg({'accuracy':'mean'})
-    df_transfer_acc_mn = df_transfer_acc_mn.reset_index()
+                if incremental:
+                    run_name = f'{net_name}-{method}-{mode}'
+                    run_names.append(run_name)
+                    signature = run_signature(results_gz_path, csv_path, learning_rate)
+                    if index.get(run_name) == signature and all(
+                            partials_root.joinpath(f'{run_name}.{suffix}.csv').exists() for suffix in ('rows', 'sums')
+                    ):
+                        continue
+                    print(f'updating partial results for: {run_name}')
+
+                with instrumentation.stage('load') as load:
+                    df = searchnets.analysis.searchstims.results_gz_to_df(load.read(results_gz_path),
+                                                                          load.read(csv_path),
+                                                                          net_name,
+                                                                          method,
+                                                                          mode,
+                                                                          learning_rate)
+                    load.rows_out = len(df)
+                if incremental:
+                    with instrumentation.stage('write', rows_in=len(df)):
+                        save_partials(df, partials_root, run_name)
+                        index[run_name] = signature
+                        save_partials_index(index, partials_root)
+                else:
+                    df_list.append(df)
+
+    if incremental:
+        with instrumentation.stage('groupby', rows_in=len(run_names)) as groupby:
+            df_transfer_acc_mn = transfer_acc_mn_from_partials(partials_root, run_names)
+            groupby.rows_out = len(df_transfer_acc_mn)
+    else:
+        with instrumentation.stage('concat', rows_in=sum(len(df) for df in df_list)) as concat:
+            df_all = pd.concat(df_list)
+            concat.rows_out = len(df_all)
+
+        # Get just the transfer learning results,
+        # then group by network, stimulus, and set size,
+        # and compute the mean accuracy for each set size.
+        with instrumentation.stage('groupby', rows_in=len(df_all)) as groupby:
+            df_transfer = df_all[df_all['method'] == 'transfer']
+            df_transfer_acc_mn = df_transfer.groupby(['net_name', 'stimulus', 'set_size']).agg({'accuracy':'mean'})
+            df_transfer_acc_mn = df_transfer_acc_mn.reset_index()
+            groupby.rows_out = len(df_transfer_acc_mn)
 
     # Make one more `DataFrame`
     # where variable is difference of mean accuracies on set size 1 and set size 8.
     # We use this to organize the figure,
     # and to show a heatmap with a marginal distribution.
-    records = defaultdict(list)
-
-    for net_name in df_transfer_acc_mn['net_name'].unique():
-        df_net = df_transfer_acc_mn[df_transfer_acc_mn['net_name'] == net_name]
-        for stim in df_net['stimulus'].unique():
-            df_stim = df_net[df_net['stimulus'] == stim]
-            set_size_1_acc = df_stim[df_stim['set_size'] == 1]['accuracy'].values.item()
-            set_size_8_acc = df_stim[df_stim['set_size'] == 8]['accuracy'].values.item()
-            acc_diff = set_size_1_acc - set_size_8_acc
-            records['net_name'].append(net_name)
-            records['stimulus'].append(stim)
-            records['set_size_1_acc'].append(set_size_1_acc)
-            records['set_size_8_acc'].append(set_size_8_acc)
-            records['acc_diff'].append(acc_diff)
-
-    df_acc_diff = pd.DataFrame.from_records(records)
-    df_acc_diff = df_acc_diff[['net_name', 'stimulus', 'set_size_1_acc', 'set_size_8_acc', 'acc_diff']]
-
-    # columns will be stimuli, in increasing order of accuracy drop across models
-    stim_acc_diff_df = df_acc_diff.groupby(['stimulus']).agg({'acc_diff': 'mean', 'set_size_1_acc': 'mean'})
-    stim_acc_diff_df = stim_acc_diff_df.reset_index()
-    stim_acc_diff_df = stim_acc_diff_df.sort_values(by=['set_size_1_acc', 'acc_diff'], ascending=False)
-
-    # rows will be nets, in decreasing order of accuracy drops across stimuli
-    net_acc_diff_df = df_acc_diff.groupby(['net_name']).agg({'acc_diff': 'mean'})
-    net_acc_diff_df = net_acc_diff_df.reset_index()
-    net_acc_diff_df = net_acc_diff_df.sort_values(by='acc_diff', ascending=False)
-
-    # no idea how much I am abusing the Pandas API, just trying to make a pivot table into a data frame here
-    # https://stackoverflow.com/a/42708606/4906855
-    # want the columns to be (sorted) stimulus type,
-    # and rows be (sorted) network names,
-    # with values in cells being effect size
-    df_acc_diff_only = df_acc_diff[['net_name', 'stimulus', 'acc_diff']]
-    df_acc_diff_by_stim = df_acc_diff_only.pivot_table(index='net_name', columns='stimulus')
-    df_acc_diff_by_stim.columns = df_acc_diff_by_stim.columns.get_level_values(1)
-    df_acc_diff_by_stim = pd.DataFrame(df_acc_diff_by_stim.to_records())
-    df_acc_diff_by_stim = df_acc_diff_by_stim.set_index('net_name')
-    df_acc_diff_by_stim = df_acc_diff_by_stim.reindex(net_acc_diff_df['net_name'].values.tolist())
-    df_acc_diff_by_stim = df_acc_diff_by_stim[stim_acc_diff_df['stimulus'].values.tolist()]
+    with instrumentation.stage('stats', rows_in=len(df_transfer_acc_mn)) as stats:
+        df_acc_diff, stim_acc_diff_df, net_acc_diff_df, df_acc_diff_by_stim = acc_diff_tables(df_transfer_acc_mn)
+        stats.rows_out = len(df_acc_diff)
 
     # finally, save csvs
-    df_all.to_csv(source_data_root.joinpath(all_csv_filename), index=False)
-    df_acc_diff.to_csv(source_data_root.joinpath(acc_diff_csv_filename), index=False)
-    stim_acc_diff_df.to_csv(source_data_root.joinpath(stim_acc_diff_csv_filename), index=False)
-    net_acc_diff_df.to_csv(source_data_root.joinpath(net_acc_diff_csv_filename), index=False)
-    # for this csv, the index is "net names" -- we want to keep it
-    df_acc_diff_by_stim.to_csv(source_data_root.joinpath(acc_diff_by_stim_csv_filename))
+    with instrumentation.stage('write', rows_in=len(df_acc_diff)):
+        if incremental:
+            concat_rows(partials_root, run_names, source_data_root.joinpath(all_csv_filename))
+        else:
+            df_all.to_csv(source_data_root.joinpath(all_csv_filename), index=False)
+        df_acc_diff.to_csv(source_data_root.joinpath(acc_diff_csv_filename), index=False)
+        stim_acc_diff_df.to_csv(source_data_root.joinpath(stim_acc_diff_csv_filename), index=False)
+        net_acc_diff_df.to_csv(source_data_root.joinpath(net_acc_diff_csv_filename), index=False)
+        # for this csv, the index is "net names" -- we want to keep it
+        df_acc_diff_by_stim.to_csv(source_data_root.joinpath(acc_diff_by_stim_csv_filename))
 
 
 ROOT = pyprojroot.here()
@@ -256,23 +393,29 @@ def get_parser():
                         help='path to .csv that contains dataset splits for "alexnet-sized" searchstim images')
     parser.add_argument('--VGG16_split_csv_path', default=VGG16_split_csv_path,
                         help='path to .csv that contains dataset splits for "VGG16-sized" searchstim images')
+    parser.add_argument('--incremental', action='store_true',
+                        help=('only load results.gz files that changed since the script was last run '
+                              'with --incremental, using partial results saved in source_data_root/partials'))
+    instrumentation.add_arguments(parser)
     return parser
 
 
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
-    main(results_gz_root=args.results_gz_root,
-         source_data_root=args.source_data_root,
-         all_csv_filename=args.all_csv_filename,
-         acc_diff_csv_filename=args.acc_diff_csv_filename,
-         stim_acc_diff_csv_filename=args.stim_acc_diff_csv_filename,
-         net_acc_diff_csv_filename=args.net_acc_diff_csv_filename,
-         acc_diff_by_stim_csv_filename=args.acc_diff_by_stim_csv_filename,
-         net_names=args.net_names,
-         methods=args.methods,
-         modes=args.modes,
-         alexnet_split_csv_path=args.alexnet_split_csv_path,
-         VGG16_split_csv_path=args.VGG16_split_csv_path,
-         learning_rate=args.learning_rate,
-         )
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(results_gz_root=args.results_gz_root,
+             source_data_root=args.source_data_root,
+             all_csv_filename=args.all_csv_filename,
+             acc_diff_csv_filename=args.acc_diff_csv_filename,
+             stim_acc_diff_csv_filename=args.stim_acc_diff_csv_filename,
+             net_acc_diff_csv_filename=args.net_acc_diff_csv_filename,
+             acc_diff_by_stim_csv_filename=args.acc_diff_by_stim_csv_filename,
+             net_names=args.net_names,
+             methods=args.methods,
+             modes=args.modes,
+             alexnet_split_csv_path=args.alexnet_split_csv_path,
+             VGG16_split_csv_path=args.VGG16_split_csv_path,
+             learning_rate=args.learning_rate,
+             incremental=args.incremental,
+             )
@@ -2,11 +2,15 @@
 # coding: utf-8
 from argparse import ArgumentParser
 from pathlib import Path
+import sys
 
 import numpy as np
 import pyprojroot
 import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+
 
 def _t1_summary(series, n_decimals=3):
     """adapted from tableone package
@@ -75,44 +79,53 @@ def main(test_results_root,
     test_results_root = Path(test_results_root)
     source_data_root = Path(source_data_root)
 
-    test_csv_paths = sorted(test_results_root.glob('**/*test_results.csv'))
+    with instrumentation.stage('discovery') as discovery:
+        test_csv_paths = sorted(test_results_root.glob('**/*test_results.csv'))
+        discovery.rows_out = len(test_csv_paths)
 
     dfs = []
-    for test_csv_path in test_csv_paths:
-        df = pd.read_csv(test_csv_path)
-        df['mode'] = 'classify'
-        dfs.append(df)
+    with instrumentation.stage('load') as load:
+        for test_csv_path in test_csv_paths:
+            df = pd.read_csv(load.read(test_csv_path))
+            df['mode'] = 'classify'
+            dfs.append(df)
+        load.rows_out = sum(len(df) for df in dfs)
 
-    all_test_results_df = pd.concat(dfs)
+    with instrumentation.stage('concat', rows_in=sum(len(df) for df in dfs)) as concat:
+        all_test_results_df = pd.concat(dfs)
+        concat.rows_out = len(all_test_results_df)
 
     # realize after writing the script I need mean and std in separate columns
     # so I can more easily plot mean test accuracy v. r values from correlation.
     # Create those here first.
-    agg = {'acc': ['mean', 'std']}
-    columns = [
-        'acc-mean',
-        'acc-std',
-    ]
-    sort_values=['method_category', ('acc', 'mean')]
-    df_test_table = test_results_table(all_test_results_df,
-                                       agg=agg,
-                                       sort_values=sort_values,
-                                       columns=columns)
-
-    df_test_table_mean_sd_single_col = test_results_table(all_test_results_df)
+    with instrumentation.stage('groupby', rows_in=len(all_test_results_df)) as groupby:
+        agg = {'acc': ['mean', 'std']}
+        columns = [
+            'acc-mean',
+            'acc-std',
+        ]
+        sort_values=['method_category', ('acc', 'mean')]
+        df_test_table = test_results_table(all_test_results_df,
+                                           agg=agg,
+                                           sort_values=sort_values,
+                                           columns=columns)
+
+        df_test_table_mean_sd_single_col = test_results_table(all_test_results_df)
+        groupby.rows_out = len(df_test_table)
 
     # finally, save csvs
-    all_test_results_df.to_csv(source_data_root.joinpath(all_test_results_csv_filename), index=False)
+    with instrumentation.stage('write', rows_in=len(all_test_results_df)):
+        all_test_results_df.to_csv(source_data_root.joinpath(all_test_results_csv_filename), index=False)
 
-    df_test_table.to_csv(source_data_root.joinpath('test_results_table.csv'))
-    df_test_table_mean_sd_single_col.to_csv(source_data_root.joinpath(
-        'test_results_table_mean_sd_single_col.csv'
-    ))
+        df_test_table.to_csv(source_data_root.joinpath('test_results_table.csv'))
+        df_test_table_mean_sd_single_col.to_csv(source_data_root.joinpath(
+            'test_results_table_mean_sd_single_col.csv'
+        ))
 
-    # also save table as Excel file, to import into Word
-    df_test_table_mean_sd_single_col.to_excel(source_data_root.joinpath(
-        'test_results_table_mean_sd_single_col.xlsx'
-    ))
+        # also save table as Excel file, to import into Word
+        df_test_table_mean_sd_single_col.to_excel(source_data_root.joinpath(
+            'test_results_table_mean_sd_single_col.xlsx'
+        ))
 
 
 ROOT = pyprojroot.here()
@@ -137,13 +150,15 @@ def get_parser():
                         help=('filename for .csv that should be saved '
                               'that contains results from **all** test_results.csv files. '
                               'Saved in source_data_root.'))
+    instrumentation.add_arguments(parser)
     return parser
 
 
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
-    main(test_results_root=args.test_results_root,
-         source_data_root=args.source_data_root,
-         all_test_results_csv_filename=args.all_test_results_csv_filename,
-         )
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(test_results_root=args.test_results_root,
+             source_data_root=args.source_data_root,
+             all_test_results_csv_filename=args.all_test_results_csv_filename,
+             )
@@ -3,6 +3,7 @@
 from argparse import ArgumentParser
 from collections import defaultdict
 from pathlib import Path
+import sys
 
 import numpy as np
 import pandas as pd
@@ -11,6 +12,9 @@ import pyprojroot
 from sklearn.preprocessing import KBinsDiscretizer
 from statsmodels.formula.api import ols
 
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+
 
 def main(test_results_root,
          source_data_root,
@@ -44,7 +48,9 @@ def main(test_results_root,
     source_data_root = Path(source_data_root)
 
     # ## get all the `assay_images` csvs from each model / net / mode / method, concatenate
-    assay_images_csvs = sorted(test_results_root.glob('**/*assay_images.csv'))
+    with instrumentation.stage('discovery') as discovery:
+        assay_images_csvs = sorted(test_results_root.glob('**/*assay_images.csv'))
+        discovery.rows_out = len(assay_images_csvs)
 
     # before loading all csvs:
     # * load one and discretize visual search difficulty scores
@@ -55,24 +61,30 @@ def main(test_results_root,
     #         and the width of the bins
     #     + we choose bins so that each has same # of samples,
     #       instead of having equal width bins
-    first_csv_df = pd.read_csv(assay_images_csvs[0])
+    with instrumentation.stage('discretize') as discretize:
+        first_csv_df = pd.read_csv(discretize.read(assay_images_csvs[0]))
 
-    discretizer = KBinsDiscretizer(n_bins=n_bins, encode='ordinal', strategy=strategy)
-    vsd_score_bin = discretizer.fit_transform(first_csv_df['vsd_score'].values.reshape(-1, 1))
-    vsd_score_bin = pd.Series(vsd_score_bin.ravel()).astype('category')
+        discretizer = KBinsDiscretizer(n_bins=n_bins, encode='ordinal', strategy=strategy)
+        vsd_score_bin = discretizer.fit_transform(first_csv_df['vsd_score'].values.reshape(-1, 1))
+        vsd_score_bin = pd.Series(vsd_score_bin.ravel()).astype('category')
+        discretize.rows_out = len(vsd_score_bin)
 
     # now we load all `assay_images` csvs
     # and add `vsd_score_bin` column that we just made to each one
-    df_list = []
-
-    for assay_images_csv in assay_images_csvs:
-        df = pd.read_csv(assay_images_csv)
-        df['vsd_score_bin'] = vsd_score_bin
-        df_list.append(df)
-
-    assay_images_df = pd.concat(
-        df_list
-    )
+    with instrumentation.stage('load') as load:
+        df_list = []
+
+        for assay_images_csv in assay_images_csvs:
+            df = pd.read_csv(load.read(assay_images_csv))
+            df['vsd_score_bin'] = vsd_score_bin
+            df_list.append(df)
+        load.rows_out = sum(len(df) for df in df_list)
+
+    with instrumentation.stage('concat', rows_in=sum(len(df) for df in df_list)) as concat:
+        assay_images_df = pd.concat(
+            df_list
+        )
+        concat.rows_out = len(assay_images_df)
 
     # declare column order, just for tidyness
     COLUMNS = [
@@ -108,34 +120,36 @@ def main(test_results_root,
     # #### first for just cases where there is only 1 item in image
     # - filter by loss function: we only want single-label classification, so remove 'BCE'
     # - also filter by number of objects / items, we only want images with one object present
-    single_label_df = assay_images_df[assay_images_df.loss_func.isin(['CE-largest', 'CE-random'])]
-    single_label_df = single_label_df[single_label_df['n_items'] == 1]
+    with instrumentation.stage('groupby', rows_in=len(assay_images_df)) as groupby:
+        single_label_df = assay_images_df[assay_images_df.loss_func.isin(['CE-largest', 'CE-random'])]
+        single_label_df = single_label_df[single_label_df['n_items'] == 1]
 
-    # - then split into groups that correspond to experimental levels + variables of interest
-    single_label_gb = single_label_df.groupby(GROUP_LABELS)
-    single_label_groups = single_label_gb.groups
+        # - then split into groups that correspond to experimental levels + variables of interest
+        single_label_gb = single_label_df.groupby(GROUP_LABELS)
+        single_label_groups = single_label_gb.groups
 
-    # * finally create new dataframe where each experimental level has a corresponding accuracy measure
-    def acc(df):
-        assert np.all(df['TP'].isin([0, 1])), "not all true positive values were zero or one"
-        return df['TP'].sum() / len(df)
+        # * finally create new dataframe where each experimental level has a corresponding accuracy measure
+        def acc(df):
+            assert np.all(df['TP'].isin([0, 1])), "not all true positive values were zero or one"
+            return df['TP'].sum() / len(df)
 
-    single_label_records = defaultdict(list)
+        single_label_records = defaultdict(list)
 
-    for a_group in sorted(single_label_groups.keys()):
-        a_group_df = single_label_gb.get_group(a_group)
+        for a_group in sorted(single_label_groups.keys()):
+            a_group_df = single_label_gb.get_group(a_group)
 
-        for grp_label, grp_val in zip(GROUP_LABELS, a_group):
-            single_label_records[grp_label].append(grp_val)
+            for grp_label, grp_val in zip(GROUP_LABELS, a_group):
+                single_label_records[grp_label].append(grp_val)
 
-        # treat each image as a 'trial'
-        single_label_records['n_trials'].append(len(a_group_df))
+            # treat each image as a 'trial'
+            single_label_records['n_trials'].append(len(a_group_df))
 
-        single_label_records['acc'].append(
-            acc(a_group_df)
-        )
+            single_label_records['acc'].append(
+                acc(a_group_df)
+            )
 
-    single_label_acc_df = pd.DataFrame.from_records(single_label_records)
+        single_label_acc_df = pd.DataFrame.from_records(single_label_records)
+        groupby.rows_out = len(single_label_acc_df)
 
     # ### declare COLUMNS for accuracy `DataFrame`s -- will use the same columns for multi-label accuracy
     ACC_COLUMNS = [
@@ -154,31 +168,33 @@ def main(test_results_root,
     # #### now measure accuracy for images with any number of objects,
     # using networks trained for multi-label classification
     # - filter by loss function: we want multi-label classification, so keep only 'BCE'
-    multi_label_df = assay_images_df[assay_images_df.loss_func.isin(['BCE'])]
-    multi_label_gb = multi_label_df.groupby(GROUP_LABELS)
-    multi_label_groups = multi_label_gb.groups
+    with instrumentation.stage('groupby', rows_in=len(assay_images_df)) as groupby:
+        multi_label_df = assay_images_df[assay_images_df.loss_func.isin(['BCE'])]
+        multi_label_gb = multi_label_df.groupby(GROUP_LABELS)
+        multi_label_groups = multi_label_gb.groups
 
-    def multi_label_acc(df):
-        acc_series = df['TP'] / (df['TP'] + df['FN'])
-        return acc_series.mean()
+        def multi_label_acc(df):
+            acc_series = df['TP'] / (df['TP'] + df['FN'])
+            return acc_series.mean()
 
-    multi_label_records = defaultdict(list)
+        multi_label_records = defaultdict(list)
 
-    for a_group in sorted(multi_label_groups.keys()):
-        a_group_df = multi_label_gb.get_group(a_group)
+        for a_group in sorted(multi_label_groups.keys()):
+            a_group_df = multi_label_gb.get_group(a_group)
 
-        for grp_label, grp_val in zip(GROUP_LABELS, a_group):
-            multi_label_records[grp_label].append(grp_val)
+            for grp_label, grp_val in zip(GROUP_LABELS, a_group):
+                multi_label_records[grp_label].append(grp_val)
 
-        # treat each image as a 'trial'
-        multi_label_records['n_trials'].append(len(a_group_df))
+            # treat each image as a 'trial'
+            multi_label_records['n_trials'].append(len(a_group_df))
 
-        multi_label_records['acc'].append(
-            multi_label_acc(a_group_df)
-        )
+            multi_label_records['acc'].append(
+                multi_label_acc(a_group_df)
+            )
 
-    multi_label_acc_df = pd.DataFrame.from_records(multi_label_records)
-    multi_label_acc_df = multi_label_acc_df[ACC_COLUMNS]
+        multi_label_acc_df = pd.DataFrame.from_records(multi_label_records)
+        multi_label_acc_df = multi_label_acc_df[ACC_COLUMNS]
+        groupby.rows_out = len(multi_label_acc_df)
 
     # #### concatenate single-label and multi-label accuracy dataframe
     # * 'loss_func' column ('CE-random' and 'BCE') is a proxy for 'single-label' and 'multi-label'
@@ -205,52 +221,55 @@ def main(test_results_root,
         # Fitted values
         return model.fittedvalues
 
-    rm_corr_records = defaultdict(list)
-    acc_df['pred'] = 0.  # dummy value we replace in loop below
-
-    for mode in ['classify']:
-        for method in ['transfer', 'initialize']:
-            for row, loss_func in enumerate(['CE-random', 'CE-largest', 'BCE']):
-                for col, net_name in enumerate(acc_df['net_name'].unique()):
-                    sub_df = acc_df[
-                        (acc_df['mode'] == mode) &
-                        (acc_df['method'] == method) &
-                        (acc_df['loss_func'] == loss_func) &
-                        (acc_df['net_name'] == net_name)
-                    ]
-                    if len(sub_df) == 0:
-                        continue
-
-                    rm_corr_df = pg.rm_corr(data=sub_df, x='vsd_score_bin', y='acc', subject='replicate')
-                    for k, v in rm_corr_df.to_dict(orient='records')[0].items():  # records will be one-item list
-                        rm_corr_records[k].append(v)
-                    for k, v in zip(('mode', 'method', 'loss_func', 'net_name'), (mode, method, loss_func, net_name)):
-                        rm_corr_records[k].append(v)
-
-                    pred = rm_corr_for_plot(data=sub_df, x='vsd_score_bin', y='acc', subject='replicate')
-                    # add predicted values from regression to dataframe, to use for plotting later
-                    acc_df.loc[
-                        ((acc_df['mode'] == mode) &
-                         (acc_df['method'] == method) &
-                         (acc_df['loss_func'] == loss_func) &
-                         (acc_df['net_name'] == net_name)),
-                        'pred'] = pred
+    with instrumentation.stage('stats', rows_in=len(acc_df)) as stats:
+        rm_corr_records = defaultdict(list)
+        acc_df['pred'] = 0.  # dummy value we replace in loop below
+
+        for mode in ['classify']:
+            for method in ['transfer', 'initialize']:
+                for row, loss_func in enumerate(['CE-random', 'CE-largest', 'BCE']):
+                    for col, net_name in enumerate(acc_df['net_name'].unique()):
+                        sub_df = acc_df[
+                            (acc_df['mode'] == mode) &
+                            (acc_df['method'] == method) &
+                            (acc_df['loss_func'] == loss_func) &
+                            (acc_df['net_name'] == net_name)
+                        ]
+                        if len(sub_df) == 0:
+                            continue
+
+                        rm_corr_df = pg.rm_corr(data=sub_df, x='vsd_score_bin', y='acc', subject='replicate')
+                        for k, v in rm_corr_df.to_dict(orient='records')[0].items():  # records will be one-item list
+                            rm_corr_records[k].append(v)
+                        for k, v in zip(('mode', 'method', 'loss_func', 'net_name'), (mode, method, loss_func, net_name)):
+                            rm_corr_records[k].append(v)
+
+                        pred = rm_corr_for_plot(data=sub_df, x='vsd_score_bin', y='acc', subject='replicate')
+                        # add predicted values from regression to dataframe, to use for plotting later
+                        acc_df.loc[
+                            ((acc_df['mode'] == mode) &
+                             (acc_df['method'] == method) &
+                             (acc_df['loss_func'] == loss_func) &
+                             (acc_df['net_name'] == net_name)),
+                            'pred'] = pred
+        stats.rows_out = len(rm_corr_records['r'])
 
     # #### save dataframe of repeated measures correlation results
     rm_corr_df = pd.DataFrame.from_records(rm_corr_records)
 
     # save results in a directory inside source data root named "number of bins + binning strategy"
-    out_dir = source_data_root.joinpath(
-        f'{n_bins}-bins-{strategy}-strategy'
-    )
-    out_dir.mkdir(exist_ok=True, parents=False)
-    # finally, save csvs + bin edges
-    acc_df.to_csv(out_dir.joinpath(accuracy_csv_filename), index=False)
-    rm_corr_df.to_csv(out_dir.joinpath(rm_corr_csv_filename), index=False)
-    np.savetxt(
-        fname=out_dir.joinpath('bin_edges.np.txt'),
-        X=discretizer.bin_edges_[0]
-    )
+    with instrumentation.stage('write', rows_in=len(acc_df)):
+        out_dir = source_data_root.joinpath(
+            f'{n_bins}-bins-{strategy}-strategy'
+        )
+        out_dir.mkdir(exist_ok=True, parents=False)
+        # finally, save csvs + bin edges
+        acc_df.to_csv(out_dir.joinpath(accuracy_csv_filename), index=False)
+        rm_corr_df.to_csv(out_dir.joinpath(rm_corr_csv_filename), index=False)
+        np.savetxt(
+            fname=out_dir.joinpath('bin_edges.np.txt'),
+            X=discretizer.bin_edges_[0]
+        )
 
 
 # constants
@@ -292,16 +311,18 @@ def get_parser():
                         help=('''filename for .csv saved that contains 
                               repeated measures correlation results.
                               Saved in source_data_root'''))
+    instrumentation.add_arguments(parser)
     return parser
 
 
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
-    main(test_results_root=args.test_results_root,
-         source_data_root=args.source_data_root,
-         n_bins=args.n_bins,
-         strategy=args.strategy,
-         accuracy_csv_filename=args.accuracy_csv_filename,
-         rm_corr_csv_filename=args.rm_corr_csv_filename
-         )
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(test_results_root=args.test_results_root,
+             source_data_root=args.source_data_root,
+             n_bins=args.n_bins,
+             strategy=args.strategy,
+             accuracy_csv_filename=args.accuracy_csv_filename,
+             rm_corr_csv_filename=args.rm_corr_csv_filename
+             )
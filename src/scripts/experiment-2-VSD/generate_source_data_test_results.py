@@ -2,11 +2,15 @@
 # coding: utf-8
 from argparse import ArgumentParser
 from pathlib import Path
+import sys
 
 import numpy as np
 import pyprojroot
 import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+
 
 def _t1_summary(series, n_decimals=3):
     """adapted from tableone package
@@ -82,77 +86,88 @@ def main(test_results_root,
         Saved in source_data_root.
     """
     test_results_root = Path(test_results_root)
-    test_csv_paths = sorted(test_results_root.glob('**/*test_results.csv'))
+    source_data_root = Path(source_data_root)
+
+    with instrumentation.stage('discovery') as discovery:
+        test_csv_paths = sorted(test_results_root.glob('**/*test_results.csv'))
+        discovery.rows_out = len(test_csv_paths)
 
     dfs = []
-    for test_csv_path in test_csv_paths:
-        df = pd.read_csv(test_csv_path)
-        df['mode'] = 'classify'
-        dfs.append(df)
+    with instrumentation.stage('load') as load:
+        for test_csv_path in test_csv_paths:
+            df = pd.read_csv(load.read(test_csv_path))
+            df['mode'] = 'classify'
+            dfs.append(df)
+        load.rows_out = sum(len(df) for df in dfs)
 
-    all_test_results_df = pd.concat(dfs)
+    with instrumentation.stage('concat', rows_in=sum(len(df) for df in dfs)) as concat:
+        all_test_results_df = pd.concat(dfs)
+        concat.rows_out = len(all_test_results_df)
 
     # "melt" so that metrics are rows instead of columns, makes plotting more convenient
     # this adds a 'metric_name' column where name is one of {'acc_largest', 'acc_random', 'f1'}
     # and then a column 'metric_val' with the value computed corresponding to 'metric_name'
-    value_vars = ['acc_largest', 'acc_random', 'f1']
-    id_vars = [id_var 
-               for id_var in all_test_results_df.columns.tolist() 
-               if id_var not in value_vars]
-    var_name = 'metric_name'
-    value_name = 'metric_val'
-    long_test_results_df = pd.melt(all_test_results_df,
-                                   id_vars=id_vars,
-                                   value_vars=value_vars,
-                                   var_name=var_name,
-                                   value_name=value_name)
-
-    # realize after writing the script I need mean and std in separate columns
-    # so I can more easily plot mean test accuracy v. r values from correlation.
-    # Create those here first.
-    agg = {k: ['mean', 'std'] for k in ['acc_largest', 'acc_random', 'f1']}
-    columns = [
-        'acc-largest-mean',
-        'acc-largest-std',
-        'acc-random-mean',
-        'acc-random-std',
-        'f1-mean',
-        'f1-std',
-    ]
-    sort_values=['loss_func_category', ('acc_largest', 'mean')]
-    df_test_table_transfer = test_results_table(all_test_results_df,
-                                                method='transfer',
-                                                agg=agg,
-                                                sort_values=sort_values,
-                                                columns=columns)
-    df_test_table_initialize = test_results_table(all_test_results_df,
-                                                  method='initialize',
-                                                  agg=agg,
-                                                  sort_values=sort_values,
-                                                  columns=columns)
-
-    df_test_table_transfer_mean_sd_single_col = test_results_table(all_test_results_df, method='transfer')
-    df_test_table_initialize_mean_sd_single_col = test_results_table(all_test_results_df, method='initialize')
+    with instrumentation.stage('groupby', rows_in=len(all_test_results_df)) as groupby:
+        value_vars = ['acc_largest', 'acc_random', 'f1']
+        id_vars = [id_var 
+                   for id_var in all_test_results_df.columns.tolist() 
+                   if id_var not in value_vars]
+        var_name = 'metric_name'
+        value_name = 'metric_val'
+        long_test_results_df = pd.melt(all_test_results_df,
+                                       id_vars=id_vars,
+                                       value_vars=value_vars,
+                                       var_name=var_name,
+                                       value_name=value_name)
+
+        # realize after writing the script I need mean and std in separate columns
+        # so I can more easily plot mean test accuracy v. r values from correlation.
+        # Create those here first.
+        agg = {k: ['mean', 'std'] for k in ['acc_largest', 'acc_random', 'f1']}
+        columns = [
+            'acc-largest-mean',
+            'acc-largest-std',
+            'acc-random-mean',
+            'acc-random-std',
+            'f1-mean',
+            'f1-std',
+        ]
+        sort_values=['loss_func_category', ('acc_largest', 'mean')]
+        df_test_table_transfer = test_results_table(all_test_results_df,
+                                                    method='transfer',
+                                                    agg=agg,
+                                                    sort_values=sort_values,
+                                                    columns=columns)
+        df_test_table_initialize = test_results_table(all_test_results_df,
+                                                      method='initialize',
+                                                      agg=agg,
+                                                      sort_values=sort_values,
+                                                      columns=columns)
+
+        df_test_table_transfer_mean_sd_single_col = test_results_table(all_test_results_df, method='transfer')
+        df_test_table_initialize_mean_sd_single_col = test_results_table(all_test_results_df, method='initialize')
+        groupby.rows_out = len(df_test_table_transfer) + len(df_test_table_initialize)
 
     # finally, save csvs
-    all_test_results_df.to_csv(source_data_root.joinpath(all_test_results_csv_filename), index=False)
-    long_test_results_df.to_csv(source_data_root.joinpath(long_test_results_csv_filename), index=False)
-
-    df_test_table_transfer.to_csv(source_data_root.joinpath('test_results_table_transfer.csv'))
-    df_test_table_initialize.to_csv(source_data_root.joinpath('test_results_table_initialize.csv'))
-    df_test_table_transfer_mean_sd_single_col.to_csv(source_data_root.joinpath(
-        'test_results_table_transfer_mean_sd_single_col.csv'
-    ))
-    df_test_table_initialize_mean_sd_single_col.to_csv(source_data_root.joinpath(
-        'test_results_table_initialize_mean_sd_single_col.csv'
-    ))
-    # also save tables as Excel files, to import into Word
-    df_test_table_transfer_mean_sd_single_col.to_excel(source_data_root.joinpath(
-        'test_results_table_transfer_mean_sd_single_col.xlsx'
-    ))
-    df_test_table_initialize_mean_sd_single_col.to_excel(source_data_root.joinpath(
-        'test_results_table_initialize_mean_sd_single_col.xlsx'
-    ))
+    with instrumentation.stage('write', rows_in=len(all_test_results_df)):
+        all_test_results_df.to_csv(source_data_root.joinpath(all_test_results_csv_filename), index=False)
+        long_test_results_df.to_csv(source_data_root.joinpath(long_test_results_csv_filename), index=False)
+
+        df_test_table_transfer.to_csv(source_data_root.joinpath('test_results_table_transfer.csv'))
+        df_test_table_initialize.to_csv(source_data_root.joinpath('test_results_table_initialize.csv'))
+        df_test_table_transfer_mean_sd_single_col.to_csv(source_data_root.joinpath(
+            'test_results_table_transfer_mean_sd_single_col.csv'
+        ))
+        df_test_table_initialize_mean_sd_single_col.to_csv(source_data_root.joinpath(
+            'test_results_table_initialize_mean_sd_single_col.csv'
+        ))
+        # also save tables as Excel files, to import into Word
+        df_test_table_transfer_mean_sd_single_col.to_excel(source_data_root.joinpath(
+            'test_results_table_transfer_mean_sd_single_col.xlsx'
+        ))
+        df_test_table_initialize_mean_sd_single_col.to_excel(source_data_root.joinpath(
+            'test_results_table_initialize_mean_sd_single_col.xlsx'
+        ))
 
 
 ROOT = pyprojroot.here()
@@ -183,14 +198,16 @@ def get_parser():
                               to that column ({'acc_largest', 'acc_random', 'f1'}). 
                               This "long form" is used for plotting.
                               Saved in source_data_root'''))
+    instrumentation.add_arguments(parser)
     return parser
 
 
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
-    main(test_results_root=args.test_results_root,
-         source_data_root=args.source_data_root,
-         all_test_results_csv_filename=args.all_test_results_csv_filename,
-         long_test_results_csv_filename=args.long_test_results_csv_filename
-         )
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(test_results_root=args.test_results_root,
+             source_data_root=args.source_data_root,
+             all_test_results_csv_filename=args.all_test_results_csv_filename,
+             long_test_results_csv_filename=args.long_test_results_csv_filename
+             )
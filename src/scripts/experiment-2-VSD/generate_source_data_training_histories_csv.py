@@ -3,12 +3,18 @@
 """script that generates source data csvs for searchstims training history figures"""
 from argparse import ArgumentParser
 from pathlib import Path
+import sys
+from urllib.parse import unquote
 
+import numpy as np
 import pandas as pd
 import pyprojroot
 
 from searchnets.tensorboard import logdir2df
 
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+
 
 def get_net_number_from_dirname(dirname):
     return dirname.split('_')[-1]
@@ -52,6 +58,36 @@ def logdir2csv(logdir):
     df.to_csv(logdir.joinpath(csv_filename))
 
 
+# .metrics files are saved by train_replicates.py with --metrics_log, see engine/metrics_log.py
+METRICS_SUFFIX = '.metrics'
+METRICS_RECORD_DTYPE = np.dtype([('step', '<i8'), ('wall_time', '<f8'), ('value', '<f8')])
+
+
+def metrics_log2df(logdir):
+    """load .metrics files in a logs directory into a pandas DataFrame,
+    with the same columns as ``searchnets.tensorboard.logdir2df``
+
+    Parameters
+    ----------
+    logdir : str, Path
+        path to directory containing .metrics files saved by a MetricsLogger
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        indexed by 'step', with one column per scalar tag
+    """
+    dfs = []
+    for path in sorted(Path(logdir).glob(f'*{METRICS_SUFFIX}')):
+        data = path.read_bytes()
+        n_records = len(data) // METRICS_RECORD_DTYPE.itemsize  # ignore partially-written record
+        records = np.frombuffer(data[:n_records * METRICS_RECORD_DTYPE.itemsize], dtype=METRICS_RECORD_DTYPE)
+        tag = unquote(path.name[:-len(METRICS_SUFFIX)])
+        df = pd.DataFrame({tag: records['value']}, index=pd.Index(records['step'], name='step'))
+        dfs.append(df[~df.index.duplicated(keep='last')])
+    return pd.concat(dfs, axis=1).sort_index()
+
+
 def main(ckpt_root,
          source_data_root,
          csv_filename,
@@ -89,7 +125,9 @@ def main(ckpt_root,
     # directories in checkpoint root will be named (basically) {net}_{method}_{learning_rate}_{dataset}
     # 'mode' is implied by whether or not 'detect' appears in directory name
     # we need to get training history for each {net}_{method} & mode
-    net_ckpt_roots = [path for path in sorted(ckpt_root.iterdir()) if path.is_dir()]
+    with instrumentation.stage('discovery') as discovery:
+        net_ckpt_roots = [path for path in sorted(ckpt_root.iterdir()) if path.is_dir()]
+        discovery.rows_out = len(net_ckpt_roots)
 
     # loop that saves a separate .csv for each net / method / mode / loss func
     for net_name in net_names:
@@ -142,7 +180,9 @@ def main(ckpt_root,
 
                     # the '**' in the glob in the next line will usually be 'trained_200_epochs'
                     # even though early stopping was used and nets weren't always trained 200 epochs
-                    net_roots = sorted(this_ckpt_root.glob('**/net_number*'))
+                    with instrumentation.stage('discovery') as discovery:
+                        net_roots = sorted(this_ckpt_root.glob('**/net_number*'))
+                        discovery.rows_out = len(net_roots)
                     df_all_net_numbers = []
                     for net_root in net_roots:  # here 'net' refers to the training replicate
                         print(
@@ -152,35 +192,45 @@ def main(ckpt_root,
                             get_net_number_from_dirname(net_root.name)
                         )
 
-                        # convert to .csv -- do this every time even though it takes longer
-                        # to make sure we have converted **all** events files, and that we
-                        # 're-generate' the .csv files from the 'ground truth' events files
-                        events_file = sorted(net_root.glob('**/*events*'))
-                        events_file = [path for path in events_file if not str(path).endswith('.csv')]
-                        assert len(events_file) == 1, 'found more than one events file'
-                        events_file = events_file[0]
-                        logdir = events_file.parent
-                        logdir2csv(logdir)
-
-                        # now load the .csv file we just created
-                        events_csv = sorted(net_root.glob('**/*events*csv'))
-                        assert len(events_csv) == 1, 'found more than one events file'
-                        events_csv = events_csv[0]
-                        df = pd.read_csv(events_csv)
+                        with instrumentation.stage('load') as load:
+                            metrics_files = sorted(net_root.glob(f'**/*{METRICS_SUFFIX}'))
+                            if metrics_files:
+                                # training logged with metrics logger, no need to convert events file
+                                df = metrics_log2df(load.read(metrics_files[0].parent)).reset_index()
+                            else:
+                                # convert to .csv -- do this every time even though it takes longer
+                                # to make sure we have converted **all** events files, and that we
+                                # 're-generate' the .csv files from the 'ground truth' events files
+                                events_file = sorted(net_root.glob('**/*events*'))
+                                events_file = [path for path in events_file if not str(path).endswith('.csv')]
+                                assert len(events_file) == 1, 'found more than one events file'
+                                events_file = load.read(events_file[0])
+                                logdir = events_file.parent
+                                logdir2csv(logdir)
+
+                                # now load the .csv file we just created
+                                events_csv = sorted(net_root.glob('**/*events*csv'))
+                                assert len(events_csv) == 1, 'found more than one events file'
+                                events_csv = events_csv[0]
+                                df = pd.read_csv(events_csv)
+                            load.rows_out = len(df)
                         df['replicate'] = net_number
                         df['net_name'] = net_name
                         df['method'] = method
                         df['mode'] = mode
                         df['loss_func'] = loss_func
                         df_all_net_numbers.append(df)
-                    df_all_net_numbers = pd.concat(df_all_net_numbers)
+                    with instrumentation.stage('concat', rows_in=sum(len(df) for df in df_all_net_numbers)) as concat:
+                        df_all_net_numbers = pd.concat(df_all_net_numbers)
+                        concat.rows_out = len(df_all_net_numbers)
 
                     # save a separate .csv for each net / method / mode / loss func
-                    stem, ext = Path(csv_filename).stem, Path(csv_filename).suffix
-                    this_csv_filename = f'{stem}-{net_name}-{mode}-{method}-{loss_func}{ext}'
-                    df_all_net_numbers.to_csv(
-                        source_data_root.joinpath(this_csv_filename), index=False
-                    )
+                    with instrumentation.stage('write', rows_in=len(df_all_net_numbers)):
+                        stem, ext = Path(csv_filename).stem, Path(csv_filename).suffix
+                        this_csv_filename = f'{stem}-{net_name}-{mode}-{method}-{loss_func}{ext}'
+                        df_all_net_numbers.to_csv(
+                            source_data_root.joinpath(this_csv_filename), index=False
+                        )
 
 
 ROOT = pyprojroot.here()
@@ -237,17 +287,19 @@ def get_parser():
                               'must be in {"BCE", "CE-largest", "CE-random"}'),
                         type=lambda loss_funcs: loss_funcs.split(','))
 
+    instrumentation.add_arguments(parser)
     return parser
 
 
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
-    main(ckpt_root=args.ckpt_root,
-         source_data_root=args.source_data_root,
-         csv_filename=args.all_csv_filename,
-         net_names=args.net_names,
-         methods=args.methods,
-         modes=args.modes,
-         loss_funcs=args.loss_funcs,
-         )
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(ckpt_root=args.ckpt_root,
+             source_data_root=args.source_data_root,
+             csv_filename=args.all_csv_filename,
+             net_names=args.net_names,
+             methods=args.methods,
+             modes=args.modes,
+             loss_funcs=args.loss_funcs,
+             )
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""vectorized multi-label metrics for models tested on the Visual Search Difficulty dataset.
+
+Computes the per-image metrics found in ``data/csv/VSD_*_test.csv``
+(f1 score, accuracy, Hamming loss) and the per-image counts found in ``*assay_images.csv``
+(TP, FP, TN, FN) for all training replicates at once, without calling
+``sklearn.metrics`` once per image.
+
+Predictions and ground truth are arrays with shape (n_models, n_images, n_classes),
+where n_models is the number of training replicates.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyprojroot
+
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+
+N_CLASSES = 20  # number of classes in Pascal VOC
+
+COUNT_NAMES = ['TP', 'FP', 'TN', 'FN']
+METRIC_NAMES = ['f1_score', 'acc', 'hamming_loss']
+
+
+def confusion_counts(y_pred, y_true):
+    """count true positives, false positives, true negatives, and false negatives for each image
+
+    Parameters
+    ----------
+    y_pred : numpy.ndarray
+        of predicted labels, binary vectors with shape (n_models, n_images, n_classes).
+    y_true : numpy.ndarray
+        of true labels, binary vectors with shape (n_models, n_images, n_classes),
+        or (n_images, n_classes), in which case the same ground truth is used for every model.
+
+    Returns
+    -------
+    counts : dict
+        with keys {'TP', 'FP', 'TN', 'FN'}, where each value is an array
+        with shape (n_models, n_images)
+    """
+    y_pred = np.asarray(y_pred).astype(bool)
+    y_true = np.asarray(y_true).astype(bool)
+    if y_pred.ndim != 3:
+        raise ValueError(
+            f'y_pred should have shape (n_models, n_images, n_classes) but shape was: {y_pred.shape}'
+        )
+    y_true = np.broadcast_to(y_true, y_pred.shape)
+
+    n_classes = y_pred.shape[-1]
+    TP = np.count_nonzero(y_pred & y_true, axis=-1)
+    FP = np.count_nonzero(y_pred & ~y_true, axis=-1)
+    FN = np.count_nonzero(~y_pred & y_true, axis=-1)
+    TN = n_classes - TP - FP - FN
+    return {'TP': TP, 'FP': FP, 'TN': TN, 'FN': FN}
+
+
+def metrics_from_counts(TP, FP, TN, FN):
+    """compute per-image metrics from confusion counts
+
+    The f1 score is computed the same way as
+    ``sklearn.metrics.f1_score(y_true, y_pred, average='macro')``
+    where ``y_true`` and ``y_pred`` are the binary label vectors for a single image,
+    i.e. it is the mean of the f1 score for the "present" class
+    and the f1 score for the "absent" class, averaged only over classes
+    that occur in either the true or predicted labels.
+    Accuracy is the fraction of labels predicted correctly and
+    Hamming loss is the fraction predicted incorrectly.
+
+    Parameters
+    ----------
+    TP, FP, TN, FN : numpy.ndarray
+        counts with the same shape, e.g. as returned by ``confusion_counts``
+
+    Returns
+    -------
+    metrics : dict
+        with keys {'f1_score', 'acc', 'hamming_loss'},
+        where each value is an array with the same shape as the counts
+    """
+    TP, FP, TN, FN = (np.asarray(count, dtype=np.float64) for count in (TP, FP, TN, FN))
+    n_labels = TP + FP + TN + FN
+
+    errors = FP + FN
+    # f1 for "present" class and "absent" class; where denominator is zero, the class
+    # does not occur in y_true or y_pred, so it is left out of the average (like sklearn does)
+    pos_denom = 2 * TP + errors
+    neg_denom = 2 * TN + errors
+    f1_pos = np.divide(2 * TP, pos_denom, out=np.zeros_like(TP), where=pos_denom > 0)
+    f1_neg = np.divide(2 * TN, neg_denom, out=np.zeros_like(TN), where=neg_denom > 0)
+    n_present = (pos_denom > 0).astype(np.float64) + (neg_denom > 0).astype(np.float64)
+    f1_score = np.divide(f1_pos + f1_neg, n_present, out=np.zeros_like(TP), where=n_present > 0)
+
+    hamming_loss = errors / n_labels
+    acc = 1. - hamming_loss
+    return {'f1_score': f1_score, 'acc': acc, 'hamming_loss': hamming_loss}
+
+
+def score(y_pred, y_true):
+    """compute all per-image counts and metrics for all models
+
+    Parameters
+    ----------
+    y_pred : numpy.ndarray
+        of predicted labels, binary vectors with shape (n_models, n_images, n_classes).
+    y_true : numpy.ndarray
+        of true labels, with shape (n_models, n_images, n_classes) or (n_images, n_classes).
+
+    Returns
+    -------
+    scores : dict
+        with keys {'TP', 'FP', 'TN', 'FN', 'f1_score', 'acc', 'hamming_loss'},
+        where each value is an array with shape (n_models, n_images)
+    """
+    scores = confusion_counts(y_pred, y_true)
+    scores.update(metrics_from_counts(**scores))
+    return scores
+
+
+def model_means(scores):
+    """average per-image scores across images, to get one value per model
+
+    Parameters
+    ----------
+    scores : dict
+        returned by ``score``
+
+    Returns
+    -------
+    means : dict
+        with the same keys as scores, where each value is an array with shape (n_models,)
+    """
+    return {key: val.mean(axis=1) for key, val in scores.items()}
+
+
+def to_wide_df(scores, img_names, vsd_scores, index=None, split='test'):
+    """convert scores to a DataFrame with the "wide" layout used by ``data/csv/VSD_*_test.csv``,
+    i.e. one row per image, with columns ``f1_score_model_k``, ``acc_model_k``, and ``hamming_loss_model_k``
+    for each model k, followed by the mean of each metric across models.
+
+    Parameters
+    ----------
+    scores : dict
+        returned by ``score``
+    img_names : list, numpy.ndarray
+        of str, names of images, e.g. '2008_000015'
+    vsd_scores : numpy.ndarray
+        of float, Visual Search Difficulty score for each image
+    index : numpy.ndarray
+        index for DataFrame, e.g. the index of images in the dataset split .csv.
+        Default is None, in which case a RangeIndex is used.
+    split : str
+        value for 'split' column. Default is 'test'.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+    """
+    n_models = scores[METRIC_NAMES[0]].shape[0]
+    columns = {
+        'img': np.asarray(img_names),
+        'difficulty_score': np.asarray(vsd_scores),
+        'split': split,
+    }
+    for model_ind in range(n_models):
+        for metric_name in METRIC_NAMES:
+            columns[f'{metric_name}_model_{model_ind + 1}'] = scores[metric_name][model_ind]
+    for metric_name in METRIC_NAMES:
+        columns[f'mean_{metric_name}'] = scores[metric_name].mean(axis=0)
+    return pd.DataFrame(columns, index=index)
+
+
+def to_long_df(scores, img_names, vsd_scores, replicates=None):
+    """convert scores to a "tidy" DataFrame with one row per image per model,
+    and one column for each count and metric
+
+    Parameters
+    ----------
+    scores : dict
+        returned by ``score``
+    img_names : list, numpy.ndarray
+        of str, names of images, e.g. '2008_000015'
+    vsd_scores : numpy.ndarray
+        of float, Visual Search Difficulty score for each image
+    replicates : list, numpy.ndarray
+        of int, training replicate number for each model.
+        Default is None, in which case replicates are numbered starting from 1.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+    """
+    n_models, n_images = scores[METRIC_NAMES[0]].shape
+    if replicates is None:
+        replicates = np.arange(1, n_models + 1)
+    columns = {
+        'replicate': np.repeat(np.asarray(replicates), n_images),
+        'img_name': np.tile(np.asarray(img_names), n_models),
+        'vsd_score': np.tile(np.asarray(vsd_scores), n_models),
+    }
+    for key in COUNT_NAMES + METRIC_NAMES:
+        columns[key] = scores[key].ravel()
+    return pd.DataFrame(columns)
+
+
+def get_net_number_from_restore_path(restore_path):
+    """get training replicate number from the path that a model was restored from,
+    e.g. '.../net_number_3/alexnet_trained_200_epochs_number_3' -> 3"""
+    return int(Path(restore_path).parent.name.split('_')[-1])
+
+
+def load_assay_arrays(assay_arrays_path):
+    """load predictions and ground truth for all replicates from an ``*assay_arrays.gz`` file
+    created by the ``searchnets assay`` command
+
+    Returns
+    -------
+    y_pred : numpy.ndarray
+        with shape (n_models, n_images, n_classes)
+    y_true : numpy.ndarray
+        with shape (n_images, n_classes)
+    replicates : numpy.ndarray
+        training replicate number of each model, in the same order as the first axis of y_pred
+    """
+    arrays_per_model = joblib.load(assay_arrays_path)
+    restore_paths = sorted(arrays_per_model.keys(), key=get_net_number_from_restore_path)
+    y_pred = np.stack([arrays_per_model[restore_path]['y_pred'] for restore_path in restore_paths])
+    # ground truth is the same for every model since they are all tested on the same test set
+    y_true = arrays_per_model[restore_paths[0]]['y_true_onehot']
+    replicates = np.asarray([get_net_number_from_restore_path(restore_path) for restore_path in restore_paths])
+    return y_pred, y_true, replicates
+
+
+def main(test_results_root,
+         source_data_root,
+         vsd_split_csv,
+         ):
+    """score predictions in all ``*assay_arrays.gz`` files found in test_results_root,
+    and save a "wide" and "long" .csv of per-image metrics for each
+
+    Parameters
+    ----------
+    test_results_root : str, Path
+        path to root of directory that has assay_arrays.gz files created by `searchnets assay` command
+    source_data_root : str, Path
+        path to root of directory where csv files
+        that are the source data for figures should be saved.
+    vsd_split_csv : str, Path
+        path to .csv with Visual Search Difficulty dataset splits,
+        created by `searchnets split` command.
+        Used to get image names and scores for the test set.
+    """
+    test_results_root = Path(test_results_root)
+    source_data_root = Path(source_data_root)
+
+    with instrumentation.stage('load') as load:
+        vsd_split_df = pd.read_csv(load.read(vsd_split_csv), index_col=0)
+        vsd_test_df = vsd_split_df[vsd_split_df['split'] == 'test']
+        load.rows_out = len(vsd_test_df)
+
+    with instrumentation.stage('discovery') as discovery:
+        assay_arrays_paths = sorted(test_results_root.glob('**/*assay_arrays.gz'))
+        discovery.rows_out = len(assay_arrays_paths)
+    for assay_arrays_path in assay_arrays_paths:
+        print(f'scoring predictions in: {assay_arrays_path}')
+        with instrumentation.stage('load') as load:
+            y_pred, y_true, replicates = load_assay_arrays(load.read(assay_arrays_path))
+            load.rows_out = y_pred.shape[0] * y_pred.shape[1]
+        if y_pred.shape[1] != len(vsd_test_df):
+            raise ValueError(
+                f'number of images in {assay_arrays_path.name}, {y_pred.shape[1]}, '
+                f'does not equal number of images in test set, {len(vsd_test_df)}'
+            )
+        with instrumentation.stage('stats', rows_in=y_pred.shape[0] * y_pred.shape[1]) as stats:
+            scores = score(y_pred, y_true)
+
+            wide_df = to_wide_df(scores,
+                                 img_names=vsd_test_df['img'].values,
+                                 vsd_scores=vsd_test_df['difficulty_score'].values,
+                                 index=vsd_test_df.index)
+            long_df = to_long_df(scores,
+                                 img_names=vsd_test_df['img'].values,
+                                 vsd_scores=vsd_test_df['difficulty_score'].values,
+                                 replicates=replicates)
+            stats.rows_out = len(long_df)
+
+        with instrumentation.stage('write', rows_in=len(wide_df) + len(long_df)):
+            stem = assay_arrays_path.name.replace('_assay_arrays.gz', '')
+            wide_df.to_csv(source_data_root.joinpath(f'{stem}_test.csv'))
+            long_df.to_csv(source_data_root.joinpath(f'{stem}_test_long_form.csv'), index=False)
+
+
+ROOT = pyprojroot.here()
+DATA_DIR = ROOT.joinpath('data')
+RESULTS_ROOT = ROOT.joinpath('results')
+
+VSD_ROOT = RESULTS_ROOT.joinpath('VSD')
+TEST_RESULTS_ROOT = VSD_ROOT.joinpath('test_results')
+SOURCE_DATA_ROOT = VSD_ROOT.joinpath('source_data')
+VSD_SPLIT_CSV = DATA_DIR.joinpath('Visual_Search_Difficulty_v1.0/VSD_dataset_split.csv')
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--test_results_root',
+                        help='path to root of directory that has assay_arrays.gz files '
+                             'created by searchnets assay command',
+                        default=TEST_RESULTS_ROOT)
+    parser.add_argument('--source_data_root',
+                        help=('path to root of directory where "source data" csv files '
+                              'that are generated should be saved'),
+                        default=SOURCE_DATA_ROOT)
+    parser.add_argument('--vsd_split_csv',
+                        help=('path to .csv with Visual Search Difficulty dataset splits, '
+                              'created by searchnets split command'),
+                        default=VSD_SPLIT_CSV)
+    instrumentation.add_arguments(parser)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(test_results_root=args.test_results_root,
+             source_data_root=args.source_data_root,
+             vsd_split_csv=args.vsd_split_csv,
+             )
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""compact store for multi-label predictions made by models tested on the Visual Search Difficulty dataset.
+
+Each image's predicted and true label sets are stored as packed bits,
+i.e. 3 bytes per image per replicate for the 20 Pascal VOC classes,
+in a single .npz file along with a header describing the run.
+Confusion counts are computed directly from the packed bits with a popcount lookup table,
+so predictions can be re-scored without re-running inference
+and without expanding them into verbose .csv files.
+"""
+from argparse import ArgumentParser
+import json
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+import pyprojroot
+
+sys.path.insert(0, str(Path(__file__).parents[1]))  # for modules shared by scripts, in src/scripts
+import instrumentation  # noqa: E402
+import vsd_metrics  # noqa: E402
+
+# number of bits set in each possible byte value
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+PREDICTIONS_SUFFIX = '_predictions.npz'
+
+
+def pack(y):
+    """pack binary label vectors into bytes, along the last axis
+
+    Parameters
+    ----------
+    y : numpy.ndarray
+        of binary label vectors, with shape (..., n_classes)
+
+    Returns
+    -------
+    packed : numpy.ndarray
+        of uint8, with shape (..., ceil(n_classes / 8))
+    """
+    return np.packbits(np.asarray(y).astype(bool), axis=-1)
+
+
+def unpack(packed, n_classes=vsd_metrics.N_CLASSES):
+    """unpack bytes into binary label vectors, inverse of ``pack``"""
+    # slice instead of using the ``count`` argument of unpackbits, that needs numpy >= 1.17
+    return np.unpackbits(packed, axis=-1)[..., :n_classes].astype(bool)
+
+
+def popcount(packed):
+    """count number of bits set along last axis of an array of packed bits"""
+    return POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+def confusion_counts(y_pred_packed, y_true_packed, n_classes=vsd_metrics.N_CLASSES):
+    """count true positives, false positives, true negatives, and false negatives
+    for each image, from packed bits
+
+    Parameters
+    ----------
+    y_pred_packed : numpy.ndarray
+        of packed predicted labels, with shape (n_models, n_images, n_bytes)
+    y_true_packed : numpy.ndarray
+        of packed true labels, with shape (n_images, n_bytes)
+    n_classes : int
+        number of classes. Default is 20, the number of classes in Pascal VOC.
+
+    Returns
+    -------
+    counts : dict
+        with keys {'TP', 'FP', 'TN', 'FN'}, where each value is an array
+        with shape (n_models, n_images)
+    """
+    # padding bits are zero in both arrays, so they never count as TP, FP, or FN
+    TP = popcount(y_pred_packed & y_true_packed)
+    FP = popcount(y_pred_packed & ~y_true_packed)
+    FN = popcount(~y_pred_packed & y_true_packed)
+    TN = n_classes - TP - FP - FN
+    return {'TP': TP, 'FP': FP, 'TN': TN, 'FN': FN}
+
+
+def save(predictions_path, y_pred, y_true, img_names, vsd_scores, header):
+    """save predictions as packed bits in a .npz file
+
+    Parameters
+    ----------
+    predictions_path : str, Path
+        path where .npz file should be saved
+    y_pred : numpy.ndarray
+        of predicted labels, binary vectors with shape (n_models, n_images, n_classes)
+    y_true : numpy.ndarray
+        of true labels, binary vectors with shape (n_images, n_classes)
+    img_names : list, numpy.ndarray
+        of str, names of images
+    vsd_scores : numpy.ndarray
+        of float, Visual Search Difficulty score for each image
+    header : dict
+        that describes the run, e.g. with keys 'net_name', 'method', 'loss_func',
+        'replicates', 'restore_paths'. Saved as JSON, so values must be serializable.
+        The number of classes is added to the header.
+    """
+    y_pred = np.asarray(y_pred)
+    header = dict(header, n_classes=int(y_pred.shape[-1]))
+    np.savez(predictions_path,
+             y_pred=pack(y_pred),
+             y_true=pack(y_true),
+             img_names=np.char.encode(np.asarray(img_names, dtype=str), 'ascii'),  # 1 byte per char, not 4
+             vsd_scores=np.asarray(vsd_scores, dtype=np.float32),
+             header=np.asarray(json.dumps(header)))
+
+
+def load(predictions_path):
+    """load predictions saved by ``save``
+
+    Returns
+    -------
+    predictions : dict
+        with keys {'y_pred', 'y_true', 'img_names', 'vsd_scores', 'header'}.
+        Label arrays are still packed, use ``unpack`` to get binary vectors.
+    """
+    with np.load(predictions_path) as npz:
+        predictions = {key: npz[key] for key in ('y_pred', 'y_true', 'vsd_scores')}
+        predictions['img_names'] = np.char.decode(npz['img_names'], 'ascii')
+        predictions['header'] = json.loads(npz['header'].item())
+    return predictions
+
+
+def score(predictions):
+    """compute all per-image counts and metrics from loaded predictions
+
+    Parameters
+    ----------
+    predictions : dict
+        returned by ``load``
+
+    Returns
+    -------
+    scores : dict
+        with keys {'TP', 'FP', 'TN', 'FN', 'f1_score', 'acc', 'hamming_loss'},
+        where each value is an array with shape (n_models, n_images)
+    """
+    scores = confusion_counts(predictions['y_pred'],
+                              predictions['y_true'],
+                              n_classes=predictions['header']['n_classes'])
+    scores.update(vsd_metrics.metrics_from_counts(**scores))
+    return scores
+
+
+def main(test_results_root,
+         source_data_root,
+         vsd_split_csv,
+         save_csv=False,
+         ):
+    """convert all ``*assay_arrays.gz`` files found in test_results_root
+    into packed prediction files, saved next to the file they were converted from
+
+    Parameters
+    ----------
+    test_results_root : str, Path
+        path to root of directory that has assay_arrays.gz files created by `searchnets assay` command
+    source_data_root : str, Path
+        path to root of directory where csv files
+        that are the source data for figures should be saved.
+        Only used when save_csv is True.
+    vsd_split_csv : str, Path
+        path to .csv with Visual Search Difficulty dataset splits,
+        created by `searchnets split` command.
+        Used to get image names and scores for the test set.
+    save_csv : bool
+        if True, also score the packed predictions and save "wide" and "long" .csv files
+        of per-image metrics in source_data_root. Default is False.
+    """
+    test_results_root = Path(test_results_root)
+    source_data_root = Path(source_data_root)
+
+    # stages are not bound to the name 'load', which would shadow the ``load`` function
+    with instrumentation.stage('load') as load_split:
+        vsd_split_df = pd.read_csv(load_split.read(vsd_split_csv), index_col=0)
+        vsd_test_df = vsd_split_df[vsd_split_df['split'] == 'test']
+        load_split.rows_out = len(vsd_test_df)
+
+    with instrumentation.stage('discovery') as discovery:
+        assay_arrays_paths = sorted(test_results_root.glob('**/*assay_arrays.gz'))
+        discovery.rows_out = len(assay_arrays_paths)
+    for assay_arrays_path in assay_arrays_paths:
+        print(f'packing predictions in: {assay_arrays_path}')
+        with instrumentation.stage('load') as load_arrays:
+            y_pred, y_true, replicates = vsd_metrics.load_assay_arrays(load_arrays.read(assay_arrays_path))
+            load_arrays.rows_out = y_pred.shape[0] * y_pred.shape[1]
+        stem = assay_arrays_path.name.replace('_assay_arrays.gz', '')
+        header = {
+            'config': stem,
+            'replicates': replicates.tolist(),
+        }
+        predictions_path = assay_arrays_path.parent.joinpath(stem + PREDICTIONS_SUFFIX)
+        with instrumentation.stage('write', rows_in=y_pred.shape[0] * y_pred.shape[1]):
+            save(predictions_path,
+                 y_pred=y_pred,
+                 y_true=y_true,
+                 img_names=vsd_test_df['img'].values,
+                 vsd_scores=vsd_test_df['difficulty_score'].values,
+                 header=header)
+
+        if save_csv:
+            with instrumentation.stage('load') as load_packed:
+                predictions = load(load_packed.read(predictions_path))
+            with instrumentation.stage('stats', rows_in=y_pred.shape[0] * y_pred.shape[1]) as stats:
+                scores = score(predictions)
+                wide_df = vsd_metrics.to_wide_df(scores,
+                                                 img_names=predictions['img_names'],
+                                                 vsd_scores=predictions['vsd_scores'],
+                                                 index=vsd_test_df.index)
+                long_df = vsd_metrics.to_long_df(scores,
+                                                 img_names=predictions['img_names'],
+                                                 vsd_scores=predictions['vsd_scores'],
+                                                 replicates=predictions['header']['replicates'])
+                stats.rows_out = len(long_df)
+            with instrumentation.stage('write', rows_in=len(wide_df) + len(long_df)):
+                wide_df.to_csv(source_data_root.joinpath(f'{stem}_test.csv'))
+                long_df.to_csv(source_data_root.joinpath(f'{stem}_test_long_form.csv'), index=False)
+
+
+ROOT = pyprojroot.here()
+DATA_DIR = ROOT.joinpath('data')
+RESULTS_ROOT = ROOT.joinpath('results')
+
+VSD_ROOT = RESULTS_ROOT.joinpath('VSD')
+TEST_RESULTS_ROOT = VSD_ROOT.joinpath('test_results')
+SOURCE_DATA_ROOT = VSD_ROOT.joinpath('source_data')
+VSD_SPLIT_CSV = DATA_DIR.joinpath('Visual_Search_Difficulty_v1.0/VSD_dataset_split.csv')
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--test_results_root',
+                        help='path to root of directory that has assay_arrays.gz files '
+                             'created by searchnets assay command',
+                        default=TEST_RESULTS_ROOT)
+    parser.add_argument('--source_data_root',
+                        help=('path to root of directory where "source data" csv files '
+                              'that are generated should be saved'),
+                        default=SOURCE_DATA_ROOT)
+    parser.add_argument('--vsd_split_csv',
+                        help=('path to .csv with Visual Search Difficulty dataset splits, '
+                              'created by searchnets split command'),
+                        default=VSD_SPLIT_CSV)
+    parser.add_argument('--save_csv', action='store_true',
+                        help=('if specified, also score packed predictions and save .csv files '
+                              'with per-image metrics in source_data_root'))
+    instrumentation.add_arguments(parser)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(test_results_root=args.test_results_root,
+             source_data_root=args.source_data_root,
+             vsd_split_csv=args.vsd_split_csv,
+             save_csv=args.save_csv,
+             )
@@ -0,0 +1,289 @@
+"""per-stage timing and memory instrumentation for the analysis scripts.
+
+Scripts mark their stages (e.g. discovery, load, concat, groupby, stats, write) with ``stage``:
+
+    with instrumentation.stage('load') as load:
+        df = pd.read_csv(load.read(csv_path))
+        load.rows_out = len(df)
+
+or by decorating a function with ``staged``, which counts rows of the first argument and of the return value
+if they are DataFrames or arrays. For each stage, records:
+- wall_sec and cpu_sec (CPU time of the whole process, so it can exceed wall time with threads)
+- peak_rss_mb: peak resident set size of the process during the stage.
+  On Linux, the peak is reset at the start of each stage, by writing to /proc/self/clear_refs,
+  so it is the peak of the stage; otherwise it is the peak of the process so far.
+- rows_in, rows_out, and bytes_read, when the script sets them
+
+Stages only record anything inside ``profiled``, which the scripts use when run from the command line,
+so calling a script's ``main`` from a notebook or another script isn't slowed down.
+When ``profiled`` exits, it saves a .profile.json file with the stages summed over calls,
+and a .profile.csv file with one row per call, and prints the summary.
+
+Stages in ``hot_stages`` are also profiled, either with cProfile, saving a .pstats file for each call
+(view with e.g. ``python -m pstats`` or snakeviz), or with py-spy, which is started as a subprocess
+that samples this process, saving a speedscope .json file for each call. py-spy must be installed,
+and may need permission to attach to the process, e.g. with sudo.
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyprojroot
+
+PROFILERS = ['cprofile', 'py-spy']
+PROFILE_ROOT = pyprojroot.here().joinpath('results', 'profiles')
+CLEAR_REFS = Path('/proc/self/clear_refs')
+STATUS = Path('/proc/self/status')
+
+_profile = None  # Profile of the current run, set by ``profiled``
+
+
+def reset_peak_rss():
+    """reset peak resident set size of this process, if the OS supports it
+
+    Returns
+    -------
+    reset : bool
+        True if peak was reset
+    """
+    try:
+        CLEAR_REFS.write_text('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """peak resident set size of this process since it was last reset, in megabytes"""
+    try:
+        for line in STATUS.read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+def n_rows(obj):
+    """number of rows in a DataFrame, Series, or array; None for anything else"""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    elif isinstance(obj, np.ndarray) and obj.ndim > 0:
+        return obj.shape[0]
+    return None
+
+
+def sum_rows(rows):
+    """sum of rows counted in calls of a stage, NaN if none were counted"""
+    return rows.sum(min_count=1)
+
+
+class Stage:
+    """measurements of one call of a stage. Scripts set rows_in and rows_out, and call ``read``"""
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_read = 0
+        self.peak_rss_mb = 0.
+
+    def read(self, path):
+        """add size of file, or of all files in a directory, to bytes read, and return path"""
+        path = Path(path)
+        if path.is_dir():
+            self.bytes_read += sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+        else:
+            self.bytes_read += path.stat().st_size
+        return path
+
+
+class Profile:
+    """stages recorded while running a script"""
+    def __init__(self, script, output_dir, hot_stages=(), profiler='cprofile'):
+        if profiler not in PROFILERS:
+            raise ValueError(
+                f'invalid profiler: {profiler}, must be one of: {PROFILERS}'
+            )
+        self.script = Path(script).stem
+        # with process id, so that runs of a script started at the same time, e.g. by pipeline.py, don't collide
+        self.stem = Path(output_dir).joinpath(f'{self.script}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}')
+        self.stem.parent.mkdir(parents=True, exist_ok=True)
+        self.hot_stages = set(hot_stages)
+        self.profiler = profiler
+        self.stack = []
+        self.records = []
+        self.calls = {}
+        self.n_started = 0
+        self.resets_peak = reset_peak_rss()
+
+    @contextlib.contextmanager
+    def hot_stage_hook(self, key):
+        call = self.calls[key]
+        filename = f'{self.stem.name}.{key.replace("/", ".")}.{call}'
+        if self.profiler == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats(self.stem.parent.joinpath(f'{filename}.pstats'))
+        else:
+            process = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()),
+                                        '--format', 'speedscope', '--nonblocking',
+                                        '--output', str(self.stem.parent.joinpath(f'{filename}.speedscope.json'))],
+                                       stdout=subprocess.DEVNULL)
+            try:
+                yield
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait()
+
+    @contextlib.contextmanager
+    def run_stage(self, stage):
+        # name stages inside the 'total' stage of ``profiled`` relative to it, e.g. 'load', not 'total/load'
+        key = '/'.join([parent.name for parent in self.stack[1:]] + [stage.name])
+        self.calls[key] = self.calls.get(key, 0) + 1
+        start = self.n_started
+        self.n_started += 1
+        if self.resets_peak:
+            if self.stack:
+                # keep peak of enclosing stage so far, before it is reset
+                self.stack[-1].peak_rss_mb = max(self.stack[-1].peak_rss_mb, peak_rss_mb())
+            reset_peak_rss()
+        self.stack.append(stage)
+        # an empty ExitStack does nothing, like contextlib.nullcontext, which needs python >= 3.7
+        hook = self.hot_stage_hook(key) if stage.name in self.hot_stages else contextlib.ExitStack()
+        cpu = time.process_time()
+        tic = time.perf_counter()
+        try:
+            with hook:
+                yield stage
+        finally:
+            wall_sec = time.perf_counter() - tic
+            cpu_sec = time.process_time() - cpu
+            self.stack.pop()
+            stage.peak_rss_mb = max(stage.peak_rss_mb, peak_rss_mb())
+            if self.stack:
+                self.stack[-1].peak_rss_mb = max(self.stack[-1].peak_rss_mb, stage.peak_rss_mb)
+            self.records.append(dict(stage=key, call=self.calls[key], start=start, depth=len(self.stack),
+                                     wall_sec=wall_sec, cpu_sec=cpu_sec, peak_rss_mb=stage.peak_rss_mb,
+                                     rows_in=stage.rows_in, rows_out=stage.rows_out, bytes_read=stage.bytes_read))
+
+    def summary(self):
+        """stages summed over calls, in the order they first ran"""
+        df = pd.DataFrame.from_records(self.records)
+        summary = df.groupby('stage', sort=False).agg(
+            calls=('call', 'max'),
+            depth=('depth', 'first'),
+            start=('start', 'min'),
+            wall_sec=('wall_sec', 'sum'),
+            cpu_sec=('cpu_sec', 'sum'),
+            peak_rss_mb=('peak_rss_mb', 'max'),
+            rows_in=('rows_in', sum_rows),
+            rows_out=('rows_out', sum_rows),
+            bytes_read=('bytes_read', 'sum'),
+        )
+        return summary.sort_values('start').drop(columns='start').reset_index()
+
+    def save(self):
+        summary = self.summary()
+        pd.DataFrame.from_records(self.records).to_csv(self.stem.with_name(self.stem.name + '.profile.csv'),
+                                                       index=False)
+        profile = dict(script=self.script,
+                       argv=sys.argv,
+                       host=socket.gethostname(),
+                       python=platform.python_version(),
+                       time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       peak_rss_is_per_stage=self.resets_peak,
+                       stages=json.loads(summary.to_json(orient='records')))
+        json_path = self.stem.with_name(self.stem.name + '.profile.json')
+        json_path.write_text(json.dumps(profile, indent=2))
+        return summary, json_path
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """context manager that records a stage of the current run, and yields its ``Stage``
+
+    Parameters
+    ----------
+    name : str
+        name of stage, e.g. 'load'. Stages inside other stages are recorded as e.g. 'load/concat'
+    rows_in : int
+        number of rows the stage starts with. Can also be set on the yielded ``Stage``.
+    """
+    this_stage = Stage(name, rows_in)
+    if _profile is None:
+        yield this_stage
+        return
+    with _profile.run_stage(this_stage):
+        yield this_stage
+
+
+def staged(name=None):
+    """decorator that records each call of a function as a stage, named name or the function's name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__, rows_in=n_rows(args[0]) if args else None) as this_stage:
+                out = func(*args, **kwargs)
+                this_stage.rows_out = n_rows(out)
+            return out
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def profiled(script, profile_dir=None, hot_stages=(), profiler='cprofile'):
+    """record stages run inside this context, and save profile when it exits
+
+    Parameters
+    ----------
+    script : str, Path
+        path to script, used to name profile, e.g. ``__file__``
+    profile_dir : str, Path
+        directory where profile is saved. Default is None, in which case results/profiles is used.
+    hot_stages : list
+        of str, names of stages to also profile with profiler. Default is none.
+    profiler : str
+        one of {'cprofile', 'py-spy'}. Default is 'cprofile'.
+    """
+    global _profile
+    if profile_dir is None:
+        profile_dir = PROFILE_ROOT
+    _profile = Profile(script, profile_dir, hot_stages, profiler)
+    try:
+        with stage('total'):
+            yield _profile
+    finally:
+        profile, _profile = _profile, None
+        summary, json_path = profile.save()
+        print(summary.to_string(index=False, float_format='%.3f'))
+        print(f'saved profile in {json_path}')
+
+
+def add_arguments(parser):
+    """add command-line arguments for ``profiled`` to a script's parser"""
+    parser.add_argument('--profile_dir', default=None,
+                        help='directory where profile of stages is saved. Default is results/profiles')
+    parser.add_argument('--hot_stages', default=[],
+                        help='comma-separated list of stages to also profile with --profiler, e.g. load,stats',
+                        type=lambda hot_stages: hot_stages.split(','))
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile',
+                        help='profiler used for --hot_stages')
+    return parser
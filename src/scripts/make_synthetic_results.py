@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""make synthetic results trees, with the same layout as the results of training and testing,
+so the generate_source_data_* scripts can be run (and benchmarked) without real training outputs.
+
+For the 'searchstims' experiment, makes:
+
+    output_root/
+        split.csv  # dataset split, pass as both --alexnet_split_csv_path and --VGG16_split_csv_path
+        results_gz/{net}_{method}_lr_1e-03_synthetic/
+            searchnets_{net}_{method}_lr_1e-03_synthetic_trained_{epochs}_epochs_test_results.gz
+            searchnets_{net}_{method}_lr_1e-03_synthetic_trained_{epochs}_epochs_test_results.csv
+        checkpoints/{net}_{method}_lr_1e-03_synthetic/trained_{epochs}_epochs/net_number_{replicate}/...
+        source_data/
+
+and for the 'VSD' experiment:
+
+    output_root/
+        test_results/VSD_{net}_{method}_{loss_func}/
+            VSD_{net}_{method}_{loss_func}_trained_{epochs}_epochs_test_results.gz
+            VSD_{net}_{method}_{loss_func}_trained_{epochs}_epochs_test_results.csv
+            VSD_{net}_{method}_{loss_func}_trained_{epochs}_epochs_assay_images.csv
+        checkpoints/{net}_{method}_{loss_func}/trained_{epochs}_epochs/net_number_{replicate}/...
+        source_data/
+
+where each net_number_{replicate} directory has a training history, either a tfevents file
+like the ones saved by SummaryWriter, or .metrics files like the ones saved by engine/metrics_log.py.
+Accuracy decreases with set size (searchstims) or visual search difficulty score (VSD),
+so the statistics computed by the scripts aren't degenerate.
+
+Nets after the first four in NET_NAMES are named 'CORnet_X01', 'CORnet_X02', ...
+so that the scripts use the alexnet-sized split for them, and so that no name contains another,
+since the scripts find files by checking whether the net name is in the path.
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+import struct
+import time
+from urllib.parse import quote
+
+import joblib
+import numpy as np
+import pandas as pd
+
+EXPERIMENTS = ['searchstims', 'VSD']
+NET_NAMES = ['alexnet', 'VGG16', 'CORnet_Z', 'CORnet_S']
+METHODS = ['initialize', 'transfer']
+LOSS_FUNCS = ['BCE', 'CE-largest', 'CE-random']
+STIMULI = ['RVvGV', 'RVvRHGV', '2_v_5']
+SET_SIZES = [1, 2, 4, 6, 8]
+HISTORY_FORMATS = ['tfevents', 'metrics']
+
+EPOCHS = 200
+N_TEST_PER_CONDITION = 100  # searchstims test images per stimulus, set size, and target condition
+N_IMAGES_VSD = 2884  # images in the Visual Search Difficulty test set
+N_CLASSES_VSD = 20  # classes in Pascal VOC
+N_STEPS = 2000
+VAL_STEP = 200
+SEED = 42
+
+# tfevents files are TFRecord files of serialized Event protocol buffers, see
+# tensorboard/compat/proto/event.proto and tensorflow/core/lib/io/record_writer.cc
+FILE_VERSION = b'brain.Event:2'
+CRC32C_POLY = 0x82F63B78
+CRC32C_TABLE = []
+for _byte in range(256):
+    _crc = _byte
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ CRC32C_POLY if _crc & 1 else _crc >> 1
+    CRC32C_TABLE.append(_crc)
+
+# same as engine/metrics_log.py
+METRICS_SUFFIX = '.metrics'
+METRICS_RECORD_DTYPE = np.dtype([('step', '<i8'), ('wall_time', '<f8'), ('value', '<f8')])
+
+
+def get_net_names(n_nets):
+    """names of n_nets nets: the nets in NET_NAMES, then 'CORnet_X01', 'CORnet_X02', ..."""
+    return NET_NAMES[:n_nets] + [f'CORnet_X{ind:02d}' for ind in range(1, n_nets - len(NET_NAMES) + 1)]
+
+
+def masked_crc32c(data):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    crc ^= 0xFFFFFFFF
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def length_delimited(field_number, data):
+    return varint(field_number << 3 | 2) + varint(len(data)) + data
+
+
+def event_bytes(wall_time, step, tag=None, value=None):
+    """serialize an Event with a scalar summary, or with the file version if tag is None"""
+    event = b'\x09' + struct.pack('<d', wall_time) + b'\x10' + varint(step)
+    if tag is None:
+        return event + length_delimited(3, FILE_VERSION)
+    summary_value = length_delimited(1, tag.encode()) + b'\x15' + struct.pack('<f', value)
+    return event + length_delimited(5, length_delimited(1, summary_value))
+
+
+def write_tfevents(log_dir, history, wall_time):
+    """write history, a dict that maps tags to (steps, values), to a tfevents file in log_dir"""
+    records = [event_bytes(wall_time, 0)]
+    for tag, (steps, values) in history.items():
+        records.extend(event_bytes(wall_time + step, int(step), tag, float(value))
+                       for step, value in zip(steps, values))
+    path = Path(log_dir).joinpath(f'events.out.tfevents.{int(wall_time)}.synthetic')
+    with path.open('wb') as fp:
+        for record in records:
+            length = struct.pack('<Q', len(record))
+            fp.write(length + struct.pack('<I', masked_crc32c(length))
+                     + record + struct.pack('<I', masked_crc32c(record)))
+
+
+def write_metrics(log_dir, history, wall_time):
+    """write history, a dict that maps tags to (steps, values), to .metrics files in log_dir"""
+    for tag, (steps, values) in history.items():
+        records = np.zeros(len(steps), dtype=METRICS_RECORD_DTYPE)
+        records['step'] = steps
+        records['wall_time'] = wall_time + steps
+        records['value'] = values
+        Path(log_dir).joinpath(quote(tag, safe='') + METRICS_SUFFIX).write_bytes(records.tobytes())
+
+
+def make_history(rng, n_steps, val_step):
+    """training history with the tags logged by searchnets trainers: loss decays, accuracy rises"""
+    steps = np.arange(n_steps)
+    loss = 0.7 * np.exp(-steps / (n_steps / 4)) + 0.05 + 0.05 * rng.random_sample(n_steps)
+    val_steps = np.arange(val_step, n_steps, val_step)
+    val_loss = loss[val_steps] + 0.02 * rng.random_sample(len(val_steps))
+    val_acc = 1 - val_loss / 1.5
+    return {'loss/train': (steps, loss),
+            'loss/val': (val_steps, val_loss),
+            'acc/val': (val_steps, val_acc)}
+
+
+def write_histories(rng, save_path, net_name, n_replicates, n_steps, val_step, history_format):
+    for replicate in range(1, n_replicates + 1):
+        log_dir = save_path.joinpath(f'trained_{EPOCHS}_epochs', f'net_number_{replicate}',
+                                     f'{net_name}_trained_{EPOCHS}_epochs_number_{replicate}', 'train')
+        log_dir.mkdir(parents=True, exist_ok=True)
+        history = make_history(rng, n_steps, val_step)
+        if history_format == 'tfevents':
+            write_tfevents(log_dir, history, time.time())
+        else:
+            write_metrics(log_dir, history, time.time())
+
+
+def restore_path(save_path, net_name, replicate):
+    return str(save_path.joinpath(f'trained_{EPOCHS}_epochs', f'net_number_{replicate}',
+                                  f'{net_name}_trained_{EPOCHS}_epochs_number_{replicate}'))
+
+
+def make_searchstims(output_root, rng, net_names, methods, n_replicates,
+                     stimuli, set_sizes, n_test_per_condition, n_steps, val_step, history_format):
+    records = defaultdict(list)
+    for stimulus in stimuli:
+        for set_size in set_sizes:
+            for target_condition in ('present', 'absent'):
+                for split, n_images in (('train', 2 * n_test_per_condition), ('test', n_test_per_condition)):
+                    for img_num in range(n_images):
+                        img_file = f'{stimulus}/{set_size}/{target_condition}/{split}_{img_num}.png'
+                        records['stimulus'].append(stimulus)
+                        records['set_size'].append(set_size)
+                        records['target_condition'].append(target_condition)
+                        records['img_num'].append(img_num)
+                        records['root_output_dir'].append(str(output_root))
+                        records['img_file'].append(img_file)
+                        records['meta_file'].append(img_file.replace('.png', '.meta.json'))
+                        records['split'].append(split)
+    df_split = pd.DataFrame.from_records(records)
+    df_split.to_csv(output_root.joinpath('split.csv'), index=False)
+
+    df_test = df_split[df_split['split'] == 'test']
+    y_true = (df_test['target_condition'] == 'present').values.astype(int)
+    # harder with bigger set sizes, and for nets trained from randomly-initialized weights
+    p_correct = 0.98 - 0.03 * df_test['set_size'].values
+
+    for net_name in net_names:
+        for method in methods:
+            run_name = f'{net_name}_{method}_lr_1e-03_synthetic'
+            save_path = output_root.joinpath('checkpoints', run_name)
+            test_results_save_path = output_root.joinpath('results_gz', run_name)
+            test_results_save_path.mkdir(parents=True, exist_ok=True)
+
+            p = p_correct - (0.1 if method == 'initialize' else 0.)
+            predictions_per_model_dict = {}
+            test_records = defaultdict(list)
+            for replicate in range(1, n_replicates + 1):
+                correct = rng.random_sample(len(y_true)) < p
+                pred = np.where(correct, y_true, 1 - y_true)
+                key = restore_path(save_path, net_name, replicate)
+                predictions_per_model_dict[key] = pred
+                for col, value in zip(('net_name', 'replicate', 'method', 'loss_func', 'restore_path', 'acc'),
+                                      (net_name, replicate, method, 'CE', key, correct.mean())):
+                    test_records[col].append(value)
+
+            fname_stem = test_results_save_path.joinpath(f'searchnets_{run_name}_trained_{EPOCHS}_epochs')
+            joblib.dump(dict(predictions_per_model_dict=predictions_per_model_dict,
+                             set_sizes=set_sizes), f'{fname_stem}_test_results.gz')
+            pd.DataFrame.from_records(test_records).to_csv(f'{fname_stem}_test_results.csv', index=False)
+
+            write_histories(rng, save_path, net_name, n_replicates, n_steps, val_step, history_format)
+
+
+def make_vsd(output_root, rng, net_names, methods, loss_funcs, n_replicates,
+             n_images, n_steps, val_step, history_format):
+    # the test set is the same for every net, so VSD scores, items, and image names are too
+    vsd_score = np.round(1.5 + rng.gamma(shape=4., scale=0.5, size=n_images), 6)
+    n_items = np.minimum(1 + rng.poisson(0.8, size=n_images), 6)
+    img_name = np.array([f'2008_{ind:06d}' for ind in range(n_images)])
+    # harder with higher visual search difficulty scores
+    p_correct = np.clip(1.1 - 0.08 * vsd_score, 0.05, 0.99)
+
+    for net_name in net_names:
+        for method in methods:
+            for loss_func in loss_funcs:
+                dir_loss_func = loss_func.replace('-', '_')  # as in the names of the config files
+                save_path = output_root.joinpath('checkpoints', f'{net_name}_{method}_{dir_loss_func}')
+                run_name = f'VSD_{net_name}_{method}_{dir_loss_func}'
+                test_results_save_path = output_root.joinpath('test_results', run_name)
+                test_results_save_path.mkdir(parents=True, exist_ok=True)
+
+                p = p_correct - (0.1 if method == 'initialize' else 0.)
+                predictions_per_model_dict = {}
+                img_names_per_model_dict = {}
+                test_records = defaultdict(list)
+                images_dfs = []
+                for replicate in range(1, n_replicates + 1):
+                    key = restore_path(save_path, net_name, replicate)
+                    if loss_func == 'BCE':
+                        TP = rng.binomial(n_items, p)
+                        FP = rng.binomial(2, 1 - p)
+                    else:  # single-label, predicts one class
+                        TP = (rng.random_sample(n_images) < p).astype(int)
+                        FP = 1 - TP
+                    FN = n_items - TP
+                    TN = N_CLASSES_VSD - TP - FP - FN
+                    images_dfs.append(pd.DataFrame({
+                        'TP': TP, 'FP': FP, 'TN': TN, 'FN': FN,
+                        'vsd_score': vsd_score, 'n_items': n_items,
+                        'img_name': img_name,
+                        'img_path': [f'JPEGImages/{name}.jpg' for name in img_name],
+                        'voc_test_index': np.arange(n_images),
+                        'net_name': net_name, 'replicate': replicate, 'mode': 'classify',
+                        'method': method, 'loss_func': loss_func, 'restore_path': key,
+                    }))
+                    pred = np.zeros((n_images, N_CLASSES_VSD), dtype=np.float32)
+                    pred[np.arange(n_images), rng.randint(N_CLASSES_VSD, size=n_images)] = 1.
+                    predictions_per_model_dict[key] = pred
+                    img_names_per_model_dict[key] = img_name.tolist()
+
+                    precision = TP / np.maximum(TP + FP, 1)
+                    recall = TP / n_items
+                    f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+                    for col, value in zip(
+                            ('net_name', 'replicate', 'method', 'loss_func', 'restore_path',
+                             'f1', 'acc_largest', 'acc_random'),
+                            (net_name, replicate, method, loss_func, key,
+                             f1.mean(), (TP > 0).mean(), (TP / n_items).mean())):
+                        test_records[col].append(value)
+
+                fname_stem = test_results_save_path.joinpath(f'{run_name}_trained_{EPOCHS}_epochs')
+                joblib.dump(dict(predictions_per_model_dict=predictions_per_model_dict,
+                                 img_names_per_model_dict=img_names_per_model_dict),
+                            f'{fname_stem}_test_results.gz')
+                pd.DataFrame.from_records(test_records).to_csv(f'{fname_stem}_test_results.csv', index=False)
+                pd.concat(images_dfs).to_csv(f'{fname_stem}_assay_images.csv', index=False)
+
+                write_histories(rng, save_path, net_name, n_replicates, n_steps, val_step, history_format)
+
+
+def main(output_root,
+         experiment,
+         n_nets=len(NET_NAMES),
+         methods=METHODS,
+         loss_funcs=LOSS_FUNCS,
+         n_replicates=8,
+         stimuli=STIMULI,
+         set_sizes=SET_SIZES,
+         n_test_per_condition=N_TEST_PER_CONDITION,
+         n_images=N_IMAGES_VSD,
+         n_steps=N_STEPS,
+         val_step=VAL_STEP,
+         history_format='tfevents',
+         seed=SEED):
+    """make a synthetic results tree
+
+    Parameters
+    ----------
+    output_root : str, Path
+        directory where tree is made. Created if it doesn't exist.
+    experiment : str
+        one of {'searchstims', 'VSD'}
+    n_nets : int
+        number of neural network architectures. Default is 4, the nets in NET_NAMES.
+    methods : list
+        of str, training "methods". Default is ['initialize', 'transfer'].
+    loss_funcs : list
+        of str, loss functions. Only used for 'VSD'. Default is ['BCE', 'CE-largest', 'CE-random'].
+    n_replicates : int
+        number of training replicates of each net, method, and loss function. Default is 8.
+    stimuli : list
+        of str, visual search stimuli. Only used for 'searchstims'. Default is ['RVvGV', 'RVvRHGV', '2_v_5'].
+    set_sizes : list
+        of int. Only used for 'searchstims', and must include 1 and 8. Default is [1, 2, 4, 6, 8].
+    n_test_per_condition : int
+        number of test images for each stimulus, set size, and target condition.
+        Only used for 'searchstims'. Default is 100.
+    n_images : int
+        number of test images. Only used for 'VSD'. Default is 2884, as in the real test set.
+    n_steps : int
+        number of training steps in each training history. Default is 2000.
+    val_step : int
+        validation is logged every val_step steps. Default is 200.
+    history_format : str
+        one of {'tfevents', 'metrics'}. Default is 'tfevents'.
+    seed : int
+        seed for random number generator. Default is 42.
+    """
+    if experiment not in EXPERIMENTS:
+        raise ValueError(
+            f'invalid experiment: {experiment}, must be one of: {EXPERIMENTS}'
+        )
+    if history_format not in HISTORY_FORMATS:
+        raise ValueError(
+            f'invalid history_format: {history_format}, must be one of: {HISTORY_FORMATS}'
+        )
+    output_root = Path(output_root)
+    output_root.joinpath('source_data').mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)  # not default_rng, which needs numpy >= 1.17
+    net_names = get_net_names(n_nets)
+
+    if experiment == 'searchstims':
+        make_searchstims(output_root, rng, net_names, methods, n_replicates,
+                         stimuli, set_sizes, n_test_per_condition, n_steps, val_step, history_format)
+    else:
+        make_vsd(output_root, rng, net_names, methods, loss_funcs, n_replicates,
+                 n_images, n_steps, val_step, history_format)
+    return net_names
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('output_root',
+                        help='directory where synthetic results tree is made')
+    parser.add_argument('experiment', choices=EXPERIMENTS,
+                        help='which experiment the results tree is for')
+    parser.add_argument('--n_nets', type=int, default=len(NET_NAMES),
+                        help='number of neural network architectures')
+    parser.add_argument('--methods', default=METHODS,
+                        help='comma-separated list of training "methods", must be in {"transfer", "initialize"}',
+                        type=lambda methods: methods.split(','))
+    parser.add_argument('--loss_funcs', default=LOSS_FUNCS,
+                        help='comma-separated list of loss functions, must be in {"BCE", "CE-largest", "CE-random"}',
+                        type=lambda loss_funcs: loss_funcs.split(','))
+    parser.add_argument('--n_replicates', type=int, default=8,
+                        help='number of training replicates of each net, method, and loss function')
+    parser.add_argument('--stimuli', default=STIMULI,
+                        help='comma-separated list of visual search stimuli',
+                        type=lambda stimuli: stimuli.split(','))
+    parser.add_argument('--set_sizes', default=SET_SIZES,
+                        help='comma-separated list of set sizes, must include 1 and 8',
+                        type=lambda set_sizes: [int(set_size) for set_size in set_sizes.split(',')])
+    parser.add_argument('--n_test_per_condition', type=int, default=N_TEST_PER_CONDITION,
+                        help='searchstims test images per stimulus, set size, and target condition')
+    parser.add_argument('--n_images', type=int, default=N_IMAGES_VSD,
+                        help='number of VSD test images')
+    parser.add_argument('--n_steps', type=int, default=N_STEPS,
+                        help='number of training steps in each training history')
+    parser.add_argument('--val_step', type=int, default=VAL_STEP,
+                        help='validation is logged every val_step steps')
+    parser.add_argument('--history_format', choices=HISTORY_FORMATS, default='tfevents',
+                        help='format of training histories')
+    parser.add_argument('--seed', type=int, default=SEED)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(output_root=args.output_root,
+         experiment=args.experiment,
+         n_nets=args.n_nets,
+         methods=args.methods,
+         loss_funcs=args.loss_funcs,
+         n_replicates=args.n_replicates,
+         stimuli=args.stimuli,
+         set_sizes=args.set_sizes,
+         n_test_per_condition=args.n_test_per_condition,
+         n_images=args.n_images,
+         n_steps=args.n_steps,
+         val_step=args.val_step,
+         history_format=args.history_format,
+         seed=args.seed,
+         )
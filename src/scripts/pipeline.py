@@ -0,0 +1,549 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""run the scripts and notebooks that make source data and figures as a pipeline of stages,
+skipping stages that are up to date.
+
+Each stage runs one script with fixed parameters, or executes one notebook,
+and declares the files it reads (inputs) and writes (outputs), as glob patterns relative to the root.
+A stage depends on every stage with an output that matches one of its inputs,
+e.g. 'VSD-test-acc-v-r-coeff' depends on 'VSD-test-results' and 'VSD-acc-vsd-corr-8-bins-quantile'.
+Stages whose dependencies have finished run concurrently, each in its own process.
+
+The key of a stage is a hash of its script or notebook, its parameters, and the contents of its inputs.
+After a stage runs, its key and hashes of its outputs are saved in results/pipeline/state.json.
+A stage is skipped if its key and its outputs are the same as when it last ran.
+Since keys hash contents, not modification times, a stage is also skipped if an upstream stage re-ran
+but wrote the same outputs. So after one new replicate is added to results/VSD/test_results, only the VSD
+test results and accuracy / VSD score correlation stages re-run, and the stages and figures downstream of them.
+Hashes of files are cached in the state by size and modification time, so unchanged files aren't read again.
+
+Logs of each stage are saved in results/pipeline/logs, profiles of scripts in results/pipeline/profiles,
+and executed notebooks in results/pipeline/notebooks.
+Notebooks read and save figures in the project root, wherever the pipeline root is.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatchcase
+import hashlib
+import json
+import os
+from pathlib import Path, PurePosixPath
+import subprocess
+import sys
+import threading
+import time
+
+import pyprojroot
+
+ROOT = pyprojroot.here()
+SCRIPTS_ROOT = Path(__file__).parent
+PIPELINE_DIR = 'results/pipeline'  # relative to root
+STATE_JSON = 'state.json'
+
+CHUNK_SIZE = 2 ** 20
+GLOB_CHARS = set('*?[')
+
+RAN, SKIPPED, FAILED, BLOCKED = 'ran', 'skipped', 'failed', 'blocked'
+
+
+class Stage:
+    """a script run with fixed parameters, or a notebook, and the files it reads and writes
+
+    Parameters
+    ----------
+    name : str
+        unique name of stage
+    script : str
+        path to .py script or .ipynb notebook, relative to src/scripts
+    params : dict
+        command-line options passed to script. Values that are Paths are relative to the root,
+        lists are joined with commas, and options that are True are passed as flags. Not used for notebooks.
+    inputs : list
+        of glob patterns of files read by the stage, relative to the root.
+        A pattern without wildcards can also be a directory, to include all files in it.
+    outputs : list
+        of glob patterns of files written by the stage, relative to the root.
+        Notebooks also output a copy of the executed notebook in results/pipeline/notebooks.
+    exclude : list
+        of patterns of file names that are not inputs, even if they match,
+        e.g. .csv files that the training history scripts save next to events files.
+    """
+    def __init__(self, name, script, params=None, inputs=(), outputs=(), exclude=()):
+        self.name = name
+        self.script = script
+        self.params = params if params is not None else {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        if self.is_notebook:
+            self.outputs.append(f'{PIPELINE_DIR}/notebooks/{name}.ipynb')
+        self.exclude = list(exclude)
+
+    @property
+    def is_notebook(self):
+        return self.script.endswith('.ipynb')
+
+    def param_strings(self, root=None):
+        """command-line options as strings. Paths are made absolute if root is specified"""
+        strings = {}
+        for param, value in self.params.items():
+            if isinstance(value, Path):
+                value = root.joinpath(value) if root is not None else PurePosixPath(value)
+            elif isinstance(value, (list, tuple)):
+                value = ','.join(str(val) for val in value)
+            strings[param] = str(value)
+        return strings
+
+    def reads(self, path):
+        """True if path, relative to the root, is one of the stage's inputs"""
+        path = str(PurePosixPath(path))
+        if any(fnmatchcase(PurePosixPath(path).name, name_pattern) for name_pattern in self.exclude):
+            return False
+        for pattern in self.inputs:
+            if GLOB_CHARS & set(pattern):
+                # '**/' can also match no directories, like with Path.glob
+                if fnmatchcase(path, pattern) or fnmatchcase(path, pattern.replace('**/', '')):
+                    return True
+            elif path == pattern or path.startswith(pattern.rstrip('/') + '/'):
+                return True
+        return False
+
+    def command(self, root):
+        script_path = SCRIPTS_ROOT.joinpath(self.script)
+        if self.is_notebook:
+            return ['jupyter', 'nbconvert', '--to', 'notebook', '--execute',
+                    '--output-dir', str(root.joinpath(PIPELINE_DIR, 'notebooks')), '--output', self.name,
+                    str(script_path)]
+        command = [sys.executable, str(script_path)]
+        for param, value in self.param_strings(root).items():
+            if self.params[param] is True:
+                command.append(f'--{param}')
+            else:
+                command.extend([f'--{param}', value])
+        # scripts that make source data all save a profile of their stages, see instrumentation.py
+        return command + ['--profile_dir', str(root.joinpath(PIPELINE_DIR, 'profiles'))]
+
+
+def searchstims_stages(expt, split_csvs, net_names=None):
+    """stages that make source data for one experiment with searchstims, e.g. '3stims'"""
+    results_gz_root = Path(f'results/searchstims/results_gz/{expt}')
+    ckpt_root = Path(f'results/searchstims/checkpoints/{expt}')
+    source_data_root = Path(f'results/searchstims/source_data/{expt}')
+    net_params = {} if net_names is None else dict(net_names=net_names)
+    return [
+        Stage(f'searchstims-{expt}-source-data',
+              'experiment-1-searchstims/generate_source_data_csv.py',
+              params=dict(results_gz_root=results_gz_root, source_data_root=source_data_root,
+                          **split_csvs, **net_params, incremental=True),
+              inputs=[f'{results_gz_root}/**/*.gz'] + [str(split_csv) for split_csv in split_csvs.values()],
+              outputs=[f'{source_data_root}/{csv_filename}' for csv_filename in SEARCHSTIMS_SOURCE_DATA_CSVS]),
+        Stage(f'searchstims-{expt}-test-results',
+              'experiment-1-searchstims/generate_source_data_test_results.py',
+              params=dict(test_results_root=results_gz_root, source_data_root=source_data_root),
+              inputs=[f'{results_gz_root}/**/*test_results.csv'],
+              outputs=[f'{source_data_root}/all_test_results.csv', f'{source_data_root}/test_results_table*']),
+        Stage(f'searchstims-{expt}-training-histories',
+              'experiment-1-searchstims/generate_source_data_training_histories_csv.py',
+              params=dict(ckpt_root=ckpt_root, source_data_root=source_data_root, **net_params),
+              inputs=[f'{ckpt_root}/**/*tfevents*', f'{ckpt_root}/**/*.metrics'],
+              outputs=[f'{source_data_root}/training_history.csv'],
+              exclude=['*.csv']),
+    ]
+
+
+def notebook_stage(notebook, inputs):
+    return Stage(Path(notebook).stem, notebook, inputs=inputs)
+
+
+SEARCHSTIMS_SOURCE_DATA_CSVS = ['all.csv', 'acc_diff.csv', 'stim_acc_diff.csv', 'net_acc_diff.csv',
+                                'acc_diff_by_stim.csv']
+# source data read by acc-v-set-size and effect-size-heat-map notebooks
+SEARCHSTIMS_FIG_CSVS = ['all.csv', 'stim_acc_diff.csv', 'net_acc_diff.csv', 'acc_diff_by_stim.csv']
+
+THREE_STIMS_SPLIT_CSVS = dict(
+    alexnet_split_csv_path=Path('../visual_search_stimuli/alexnet_multiple_stims/'
+                                'alexnet_three_stims_38400samples_balanced_split.csv'),
+    VGG16_split_csv_path=Path('../visual_search_stimuli/VGG16_multiple_stims/'
+                              'VGG16_three_stims_38400samples_balanced_split.csv'),
+)
+TEN_STIMS_SPLIT_CSVS = dict(
+    alexnet_split_csv_path=Path('../visual_search_stimuli/alexnet_multiple_stims/'
+                                'alexnet_multiple_stims_128000samples_balanced_split.csv'),
+    VGG16_split_csv_path=Path('../visual_search_stimuli/VGG16_multiple_stims/'
+                              'VGG16_multiple_stims_128000samples_balanced_split.csv'),
+)
+
+
+def alexnet_only(split_csvs):
+    return {param: split_csv for param, split_csv in split_csvs.items() if param.startswith('alexnet')}
+
+
+VSD_TEST_RESULTS_ROOT = Path('results/VSD/test_results')
+VSD_CKPT_ROOT = Path('results/VSD/checkpoints')
+VSD_SOURCE_DATA_ROOT = Path('results/VSD/source_data')
+VSD_BINNINGS = [(4, 'quantile'), (8, 'quantile'), (12, 'quantile'), (8, 'uniform')]
+
+STAGES = [
+    # experiment 1, searchstims. Same experiments and arguments as runall.sh
+    *searchstims_stages('3stims', THREE_STIMS_SPLIT_CSVS),
+    *searchstims_stages('10stims', TEN_STIMS_SPLIT_CSVS),
+    *searchstims_stages('3stims_white_background', alexnet_only(THREE_STIMS_SPLIT_CSVS), net_names=['alexnet']),
+    *searchstims_stages('10stims_white_background', alexnet_only(TEN_STIMS_SPLIT_CSVS), net_names=['alexnet']),
+    *[notebook_stage(f'experiment-1-searchstims/{stims}-{fig}-fig.ipynb',
+                     [f'results/searchstims/source_data/{stims}/{csv_filename}'
+                      for csv_filename in SEARCHSTIMS_FIG_CSVS])
+      for stims in ['3stims', '10stims']
+      for fig in ['acc-v-set-size', 'effect-size-heat-map']],
+    notebook_stage('experiment-1-searchstims/3stims-white-background-acc-v-set-size-fig.ipynb',
+                   [f'results/searchstims/source_data/3stims_white_background/{csv_filename}'
+                    for csv_filename in SEARCHSTIMS_FIG_CSVS]),
+    *[notebook_stage(f'experiment-1-searchstims/training-histories-{expt.replace("_", "-")}.ipynb',
+                     [f'results/searchstims/source_data/{expt}/training_history.csv'])
+      for expt in ['3stims', '10stims', '3stims_white_background', '10stims_white_background']],
+
+    # experiment 2, Visual Search Difficulty dataset
+    Stage('VSD-test-results',
+          'experiment-2-VSD/generate_source_data_test_results.py',
+          params=dict(test_results_root=VSD_TEST_RESULTS_ROOT, source_data_root=VSD_SOURCE_DATA_ROOT),
+          inputs=[f'{VSD_TEST_RESULTS_ROOT}/**/*test_results.csv'],
+          outputs=[f'{VSD_SOURCE_DATA_ROOT}/all_test_results*.csv', f'{VSD_SOURCE_DATA_ROOT}/test_results_table_*']),
+    *[Stage(f'VSD-acc-vsd-corr-{n_bins}-bins-{strategy}',
+            'experiment-2-VSD/generate_source_data_acc_vsd_corr.py',
+            params=dict(test_results_root=VSD_TEST_RESULTS_ROOT, source_data_root=VSD_SOURCE_DATA_ROOT,
+                        n_bins=n_bins, strategy=strategy),
+            inputs=[f'{VSD_TEST_RESULTS_ROOT}/**/*assay_images.csv'],
+            outputs=[f'{VSD_SOURCE_DATA_ROOT}/{n_bins}-bins-{strategy}-strategy/*'])
+      for n_bins, strategy in VSD_BINNINGS],
+    Stage('VSD-test-acc-v-r-coeff',
+          'experiment-2-VSD/generate_source_data_test_acc_v_r_coeff.py',
+          params=dict(source_data_root=VSD_SOURCE_DATA_ROOT),
+          inputs=[f'{VSD_SOURCE_DATA_ROOT}/8-bins-quantile-strategy/rm_corr.csv',
+                  f'{VSD_SOURCE_DATA_ROOT}/test_results_table_transfer.csv'],
+          outputs=[f'{VSD_SOURCE_DATA_ROOT}/acc_v_r_coeff.*']),
+    Stage('VSD-training-histories',
+          'experiment-2-VSD/generate_source_data_training_histories_csv.py',
+          params=dict(ckpt_root=VSD_CKPT_ROOT, source_data_root=VSD_SOURCE_DATA_ROOT),
+          inputs=[f'{VSD_CKPT_ROOT}/**/*tfevents*', f'{VSD_CKPT_ROOT}/**/*.metrics'],
+          outputs=[f'{VSD_SOURCE_DATA_ROOT}/training_history-*.csv'],
+          exclude=['*.csv']),
+    notebook_stage('experiment-2-VSD/test-results-fig.ipynb',
+                   [f'{VSD_SOURCE_DATA_ROOT}/all_test_results*.csv']),
+    *[notebook_stage(f'experiment-2-VSD/acc-VSD-corr-fig-{n_bins}-bins-{strategy}.ipynb',
+                     [f'{VSD_SOURCE_DATA_ROOT}/{n_bins}-bins-{strategy}-strategy/{csv_filename}'
+                      for csv_filename in ('acc.csv', 'rm_corr.csv')])
+      for n_bins, strategy in VSD_BINNINGS],
+    notebook_stage('experiment-2-VSD/test-acc-v-r-coeff-fig.ipynb',
+                   [f'{VSD_SOURCE_DATA_ROOT}/acc_v_r_coeff.csv']),
+    *[notebook_stage(f'experiment-2-VSD/training-histories-{net_name.replace("_", "-")}.ipynb',
+                     [f'{VSD_SOURCE_DATA_ROOT}/training_history-{net_name}-*.csv'])
+      for net_name in ['alexnet', 'VGG16', 'CORnet_Z', 'CORnet_S']],
+]
+
+
+def expand(root, patterns, exclude=()):
+    """find files that match glob patterns, relative to root
+
+    Returns
+    -------
+    paths : list
+        of str, paths relative to root, sorted
+    """
+    paths = set()
+    for pattern in patterns:
+        if GLOB_CHARS & set(pattern):
+            matches = root.glob(pattern)
+        else:
+            path = root.joinpath(pattern)
+            matches = path.rglob('*') if path.is_dir() else [path] if path.exists() else []
+        paths.update(os.path.relpath(match, root) for match in matches if match.is_file())
+    return sorted(path for path in paths
+                  if not any(fnmatchcase(Path(path).name, name_pattern) for name_pattern in exclude))
+
+
+def matches(pattern, other):
+    """True if any path could match both glob patterns, approximately:
+    either pattern matches the other as if it were a path"""
+    return fnmatchcase(pattern, other) or fnmatchcase(other, pattern)
+
+
+def get_dependencies(stages):
+    """map name of each stage to names of stages it depends on"""
+    for stage in stages:
+        for other in stages:
+            if other is not stage and other.name == stage.name:
+                raise ValueError(
+                    f'more than one stage named: {stage.name}'
+                )
+    return {
+        stage.name: {other.name for other in stages
+                     if other is not stage and any(matches(output, input_pattern)
+                                                   for output in other.outputs
+                                                   for input_pattern in stage.inputs)}
+        for stage in stages
+    }
+
+
+def select(stages, patterns):
+    """stages with names that match any of patterns, and all the stages they depend on, in order"""
+    dependencies = get_dependencies(stages)
+    selected = set()
+    to_visit = [stage.name for stage in stages if any(fnmatchcase(stage.name, pattern) for pattern in patterns)]
+    if not to_visit:
+        raise ValueError(
+            f'no stages match: {patterns}. Use --list to see names of stages'
+        )
+    while to_visit:
+        name = to_visit.pop()
+        if name not in selected:
+            selected.add(name)
+            to_visit.extend(dependencies[name])
+    return [stage for stage in stages if stage.name in selected]
+
+
+def topological_order(stages, dependencies):
+    order, done = [], set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if dependencies[stage.name] <= done]
+        if not ready:
+            raise ValueError(
+                f'stages have a cycle of dependencies: {[stage.name for stage in remaining]}'
+            )
+        order.extend(ready)
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+    return order
+
+
+class State:
+    """keys and output hashes of stages that ran, and cache of file hashes, saved in a .json file"""
+    def __init__(self, root):
+        self.root = root
+        self.path = root.joinpath(PIPELINE_DIR, STATE_JSON)
+        if self.path.exists():
+            state = json.loads(self.path.read_text())
+        else:
+            state = {}
+        self.files = state.get('files', {})
+        self.stages = state.get('stages', {})
+        self.lock = threading.Lock()
+
+    def file_hash(self, path):
+        """sha256 of file at path relative to root, cached by size and modification time"""
+        stat = self.root.joinpath(path).stat()
+        with self.lock:
+            cached = self.files.get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        sha = hashlib.sha256()
+        with self.root.joinpath(path).open('rb') as fp:
+            for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self.lock:
+            self.files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def key(self, stage):
+        """hash of stage's script or notebook, parameters, and contents of inputs"""
+        script_sha = hashlib.sha256(SCRIPTS_ROOT.joinpath(stage.script).read_bytes()).hexdigest()
+        inputs = {path: self.file_hash(path) for path in expand(self.root, stage.inputs, stage.exclude)}
+        to_hash = dict(script=script_sha, params=stage.param_strings(), inputs=inputs)
+        return hashlib.sha256(json.dumps(to_hash, sort_keys=True).encode()).hexdigest()
+
+    def output_hashes(self, stage):
+        return {path: self.file_hash(path) for path in expand(self.root, stage.outputs)}
+
+    def is_up_to_date(self, stage, key):
+        recorded = self.stages.get(stage.name)
+        return recorded is not None and recorded['key'] == key and recorded['outputs'] == self.output_hashes(stage)
+
+    def record(self, stage, key):
+        outputs = self.output_hashes(stage)
+        with self.lock:
+            self.stages[stage.name] = dict(key=key, outputs=outputs, time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.stem + '.tmp.json')
+        tmp_path.write_text(json.dumps(dict(files=self.files, stages=self.stages), indent=1))
+        os.replace(tmp_path, self.path)
+
+
+def run_stage(stage, state, force=False):
+    """run stage unless it is up to date
+
+    Returns
+    -------
+    status : str
+        one of {'ran', 'skipped', 'failed'}
+    elapsed : float
+        seconds spent checking and running stage
+    """
+    tic = time.perf_counter()
+    status = _run_stage(stage, state, force)
+    return status, time.perf_counter() - tic
+
+
+def _run_stage(stage, state, force):
+    key = state.key(stage)
+    if not force and state.is_up_to_date(stage, key):
+        return SKIPPED
+
+    log_path = state.root.joinpath(PIPELINE_DIR, 'logs', f'{stage.name}.log')
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open('w') as log:
+        log.write(' '.join(stage.command(state.root)) + '\n')
+        log.flush()
+        returncode = subprocess.run(stage.command(state.root), cwd=ROOT,
+                                    stdout=log, stderr=subprocess.STDOUT).returncode
+        if returncode != 0:
+            log.write(f'\nexited with status {returncode}\n')
+            return FAILED
+        missing = [pattern for pattern in stage.outputs if not expand(state.root, [pattern])]
+        if missing:
+            log.write(f'\ndid not write outputs: {missing}\n')
+            return FAILED
+    state.record(stage, key)
+    return RAN
+
+
+def run(stages, root, jobs, force=False):
+    """run stages, each as soon as the stages it depends on have finished
+
+    Returns
+    -------
+    statuses : dict
+        mapping name of each stage to one of {'ran', 'skipped', 'failed', 'blocked'}
+    """
+    dependencies = get_dependencies(stages)
+    state = State(root)
+    statuses = {}
+    pending = topological_order(stages, dependencies)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for stage in list(pending):
+                upstream = [statuses.get(name) for name in dependencies[stage.name]]
+                if any(status in (FAILED, BLOCKED) for status in upstream):
+                    statuses[stage.name] = BLOCKED
+                    print(f'{stage.name}: {BLOCKED}, an upstream stage failed')
+                    pending.remove(stage)
+                elif all(status in (RAN, SKIPPED) for status in upstream):
+                    running[executor.submit(run_stage, stage, state, force)] = stage
+                    pending.remove(stage)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    statuses[stage.name], elapsed = future.result()
+                except Exception as e:
+                    statuses[stage.name], elapsed = FAILED, 0.
+                    print(f'{stage.name}: raised {e!r}')
+                message = f'{stage.name}: {statuses[stage.name]} ({elapsed:.1f} s)'
+                if statuses[stage.name] == FAILED:
+                    message += f', see {root.joinpath(PIPELINE_DIR, "logs", stage.name + ".log")}'
+                print(message)
+    return statuses
+
+
+def dry_run(stages, root):
+    """print stages that would run, without running them.
+    Stages downstream of a stage that would run are listed too, since their inputs may change"""
+    dependencies = get_dependencies(stages)
+    state = State(root)
+    would_run = set()
+    for stage in topological_order(stages, dependencies):
+        if dependencies[stage.name] & would_run:
+            reason = 'upstream stage would run'
+        elif stage.name not in state.stages:
+            reason = 'never ran'
+        elif not state.is_up_to_date(stage, state.key(stage)):
+            reason = 'script, parameters, inputs, or outputs changed'
+        else:
+            print(f'{stage.name}: up to date')
+            continue
+        would_run.add(stage.name)
+        print(f'{stage.name}: would run, {reason}')
+    # save hashes of files, so they aren't computed again by the next run
+    with state.lock:
+        state.save()
+
+
+def main(stages=('*',),
+         root=ROOT,
+         jobs=None,
+         force=False,
+         dry=False,
+         list_stages=False):
+    """run pipeline
+
+    Parameters
+    ----------
+    stages : list
+        of str, glob patterns of names of stages to run. Stages that they depend on are also run.
+        Default is ('*',), all stages.
+    root : str, Path
+        root that paths of inputs and outputs are relative to, and where state is saved.
+        Default is the project root.
+    jobs : int
+        maximum number of stages that run at the same time. Default is None, the number of cpus.
+    force : bool
+        if True, run stages even if they are up to date. Default is False.
+    dry : bool
+        if True, only print which stages would run. Default is False.
+    list_stages : bool
+        if True, only print names of stages, the scripts they run, and the stages they depend on.
+        Default is False.
+    """
+    root = Path(root).resolve()
+    selected = select(STAGES, stages)
+    if list_stages:
+        dependencies = get_dependencies(selected)
+        for stage in selected:
+            depends_on = ', '.join(sorted(dependencies[stage.name])) or '-'
+            print(f'{stage.name}\n    {stage.script}\n    depends on: {depends_on}')
+        return
+    if dry:
+        dry_run(selected, root)
+        return
+
+    statuses = run(selected, root, jobs or os.cpu_count(), force)
+    counts = {status: sum(1 for val in statuses.values() if val == status)
+              for status in (RAN, SKIPPED, FAILED, BLOCKED)}
+    print(', '.join(f'{count} {status}' for status, count in counts.items()))
+    if counts[FAILED] > 0 or counts[BLOCKED] > 0:
+        sys.exit(1)
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--stages', default=['*'],
+                        help=('comma-separated list of glob patterns of names of stages to run, e.g. "VSD-*". '
+                              'Stages they depend on are also run. Default is all stages'),
+                        type=lambda stages: stages.split(','))
+    parser.add_argument('--root', default=ROOT,
+                        help='root that paths of inputs and outputs are relative to. Default is the project root')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='maximum number of stages that run at the same time. Default is number of cpus')
+    parser.add_argument('--force', action='store_true',
+                        help='run stages even if they are up to date')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='only print which stages would run')
+    parser.add_argument('--list', action='store_true',
+                        help='only print stages, the scripts they run, and the stages they depend on')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(stages=args.stages,
+         root=args.root,
+         jobs=args.jobs,
+         force=args.force,
+         dry=args.dry_run,
+         list_stages=args.list,
+         )
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""benchmark how fast each searchstims stim maker generates stimuli.
+
+For each stim maker, set size, window size, and background color, makes images the same way
+``searchstims.make.make`` does, half with target present and half with target absent, and measures separately:
+- render: drawing the stimulus with ``stim_maker.make_stim``
+- save: encoding the drawn surface as .png and writing it to disk, with ``pygame.image.save``, as ``make`` does.
+  The two are timed together since pygame 1.9 can only save images to a path, not to a file object.
+- write: writing the .meta.json file to disk
+along with images per second overall, and bytes per image (.png plus .meta.json).
+
+Stim makers are made with the same arguments as in searchstims_multiple_stims_script.py
+(black background) and searchstims_multiple_stims_white_background_script.py (white background).
+
+Results are appended to a .csv with the host, versions of searchstims and pygame, and git commit,
+so numbers can be tracked across revisions. After each run, images per second are compared
+with the previous run on the same host.
+"""
+from argparse import ArgumentParser
+import json
+import os
+from pathlib import Path
+import platform
+import socket
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyprojroot
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # no window needed, e.g. on nodes without a display
+import pygame  # noqa: E402
+import searchstims  # noqa: E402
+from searchstims.stim_makers import (RVvGVStimMaker, RVvRHGVStimMaker, Two_v_Five_StimMaker, TLStimMaker,  # noqa: E402
+                                     xoStimMaker, TStimMaker)
+
+ALEXNET_SIZE = (227, 227)
+VGG16_SIZE = (224, 224)
+BORDER_SIZE = (30, 30)
+GRID_SIZE = (5, 5)
+ITEM_BBOX_SIZE = (30, 30)
+JITTER = 12
+
+STIMULI = ['RVvGV', 'RVvRHGV', 'PWVvCV', 'PWVvPWHCV', '2_v_5', 'YT_v_BTYL',
+           'YT_v_BTBL', 'Bx_v_RxBo', 'Bx_v_RxRo', 'TvT']
+SET_SIZES = [1, 2, 4, 6, 8, 12, 18]
+WINDOW_SIZES = {'alexnet': ALEXNET_SIZE, 'VGG16': VGG16_SIZE}
+BACKGROUNDS = ['black', 'white']
+N_IMAGES = 20
+
+ROOT = pyprojroot.here()
+RESULTS_CSV = ROOT.joinpath('results', 'benchmarks', 'stim_makers.csv')
+KEY_COLS = ['stimulus', 'set_size', 'window_size', 'background']
+
+
+def get_stim_maker(stimulus, window_size, background):
+    """make stim maker with the same arguments as the scripts that generated the stimuli"""
+    kwargs = dict(window_size=window_size,
+                  border_size=BORDER_SIZE,
+                  grid_size=GRID_SIZE,
+                  item_bbox_size=ITEM_BBOX_SIZE,
+                  jitter=JITTER)
+    white = background == 'white'
+    if white:
+        kwargs['background_color'] = 'white'
+    if stimulus == 'RVvGV':
+        return RVvGVStimMaker(target_color='red', distractor_color='green', **kwargs)
+    elif stimulus == 'RVvRHGV':
+        return RVvRHGVStimMaker(target_color='red', distractor_color='green', **kwargs)
+    elif stimulus == 'PWVvCV':
+        return RVvGVStimMaker(target_color=(255, 239, 213), distractor_color=(255, 192, 203), **kwargs)
+    elif stimulus == 'PWVvPWHCV':
+        return RVvRHGVStimMaker(target_color=(255, 239, 213), distractor_color=(255, 192, 203), **kwargs)
+    elif stimulus == '2_v_5':
+        color = 'black' if white else 'white'
+        return Two_v_Five_StimMaker(target_color=color, distractor_color=color,
+                                    target_number=2, distractor_number=5, **kwargs)
+    elif stimulus == 'YT_v_BTYL':
+        return TLStimMaker(**kwargs)
+    elif stimulus == 'YT_v_BTBL':
+        return TLStimMaker(distractor_L_color=(100, 149, 237), **kwargs)
+    elif stimulus == 'Bx_v_RxBo':
+        return xoStimMaker(target_x_color='blue', distractor_x_color='red', distractor_o_color='blue', **kwargs)
+    elif stimulus == 'Bx_v_RxRo':
+        return xoStimMaker(target_x_color='blue', distractor_x_color='red', distractor_o_color='red', **kwargs)
+    elif stimulus == 'TvT':
+        if white:
+            return TStimMaker(target_color='black', distractor_color='black', **kwargs)
+        return TStimMaker(**kwargs)
+    else:
+        raise ValueError(
+            f'invalid stimulus: {stimulus}, must be one of: {STIMULI}'
+        )
+
+
+def measure(stim_maker, set_size, n_images, output_dir):
+    """make n_images stimuli with stim_maker, timing each stage
+
+    Returns
+    -------
+    result : dict
+        seconds spent in each stage, images per second, and mean bytes per image
+    """
+    render_sec = save_sec = write_sec = 0.
+    n_bytes = 0
+    for img_num in range(n_images):
+        tic = time.perf_counter()
+        rect_tuple = stim_maker.make_stim(set_size=set_size, num_target=img_num % 2)
+        toc = time.perf_counter()
+        render_sec += toc - tic
+
+        png_path = output_dir.joinpath(f'{img_num}.png')
+        pygame.image.save(rect_tuple.display_surface, str(png_path))
+        tic = time.perf_counter()
+        save_sec += tic - toc
+
+        meta = json.dumps({
+            'img_file': f'{img_num}.png',
+            'target_indices': rect_tuple.target_indices,
+            'distractor_indices': rect_tuple.distractor_indices,
+            'grid_as_char': rect_tuple.grid_as_char,
+        })
+        output_dir.joinpath(f'{img_num}.meta.json').write_text(meta)
+        write_sec += time.perf_counter() - tic
+        n_bytes += png_path.stat().st_size + len(meta.encode())
+
+    total_sec = render_sec + save_sec + write_sec
+    return dict(render_sec=render_sec / n_images,
+                save_sec=save_sec / n_images,
+                write_sec=write_sec / n_images,
+                images_per_sec=n_images / total_sec,
+                render_frac=render_sec / total_sec,
+                bytes_per_image=n_bytes / n_images)
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(host=socket.gethostname(),
+                python=platform.python_version(),
+                searchstims=searchstims.__version__,
+                pygame=pygame.version.ver,
+                commit=commit,
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def compare_with_previous(history, current):
+    """print images per second of current run relative to the previous run on the same host, by stimulus"""
+    previous = history[(history['host'] == current['host'].iloc[0]) & (history['time'] < current['time'].iloc[0])]
+    if len(previous) == 0:
+        return
+    previous = previous[previous['time'] == previous['time'].max()]
+    df = previous[KEY_COLS + ['images_per_sec']].merge(current[KEY_COLS + ['images_per_sec']],
+                                                       on=KEY_COLS, suffixes=('_previous', '_current'))
+    if len(df) == 0:
+        return
+    df['ratio'] = df['images_per_sec_current'] / df['images_per_sec_previous']
+    print(f'images per second relative to previous run on this host '
+          f'(commit {previous["commit"].iloc[0]}, {previous["time"].iloc[0]}), geometric mean by stimulus:')
+    print(df.groupby('stimulus')['ratio'].apply(lambda ratio: np.exp(np.log(ratio).mean())).to_string())
+
+
+def main(stimuli=STIMULI,
+         set_sizes=SET_SIZES,
+         window_sizes=tuple(WINDOW_SIZES),
+         backgrounds=BACKGROUNDS,
+         n_images=N_IMAGES,
+         results_csv=RESULTS_CSV):
+    """benchmark stim makers and append results to a .csv
+
+    Parameters
+    ----------
+    stimuli : list
+        of str, names of stim makers, as in the multiple stims scripts. Default is all 10.
+    set_sizes : list
+        of int. Default is [1, 2, 4, 6, 8, 12, 18].
+    window_sizes : list
+        of str, keys in WINDOW_SIZES: 'alexnet' for 227 x 227, 'VGG16' for 224 x 224. Default is both.
+    backgrounds : list
+        of str, 'black' and/or 'white'. Default is both.
+    n_images : int
+        number of images made for each combination, half with target present. Default is 20.
+    results_csv : str, Path
+        .csv that results are appended to. Default is results/benchmarks/stim_makers.csv.
+    """
+    results_csv = Path(results_csv)
+    metadata = get_metadata()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = Path(tmp_dir)
+        for stimulus in stimuli:
+            for window_size in window_sizes:
+                for background in backgrounds:
+                    stim_maker = get_stim_maker(stimulus, WINDOW_SIZES[window_size], background)
+                    for set_size in set_sizes:
+                        result = measure(stim_maker, set_size, n_images, output_dir)
+                        print(f'{stimulus}, set size {set_size}, {window_size} window, {background} background: '
+                              f'{result["images_per_sec"]:.1f} images/s, '
+                              f'{100 * result["render_frac"]:.0f}% render, '
+                              f'{result["bytes_per_image"] / 1024:.1f} kB/image')
+                        rows.append(dict(stimulus=stimulus, set_size=set_size, window_size=window_size,
+                                         background=background, **result))
+
+    current = pd.DataFrame.from_records(rows).assign(**metadata)
+    if results_csv.exists():
+        history = pd.read_csv(results_csv)
+        compare_with_previous(history, current)
+        history = pd.concat([history, current], ignore_index=True)
+    else:
+        results_csv.parent.mkdir(parents=True, exist_ok=True)
+        history = current
+    history.to_csv(results_csv, index=False)
+    print(f'appended results to {results_csv}')
+
+    summary = current.groupby('stimulus')[['images_per_sec', 'render_frac', 'bytes_per_image']].mean()
+    print(summary.sort_values('images_per_sec').to_string(float_format='%.2f'))
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--stimuli', default=STIMULI,
+                        help='comma-separated list of stim makers',
+                        type=lambda stimuli: stimuli.split(','))
+    parser.add_argument('--set_sizes', default=SET_SIZES,
+                        help='comma-separated list of set sizes',
+                        type=lambda set_sizes: [int(set_size) for set_size in set_sizes.split(',')])
+    parser.add_argument('--window_sizes', default=list(WINDOW_SIZES),
+                        help='comma-separated list of window sizes, "alexnet" (227 x 227) and/or "VGG16" (224 x 224)',
+                        type=lambda window_sizes: window_sizes.split(','))
+    parser.add_argument('--backgrounds', default=BACKGROUNDS,
+                        help='comma-separated list of background colors, "black" and/or "white"',
+                        type=lambda backgrounds: backgrounds.split(','))
+    parser.add_argument('--n_images', type=int, default=N_IMAGES,
+                        help='number of images made for each combination')
+    parser.add_argument('--results_csv', default=RESULTS_CSV,
+                        help='.csv that results are appended to')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(stimuli=args.stimuli,
+         set_sizes=args.set_sizes,
+         window_sizes=args.window_sizes,
+         backgrounds=args.backgrounds,
+         n_images=args.n_images,
+         results_csv=args.results_csv,
+         )
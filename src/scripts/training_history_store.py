@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""consolidated store of training histories, with downsampled versions for plotting.
+
+The training history scripts save .csv files with every step of every replicate.
+This script consolidates them into a store partitioned by net name, method, mode, loss function, and replicate:
+
+    store_root/
+        index.csv
+        {net_name}/{method}/{mode}/{loss_func}/replicate_{replicate}.npz
+
+Each .npz file holds each metric (e.g. 'loss/train', 'acc/val') at full resolution (level 0),
+and at coarser levels, where level k keeps the minimum and maximum of each bucket of FACTOR ** k steps,
+so that downsampled curves keep their extremes (e.g. spikes in the loss).
+Use ``load`` to get training histories at the resolution a plot needs, e.g. in a notebook:
+
+    import training_history_store
+    df = training_history_store.load(store_root, max_points=1000, net_name='alexnet', method='transfer')
+
+which returns a DataFrame with the same columns as the training history .csv files.
+"""
+from argparse import ArgumentParser
+import os
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+PARTITION_COLS = ['net_name', 'method', 'mode', 'loss_func', 'replicate']
+NON_METRIC_COLS = PARTITION_COLS + ['step']
+
+FACTOR = 4  # each level has buckets FACTOR times wider than the last
+MIN_POINTS = 128  # don't make levels with fewer points than this
+
+# searchstims training histories don't have a 'loss_func' column, all nets were trained with cross-entropy
+DEFAULT_LOSS_FUNC = 'CE'
+
+
+def minmax_downsample(steps, values, bucket_size):
+    """downsample a series by keeping the points with the minimum and maximum value in each bucket
+
+    Returns
+    -------
+    steps, values : numpy.ndarray
+        at most 2 points per bucket, in order of step
+    """
+    n_buckets = int(np.ceil(values.shape[0] / bucket_size))
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:values.shape[0]] = values
+    padded = padded.reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets)[:, np.newaxis] * bucket_size
+    inds = np.sort(
+        np.stack([np.nanargmin(padded, axis=1), np.nanargmax(padded, axis=1)], axis=1) + offsets,
+        axis=1,
+    ).ravel()
+    inds = inds[np.concatenate(([True], np.diff(inds) > 0))]  # drop duplicate when min and max are the same point
+    return steps[inds], values[inds]
+
+
+def npz_key(metric, level, field):
+    return f'{quote(metric, safe="")}.{level}.{field}'
+
+
+def save_partition(df, path):
+    """save training history of one replicate, with every level of downsampling
+
+    Returns
+    -------
+    n_points : int
+        largest number of points of any metric at full resolution
+    """
+    arrays = {}
+    n_points = 0
+    metrics = [col for col in df.columns if col not in NON_METRIC_COLS]
+    for metric in metrics:
+        series = df[['step', metric]].dropna().sort_values('step')
+        steps, values = series['step'].values.astype(np.int64), series[metric].values.astype(np.float64)
+        n_points = max(n_points, steps.shape[0])
+        arrays[npz_key(metric, 0, 'step')], arrays[npz_key(metric, 0, 'value')] = steps, values
+        n_points_by_level = [steps.shape[0]]
+        level = 1
+        while values.shape[0] / FACTOR ** level >= MIN_POINTS / 2:
+            (arrays[npz_key(metric, level, 'step')],
+             arrays[npz_key(metric, level, 'value')]) = minmax_downsample(steps, values, FACTOR ** level)
+            n_points_by_level.append(arrays[npz_key(metric, level, 'step')].shape[0])
+            level += 1
+        # so ``load`` can choose a level without reading them
+        arrays[npz_key(metric, 'all', 'n_points')] = np.array(n_points_by_level)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent.joinpath(path.stem + '.tmp.npz')
+    np.savez(tmp_path, metrics=np.array(metrics, dtype=str), **arrays)
+    os.replace(tmp_path, path)
+    return n_points
+
+
+def main(csv_paths, store_root):
+    """build store from training history .csv files saved by the training history scripts
+
+    Parameters
+    ----------
+    csv_paths : list
+        of paths to .csv files
+    store_root : str, Path
+        path to root of store. Partitions already in the store are replaced by partitions in the .csv files.
+    """
+    store_root = Path(store_root)
+    index_path = store_root.joinpath('index.csv')
+    if index_path.exists():
+        index = pd.read_csv(index_path).set_index(PARTITION_COLS)
+    else:
+        index = None
+
+    rows = []
+    for csv_path in csv_paths:
+        print(f'adding training histories from: {csv_path}')
+        with instrumentation.stage('load') as load:
+            df = pd.read_csv(load.read(csv_path))
+            load.rows_out = len(df)
+        if 'loss_func' not in df.columns:
+            df['loss_func'] = DEFAULT_LOSS_FUNC
+        with instrumentation.stage('groupby', rows_in=len(df)) as groupby:
+            for key, df_partition in df.groupby(PARTITION_COLS):
+                path = store_root.joinpath(*[str(val) for val in key[:-1]], f'replicate_{key[-1]}.npz')
+                with instrumentation.stage('write', rows_in=len(df_partition)) as write:
+                    n_points = save_partition(df_partition, path)
+                    write.rows_out = n_points
+                rows.append(dict(zip(PARTITION_COLS, key), path=str(path.relative_to(store_root)), n_points=n_points))
+            groupby.rows_out = len(rows)
+
+    with instrumentation.stage('write', rows_in=len(rows)):
+        new_index = pd.DataFrame.from_records(rows).set_index(PARTITION_COLS)
+        if index is not None:
+            new_index = pd.concat([index[~index.index.isin(new_index.index)], new_index])
+        tmp_path = store_root.joinpath('index.tmp.csv')
+        new_index.sort_index().reset_index().to_csv(tmp_path, index=False)
+        os.replace(tmp_path, index_path)
+    print(f'store in {store_root} has {len(new_index)} training histories')
+
+
+def load(store_root, max_points=None, metrics=None, **filters):
+    """load training histories from store
+
+    Parameters
+    ----------
+    store_root : str, Path
+        path to root of store
+    max_points : int
+        maximum number of points per metric per replicate.
+        For each, the finest level with at most max_points is loaded.
+        Default is None, in which case the full resolution is loaded.
+    metrics : list
+        of str, metrics to load, e.g. ['loss/train', 'acc/val']. Default is None, in which case all are loaded.
+    filters
+        partition columns and the value or list of values to select,
+        e.g. ``net_name='alexnet', method=['transfer', 'initialize']``
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        with columns 'step', one for each metric, and the partition columns,
+        like the training history .csv files
+    """
+    store_root = Path(store_root)
+    index = pd.read_csv(store_root.joinpath('index.csv'))
+    for col, val in filters.items():
+        if col not in PARTITION_COLS:
+            raise ValueError(
+                f'invalid filter: {col}, must be one of: {PARTITION_COLS}'
+            )
+        index = index[index[col].isin(val if isinstance(val, (list, tuple, set)) else [val])]
+
+    dfs = []
+    for row in index.itertuples(index=False):
+        with np.load(store_root.joinpath(row.path)) as npz:
+            metrics_this_partition = [str(metric) for metric in npz['metrics']]
+            series = []
+            for metric in metrics_this_partition:
+                if metrics is not None and metric not in metrics:
+                    continue
+                n_points = npz[npz_key(metric, 'all', 'n_points')]
+                if max_points is None or n_points[-1] > max_points:
+                    level = 0 if max_points is None else n_points.shape[0] - 1
+                else:
+                    level = int(np.argmax(n_points <= max_points))
+                series.append(pd.Series(npz[npz_key(metric, level, 'value')],
+                                        index=pd.Index(npz[npz_key(metric, level, 'step')], name='step'),
+                                        name=metric))
+        if not series:
+            continue
+        df = pd.concat(series, axis=1).sort_index().reset_index()
+        for col in PARTITION_COLS:
+            df[col] = getattr(row, col)
+        dfs.append(df)
+
+    if not dfs:
+        return pd.DataFrame(columns=['step'] + PARTITION_COLS)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('store_root',
+                        help='path to root of training history store, e.g. results/VSD/source_data/history_store')
+    parser.add_argument('csv_paths', nargs='+',
+                        help='paths to training history .csv files to add to store')
+    instrumentation.add_arguments(parser)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumentation.profiled(__file__, args.profile_dir, args.hot_stages, args.profiler):
+        main(csv_paths=args.csv_paths,
+             store_root=args.store_root,
+             )
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""watch results while training and testing jobs run, and rebuild the source data made from them.
+
+Watches the directories that the stages in pipeline.py read from, e.g. results/VSD/checkpoints,
+results/VSD/test_results, and results/searchstims/results_gz/3stims, for new, changed, or deleted files
+that are inputs of a stage: events and .metrics files written during training,
+and results.gz, test_results.csv, and assay_images.csv files written by testing.
+Changes are debounced: stages are rebuilt once no input has changed for ``debounce`` seconds,
+or ``max_delay`` seconds after the first change, so that events files that are written continuously
+during training still trigger rebuilds. Only stages that read a changed file are rebuilt,
+along with stages downstream of them, and stages are still skipped by the pipeline if their inputs
+have the same contents. By default only stages that run scripts are rebuilt, not notebooks that make figures.
+
+On Linux, changes are detected with inotify. Elsewhere, or with ``--poll``,
+the directories are scanned every ``poll_interval`` seconds instead, which also works for shared filesystems
+where inotify does not see files written by other nodes (e.g. NFS).
+
+To try it locally, make a synthetic results tree and write files into it while watching:
+
+    python src/scripts/make_synthetic_results.py /tmp/tree/results/VSD VSD --n_replicates 2
+    mkdir /tmp/tree/results/VSD/source_data
+    python src/scripts/watch.py --root /tmp/tree --stages 'VSD-*'
+    # in another shell
+    touch /tmp/tree/results/VSD/test_results/*/test_results.csv
+"""
+from argparse import ArgumentParser
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import time
+
+import pipeline
+
+DEBOUNCE = 5.
+MAX_DELAY = 60.
+POLL_INTERVAL = 10.
+
+# from sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_STRUCT = struct.Struct('iIII')  # wd, mask, cookie, len, followed by name
+
+
+def watch_roots(stages, root):
+    """directories to watch: the part of each glob pattern of the stages' inputs before the first wildcard.
+    Inputs without wildcards, like split .csv files, are not watched"""
+    roots = set()
+    for stage in stages:
+        for pattern in stage.inputs:
+            parts = Path(pattern).parts
+            wildcard_ind = [ind for ind, part in enumerate(parts) if pipeline.GLOB_CHARS & set(part)]
+            if wildcard_ind:
+                roots.add(root.joinpath(*parts[:wildcard_ind[0]]).resolve())
+    # drop roots inside other roots, they are watched already
+    return sorted(path for path in roots if not any(other in path.parents for other in roots))
+
+
+def walk_files(directory):
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            yield Path(dirpath).joinpath(filename)
+
+
+class InotifyWatcher:
+    """watches roots and all directories in them for changes to files with inotify.
+
+    Roots that don't exist yet are watched for from their nearest parent that exists,
+    and directories made inside roots are watched as they are made.
+    """
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'could not initialize inotify')
+        self.roots = list(roots)
+        self.dirs = {}  # watch descriptor -> directory
+        self.overflowed = False
+        for root in self.roots:
+            self.add_root(root)
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'could not watch directory: {directory}')
+        self.dirs[wd] = directory
+
+    def add_tree(self, directory):
+        """watch directory and all directories in it, and return files already in them"""
+        files = []
+        for dirpath, _, filenames in os.walk(directory):
+            self.add_watch(Path(dirpath))
+            files.extend(Path(dirpath).joinpath(filename) for filename in filenames)
+        return files
+
+    def add_root(self, root):
+        """watch root if it exists, otherwise its nearest parent that exists, and return files in root"""
+        path = root
+        while not path.exists():
+            path = path.parent
+        if path == root:
+            return self.add_tree(root)
+        self.add_watch(path)
+        return []
+
+    def on_new_dir(self, directory):
+        """start watching directory made inside a root, or a parent of a root, and return files in it"""
+        if any(root == directory or root in directory.parents for root in self.roots):
+            return self.add_tree(directory)
+        files = []
+        for root in self.roots:
+            if directory in root.parents:
+                files.extend(self.add_root(root))
+        return files
+
+    def read(self, timeout=None):
+        """wait up to timeout seconds for changes, or forever if timeout is None
+
+        Returns
+        -------
+        changed : set
+            of Paths to files that were written, moved, or deleted
+        """
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        try:
+            buffer = os.read(self.fd, 2 ** 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = EVENT_STRUCT.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_STRUCT.size:offset + EVENT_STRUCT.size + name_len].rstrip(b'\0')
+            offset += EVENT_STRUCT.size + name_len
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, caller should rebuild everything
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs or not name:
+                continue
+            path = self.dirs[wd].joinpath(os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files can be written before the watch is added, so count them as changed
+                    changed.update(self.on_new_dir(path))
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """watches roots for changes to files, by comparing sizes and modification times of all files
+    every ``interval`` seconds"""
+    def __init__(self, roots, interval=POLL_INTERVAL):
+        self.roots = list(roots)
+        self.interval = interval
+        self.overflowed = False
+        self.snapshot = self.scan()
+        self.last_scan = time.monotonic()
+
+    def scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for path in walk_files(root):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:  # deleted while scanning
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout=None):
+        """wait up to timeout seconds for changes, or until the next scan if timeout is None
+
+        Returns
+        -------
+        changed : set
+            of Paths to files that were added, changed, or deleted
+        """
+        next_scan = self.last_scan + self.interval
+        wait_sec = next_scan - time.monotonic()
+        if timeout is not None:
+            wait_sec = min(wait_sec, timeout)
+        time.sleep(max(wait_sec, 0.))
+        if time.monotonic() < next_scan:
+            return set()
+        snapshot = self.scan()
+        self.last_scan = time.monotonic()
+        changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                   if snapshot.get(path) != self.snapshot.get(path)}
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def get_watcher(roots, poll=False, poll_interval=POLL_INTERVAL):
+    """get inotify watcher, or polling watcher if poll is True or inotify is not available"""
+    if not poll:
+        try:
+            return InotifyWatcher(roots)
+        except (AttributeError, OSError) as e:  # AttributeError: no inotify functions in libc, e.g. on macOS
+            print(f'inotify not available ({e}), polling every {poll_interval} s instead')
+    return PollingWatcher(roots, poll_interval)
+
+
+def affected_stages(stages, changed, root):
+    """names of stages that read any of the changed files"""
+    names = set()
+    for path in changed:
+        rel_path = os.path.relpath(path, root)
+        if rel_path.startswith('..'):
+            continue
+        names.update(stage.name for stage in stages if stage.reads(rel_path))
+    return names
+
+
+def downstream(stages, names):
+    """stages with names in names, and all the stages that depend on them, in order"""
+    dependencies = pipeline.get_dependencies(stages)
+    to_run = set(names)
+    n_to_run = 0
+    while len(to_run) != n_to_run:
+        n_to_run = len(to_run)
+        to_run.update(name for name, depends_on in dependencies.items() if depends_on & to_run)
+    return [stage for stage in stages if stage.name in to_run]
+
+
+def print_counts(statuses):
+    statuses = list(statuses.values())
+    print(', '.join(f'{statuses.count(status)} {status}'
+                    for status in (pipeline.RAN, pipeline.SKIPPED, pipeline.FAILED, pipeline.BLOCKED)))
+
+
+def watch(stages, root, watcher, debounce=DEBOUNCE, max_delay=MAX_DELAY, jobs=None, max_rebuilds=None):
+    """watch for changes to inputs of stages and rebuild the affected stages
+
+    Parameters
+    ----------
+    stages : list
+        of pipeline.Stage
+    root : Path
+        root that paths of inputs and outputs are relative to
+    watcher : InotifyWatcher, PollingWatcher
+        watching the roots that stages read from
+    debounce : float
+        seconds without changes to inputs before rebuilding. Default is 5.
+    max_delay : float
+        maximum seconds between the first change and rebuilding, even if inputs are still changing.
+        Default is 60.
+    jobs : int
+        maximum number of stages that run at the same time. Default is None, the number of cpus.
+    max_rebuilds : int
+        stop after this many rebuilds. Default is None, watch until interrupted.
+
+    Returns
+    -------
+    n_rebuilds : int
+        number of rebuilds
+    """
+    pending, changed_paths = set(), set()
+    first_change = last_change = None
+    n_rebuilds = 0
+    while max_rebuilds is None or n_rebuilds < max_rebuilds:
+        if pending:
+            timeout = max(min(last_change + debounce, first_change + max_delay) - time.monotonic(), 0.)
+        else:
+            timeout = None
+        changed = watcher.read(timeout)
+        names = affected_stages(stages, changed, root)
+        if watcher.overflowed:
+            print('missed some changes, rebuilding all stages')
+            names = {stage.name for stage in stages}
+            watcher.overflowed = False
+        if names:
+            now = time.monotonic()
+            if not pending:
+                first_change = now
+            last_change = now
+            pending.update(names)
+            changed_paths.update(changed)
+
+        if pending and time.monotonic() >= min(last_change + debounce, first_change + max_delay):
+            to_run = downstream(stages, pending)
+            print(f'{time.strftime("%H:%M:%S")}: {len(changed_paths)} files changed, '
+                  f'rebuilding: {", ".join(stage.name for stage in to_run)}')
+            print_counts(pipeline.run(to_run, root, jobs or os.cpu_count()))
+            pending, changed_paths = set(), set()
+            n_rebuilds += 1
+    return n_rebuilds
+
+
+def main(stages=None,
+         root=pipeline.ROOT,
+         poll=False,
+         poll_interval=POLL_INTERVAL,
+         debounce=DEBOUNCE,
+         max_delay=MAX_DELAY,
+         jobs=None,
+         max_rebuilds=None):
+    """build stages of pipeline once, then watch their inputs and rebuild them when they change
+
+    Parameters
+    ----------
+    stages : list
+        of str, glob patterns of names of stages in pipeline.py to rebuild. Stages they depend on are also rebuilt.
+        Default is None, in which case all stages that run scripts are rebuilt, but not notebooks.
+    root : str, Path
+        root that paths of inputs and outputs are relative to. Default is the project root.
+    poll : bool
+        if True, scan for changes instead of using inotify. Default is False.
+    poll_interval : float
+        seconds between scans when polling. Default is 10.
+    debounce : float
+        seconds without changes to inputs before rebuilding. Default is 5.
+    max_delay : float
+        maximum seconds between the first change and rebuilding. Default is 60.
+    jobs : int
+        maximum number of stages that run at the same time. Default is None, the number of cpus.
+    max_rebuilds : int
+        stop after this many rebuilds, not counting the first build. Default is None, watch until interrupted.
+    """
+    root = Path(root).resolve()
+    if stages is None:
+        selected = [stage for stage in pipeline.STAGES if not stage.is_notebook]
+    else:
+        selected = pipeline.select(pipeline.STAGES, stages)
+
+    roots = watch_roots(selected, root)
+    # start watching before the first build, so changes made while it runs aren't missed
+    watcher = get_watcher(roots, poll, poll_interval)
+    print(f'watching {len(roots)} directories with {type(watcher).__name__}:')
+    for watch_root in roots:
+        print(f'    {watch_root}' + ('' if watch_root.exists() else ' (does not exist yet)'))
+    try:
+        print('building stages that are out of date')
+        print_counts(pipeline.run(selected, root, jobs or os.cpu_count()))
+        watch(selected, root, watcher, debounce, max_delay, jobs, max_rebuilds)
+    except KeyboardInterrupt:
+        print('stopped watching')
+    finally:
+        watcher.close()
+
+
+def get_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--stages', default=None,
+                        help=('comma-separated list of glob patterns of names of stages in pipeline.py to rebuild, '
+                              'e.g. "VSD-*". Default is all stages that run scripts'),
+                        type=lambda stages: stages.split(','))
+    parser.add_argument('--root', default=pipeline.ROOT,
+                        help='root that paths of inputs and outputs are relative to. Default is the project root')
+    parser.add_argument('--poll', action='store_true',
+                        help='scan for changes instead of using inotify, e.g. on shared filesystems')
+    parser.add_argument('--poll_interval', type=float, default=POLL_INTERVAL,
+                        help='seconds between scans when polling')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help='seconds without changes to inputs before rebuilding')
+    parser.add_argument('--max_delay', type=float, default=MAX_DELAY,
+                        help='maximum seconds between first change to inputs and rebuilding')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='maximum number of stages that run at the same time. Default is number of cpus')
+    parser.add_argument('--max_rebuilds', type=int, default=None,
+                        help='stop after this many rebuilds. Default is to watch until interrupted')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    main(stages=args.stages,
+         root=args.root,
+         poll=args.poll,
+         poll_interval=args.poll_interval,
+         debounce=args.debounce,
+         max_delay=args.max_delay,
+         jobs=args.jobs,
+         max_rebuilds=args.max_rebuilds,
+         )